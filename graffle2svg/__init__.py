@@ -6,4 +6,8 @@
 #
 # SPDX-License-Identifier: BSD-3-Clause
 
-__all__ = [ 'main' ]
+__all__ = [ 'main', 'convert' ]
+
+__version__ = '0.4'
+
+from .api import convert
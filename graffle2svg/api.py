@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2023 Robin Vobruba <hoijui.quaero@gmail.com>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""Converting graffle documents in process
+
+	>>> import graffle2svg
+	>>> svg = graffle2svg.convert("diagram.graffle", page=1)
+	>>> pages = graffle2svg.convert(open("diagram.graffle", "rb"), all_pages=True)
+	>>> graffle2svg.convert(data, out=response, stream=True)
+"""
+
+import io
+import os
+
+from .main import GraffleParser, GraffleInterpreter, createTarget
+
+def openSource(source):
+	"""What GraffleParser.walkGraffleFile takes, for bytes, a path or a
+	   binary file object"""
+	if isinstance(source, (bytes, bytearray, memoryview)):
+		return io.BytesIO(source)
+	if isinstance(source, os.PathLike):
+		return os.fspath(source)
+	return source
+
+def convert(source, page=0, area=None, all_pages=False, multi_page=False, out=None,
+			cache=None, **target_opts):
+	"""Convert a graffle document to SVG.
+
+	   source     -- the document, as bytes, a path (of a file or of a
+	                 graffle package) or a binary file object
+	   page       -- the page to convert, for multi-page documents
+	   area       -- only draw what lies in ((x1, y1), (x2, y2))
+	   all_pages  -- convert every page, into a list of documents
+	   multi_page -- convert every page into a single document
+	   out        -- a binary file object to write the SVG to, instead of
+	                 returning it; not with all_pages
+	   cache      -- a cache.DocumentCache of parsed documents
+
+	   The other keyword arguments are those of createTarget, e.g.
+	   stream=True to write the SVG to out while it is converted, or
+	   compress_level for svgz. Returns the SVG as bytes, a list of them
+	   with all_pages, or None when writing to out."""
+	if all_pages and out is not None:
+		raise ValueError("all_pages gives one document per page, they can not go to one out file")
+	gi = GraffleInterpreter()
+	gi.setTarget(createTarget(target_opts))
+	lazy = not (all_pages or multi_page)
+	gi.dict = GraffleParser(cache).walkGraffleFile(openSource(source), lazy=lazy)
+	if all_pages:
+		# documents without sheets are a single page
+		return [writeSvg(gi, page, None) for page in range(max(1, gi.getNumPages()))]
+	if multi_page:
+		page = None
+	return writeSvg(gi, page, area, out)
+
+def writeSvg(interpreter, page, area, out=None):
+	"""Convert page, or with page None all pages as one document, into
+	   out, or into the bytes returned"""
+	fp = io.BytesIO() if out is None else out
+	if page is None:
+		interpreter.writeDocument(fp)
+	else:
+		interpreter.writePage(fp, page=page, bounding_box=area)
+	if out is None:
+		return fp.getvalue()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2023 Robin Vobruba <hoijui.quaero@gmail.com>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""Converting whole trees of graffle files, skipping unchanged ones"""
+
+import glob
+import hashlib
+import json
+import os
+import traceback
+
+from . import __version__
+from .jobs import getContext, writePageFile
+from .main import GraffleParser, GraffleInterpreter, createTarget
+
+MANIFEST_NAME = ".graffle2svg-manifest.json"
+SUFFIX = ".graffle"
+
+def isGraffle(path):
+	"""Graffle files, and graffle packages, which are directories"""
+	return path.lower().endswith(SUFFIX)
+
+def findInputs(sources):
+	"""Yield (path, relative path) of the graffle files in sources, which
+	   are directories, files or glob patterns. The relative path is where
+	   the file is below its source, and is used to mirror the tree."""
+	for source in sources:
+		if os.path.isdir(source) and not isGraffle(source):
+			for (dirpath, dirnames, filenames) in os.walk(source):
+				# packages are inputs, not directories to walk into
+				for name in sorted(dirnames):
+					if isGraffle(name):
+						path = os.path.join(dirpath, name)
+						yield (path, os.path.relpath(path, source))
+				dirnames[:] = sorted(name for name in dirnames if not isGraffle(name))
+				for name in sorted(filenames):
+					if isGraffle(name):
+						path = os.path.join(dirpath, name)
+						yield (path, os.path.relpath(path, source))
+		elif glob.has_magic(source):
+			base = globBase(source)
+			for path in sorted(glob.glob(source, recursive=True)):
+				# like the walk, only graffle files and packages
+				if isGraffle(path.rstrip(os.sep)):
+					yield (path, os.path.relpath(path, base))
+		else:
+			yield (source, os.path.basename(source.rstrip(os.sep)))
+
+def globBase(pattern):
+	"""The directory part of pattern before the first wildcard"""
+	parts = []
+	for part in pattern.split(os.sep):
+		if glob.has_magic(part):
+			break
+		parts.append(part)
+	return os.sep.join(parts) or os.curdir
+
+def fileStamp(path):
+	"""(mtime, size), to tell without reading it that a file is unchanged"""
+	if os.path.isdir(path):
+		path = os.path.join(path, "data.plist")
+	st = os.stat(path)
+	return [st.st_mtime_ns, st.st_size]
+
+def fileHash(path):
+	if os.path.isdir(path):
+		path = os.path.join(path, "data.plist")
+	digest = hashlib.sha256()
+	with open(path, "rb") as fp:
+		for block in iter(lambda: fp.read(1024 * 1024), b""):
+			digest.update(block)
+	return digest.hexdigest()
+
+def outputNames(out_base, num_pages, all_pages, suffix=".svg", multi_page=False):
+	"""(page, output file) pairs, the page None for a multi_page document"""
+	if multi_page:
+		return [(None, out_base + suffix)]
+	if not all_pages:
+		return [(0, out_base + suffix)]
+	return [(page, "%s-%d%s" % (out_base, page, suffix)) for page in range(num_pages)]
+
+def convertFile(job):
+	"""Convert one input, and return (relative path, outputs, error or None)"""
+	(path, rel, out_base, all_pages, multi_page, target_opts) = job
+	outputs = []
+	try:
+		gi = GraffleInterpreter()
+		gi.setTarget(createTarget(target_opts))
+		gi.dict = GraffleParser().walkGraffleFile(path, lazy=not (all_pages or multi_page))
+		out_dir = os.path.dirname(out_base)
+		if out_dir:
+			os.makedirs(out_dir, exist_ok=True)
+		# documents without sheets are a single page
+		num_pages = max(1, gi.getNumPages())
+		suffix = ".svg" if target_opts.get("compress_level") is None else ".svgz"
+		for (page, out_file) in outputNames(out_base, num_pages, all_pages, suffix, multi_page):
+			writePageFile(gi, page, out_file)
+			outputs.append(out_file)
+	except Exception:
+		return (rel, outputs, traceback.format_exc())
+	return (rel, outputs, None)
+
+class BatchConverter(object):
+	"""Mirrors a tree of graffle files into out_dir as SVG files.
+
+	   A manifest in out_dir remembers the content hash of every converted
+	   input, and inputs which did not change since, for the same version
+	   and options, are skipped. With multi_page all pages of an input go
+	   into one SVG file. target_opts are the keyword arguments of
+	   createTarget."""
+
+	def __init__(self, out_dir, all_pages=False, jobs=1, force=False, target_opts=None,
+				 multi_page=False):
+		self.out_dir = out_dir
+		self.all_pages = bool(all_pages)
+		self.multi_page = bool(multi_page)
+		self.target_opts = target_opts or {}
+		self.jobs = jobs
+		self.force = force
+		self.converted = 0
+		self.skipped = 0
+		self.failed = 0
+		self.manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+
+	@property
+	def signature(self):
+		"""What the outputs depend on besides the inputs"""
+		return "%s all_pages=%s multi_page=%s target=%r" % (
+			__version__, self.all_pages, self.multi_page, sorted(self.target_opts.items()))
+
+	def loadManifest(self):
+		try:
+			with open(self.manifest_path, "r", encoding="utf-8") as fp:
+				manifest = json.load(fp)
+		except (OSError, ValueError):
+			return {}
+		if manifest.get("signature") != self.signature:
+			return {}
+		return manifest.get("entries", {})
+
+	def saveManifest(self, entries):
+		tmp_path = self.manifest_path + ".tmp"
+		with open(tmp_path, "w", encoding="utf-8") as fp:
+			json.dump({"signature": self.signature, "entries": entries}, fp,
+					  indent=1, sort_keys=True)
+		os.replace(tmp_path, self.manifest_path)
+
+	def isUpToDate(self, entry, path, stamp):
+		"""Whether entry describes the current content of path. The file
+		   is only hashed if its stamp changed."""
+		if entry is None or not entry.get("outputs") \
+				or not all(os.path.exists(f) for f in entry["outputs"]):
+			return False
+		if entry["stamp"] != stamp:
+			digest = fileHash(path)
+			if entry["hash"] != digest:
+				return False
+			entry["stamp"] = stamp
+		return True
+
+	def run(self, sources):
+		"""Convert sources, and yield (relative path, outputs, error)
+		   for every input which had to be converted"""
+		os.makedirs(self.out_dir, exist_ok=True)
+		old_entries = {}
+		if not self.force:
+			old_entries = self.loadManifest()
+		# inputs which are not among sources this time stay known
+		entries = dict(old_entries)
+		# rel -> the entry of an input to convert
+		pending = {}
+		todo = []
+		try:
+			for (path, rel) in findInputs(sources):
+				# only recorded as converted once it is, an interrupted
+				# run leaves it to convert
+				entries.pop(rel, None)
+				try:
+					stamp = fileStamp(path)
+					entry = old_entries.get(rel)
+					if self.isUpToDate(entry, path, stamp):
+						entries[rel] = entry
+						self.skipped += 1
+						continue
+					pending[rel] = {"stamp": stamp, "hash": fileHash(path)}
+				except OSError as e:
+					# missing or unreadable, the others are still converted
+					yield self.fail(entries, rel, [], "%s\n" % e)
+					continue
+				out_base = os.path.join(self.out_dir, os.path.splitext(rel)[0])
+				todo.append((path, rel, out_base, self.all_pages, self.multi_page, self.target_opts))
+
+			for (rel, outputs, error) in self.convertAll(todo):
+				if error is None:
+					entries[rel] = dict(pending[rel], outputs=outputs)
+					self.converted += 1
+					yield (rel, outputs, error)
+				else:
+					yield self.fail(entries, rel, outputs, error)
+		finally:
+			self.saveManifest(entries)
+
+	def fail(self, entries, rel, outputs, error):
+		"""Record that rel failed, it is tried again next time"""
+		entries[rel] = {"error": (error.strip().splitlines() or [""])[-1]}
+		self.failed += 1
+		return (rel, outputs, error)
+
+	def convertAll(self, todo):
+		jobs = min(self.jobs, len(todo))
+		if jobs <= 1:
+			for job in todo:
+				yield convertFile(job)
+			return
+		pool = getContext().Pool(jobs)
+		try:
+			for result in pool.imap_unordered(convertFile, todo):
+				yield result
+		finally:
+			pool.terminate()
+			pool.join()
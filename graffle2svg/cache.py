@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2023 Robin Vobruba <hoijui.quaero@gmail.com>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""On-disk cache of parsed graffle documents"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+# bump this whenever the parsed representation changes
+CACHE_VERSION = 1
+
+class DocumentCache(object):
+	"""Keeps parsed documents as pickles in a directory, keyed by a hash
+	   of the raw input bytes. The least recently used entries are removed
+	   once the directory holds more than max_size bytes.
+
+	   The pickles are loaded as they are, so only point this at a
+	   directory nobody else can write to."""
+
+	SUFFIX = ".pickle"
+
+	def __init__(self, directory, max_size=256 * 1024 * 1024):
+		self.directory = directory
+		self.max_size = max_size
+		self.hits = 0
+		self.misses = 0
+		os.makedirs(directory, exist_ok=True)
+
+	def key(self, data, *variant):
+		"""The cache key of the raw bytes data, loaded in the way
+		   described by variant"""
+		digest = hashlib.sha256(data)
+		digest.update(repr((CACHE_VERSION,) + variant).encode("utf-8"))
+		return digest.hexdigest()
+
+	def path(self, key):
+		return os.path.join(self.directory, key + self.SUFFIX)
+
+	def get(self, key):
+		"""Return the cached document, or None"""
+		path = self.path(key)
+		try:
+			with open(path, "rb") as fp:
+				doc = pickle.load(fp)
+		except OSError:
+			self.misses += 1
+			return None
+		except Exception:
+			# corrupt, or pickled by a version whose classes are gone
+			self.misses += 1
+			try:
+				os.unlink(path)
+			except OSError:
+				pass
+			return None
+		# the modification time keeps track of the last use
+		try:
+			os.utime(path)
+		except OSError:
+			pass
+		self.hits += 1
+		return doc
+
+	def put(self, key, doc):
+		"""Store a document, and make room for it if necessary"""
+		fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+		try:
+			with os.fdopen(fd, "wb") as fp:
+				pickle.dump(doc, fp, protocol=pickle.HIGHEST_PROTOCOL)
+			# other processes never see a half written entry
+			os.replace(tmp_path, self.path(key))
+		except BaseException:
+			os.unlink(tmp_path)
+			raise
+		self.evict()
+
+	def entries(self):
+		"""(last use, size, path) of all entries, least recently used first"""
+		entries = []
+		for name in os.listdir(self.directory):
+			if not name.endswith(self.SUFFIX):
+				continue
+			path = os.path.join(self.directory, name)
+			try:
+				st = os.stat(path)
+			except OSError:
+				continue
+			entries.append((st.st_mtime, st.st_size, path))
+		entries.sort()
+		return entries
+
+	def evict(self):
+		entries = self.entries()
+		total = sum(size for (_, size, _) in entries)
+		for (_, size, path) in entries:
+			if total <= self.max_size:
+				break
+			try:
+				os.unlink(path)
+			except OSError:
+				pass
+			total -= size
+
+	@property
+	def hit_rate(self):
+		lookups = self.hits + self.misses
+		if lookups == 0:
+			return 0.0
+		return float(self.hits) / lookups
+
+	def __str__(self):
+		return "%d hits, %d misses" % (self.hits, self.misses)
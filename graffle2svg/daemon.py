@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2023 Robin Vobruba <hoijui.quaero@gmail.com>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""A local conversion server that keeps parsed documents warm
+
+Jobs are HTTP requests, on localhost or on a Unix socket:
+
+	POST /convert?page=1&compact    the graffle document as the body
+	GET  /convert?path=/some/diagram.graffle&area=0,0,400,300
+	GET  /status                     counters and latencies, as JSON
+
+The query takes page, area (x1,y1,x2,y2), multi_page, and the options
+of createTarget: css_classes, compact, reuse_shapes, tight, precision
+and compress_level. A compressed result is sent with Content-Encoding
+gzip. Paths are read by the server, so only serve where every client
+may read what the server can."""
+
+import hashlib
+import http.server
+import ipaddress
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
+from urllib.parse import parse_qs, urlsplit
+
+from .api import openSource, writeSvg
+from .batch import fileStamp
+from .main import GraffleParser, GraffleInterpreter, createTarget, DEF_TEMPLATES, defTemplate
+
+DEFAULT_PORT = 8391
+# documents kept parsed, by all workers together
+MAX_DOCUMENTS = 32
+# and the most bytes of document files they may add up to
+MAX_DOCUMENT_BYTES = 256 * 1024 * 1024
+# how many of the latest jobs the latencies are taken over
+LATENCY_WINDOW = 1000
+
+BOOLEAN_OPTIONS = ("css_classes", "compact", "reuse_shapes", "tight")
+INTEGER_OPTIONS = ("precision", "compress_level")
+TRUE = ("", "1", "true", "yes", "on")
+FALSE = ("0", "false", "no", "off")
+
+class WarmDocuments(object):
+	"""The interpreters of the documents parsed last, at most max_count
+	   of them, from document files of at most max_bytes together"""
+
+	def __init__(self, max_count=MAX_DOCUMENTS, max_bytes=MAX_DOCUMENT_BYTES):
+		self.max_count = max_count
+		self.max_bytes = max_bytes
+		# document key -> (GraffleInterpreter, file size), least recently
+		# used first
+		self.entries = OrderedDict()
+		self.size = 0
+
+	def get(self, key):
+		entry = self.entries.get(key)
+		if entry is None:
+			return None
+		self.entries.move_to_end(key)
+		return entry[0]
+
+	def put(self, key, gi, size):
+		self.entries[key] = (gi, size)
+		self.size += size
+		# the newest stays, even when it is too big on its own
+		while len(self.entries) > 1 and (len(self.entries) > self.max_count
+										 or self.size > self.max_bytes):
+			(_, (_, size)) = self.entries.popitem(last=False)
+			self.size -= size
+
+# the state of a worker process, set up by initWorker
+_documents = None
+_targets = None
+
+def initWorker(max_count=MAX_DOCUMENTS, max_bytes=MAX_DOCUMENT_BYTES):
+	"""Start a worker with empty caches, and the definitions parsed"""
+	global _documents, _targets
+	_documents = WarmDocuments(max_count, max_bytes)
+	# target options -> the target, which keeps its style and text caches
+	_targets = {}
+	for name in DEF_TEMPLATES:
+		for compact in (False, True):
+			defTemplate(name, compact)
+
+def documentKey(job):
+	"""(key, size) of the job's document, the key is a hex digest of what
+	   identifies it"""
+	if "path" in job:
+		path = os.path.abspath(job["path"])
+		(mtime, size) = fileStamp(path)
+		ident = "%s\0%d\0%d" % (path, mtime, size)
+		return (hashlib.sha256(ident.encode("utf-8", "surrogateescape")).hexdigest(), size)
+	return (hashlib.sha256(job["data"]).hexdigest(), len(job["data"]))
+
+def loadDocument(job):
+	"""The interpreter of the job's document, and whether it was cached.
+	   Documents are parsed whole, a lazily parsed one would only keep
+	   the sheet converted last."""
+	(key, size) = job["key"]
+	gi = _documents.get(key)
+	if gi is not None:
+		return (gi, True)
+	gi = GraffleInterpreter()
+	gi.dict = GraffleParser().walkGraffleFile(openSource(job.get("path", job.get("data"))))
+	_documents.put(key, gi, size)
+	return (gi, False)
+
+def convertJob(job):
+	"""Convert a job of parseJob, keyed by ConversionServer.convert, in a
+	   worker, and return (svg, whether the document was cached)"""
+	(gi, cached) = loadDocument(job)
+	key = tuple(sorted(job["target_opts"].items()))
+	target = _targets.get(key)
+	if target is None:
+		target = _targets[key] = createTarget(job["target_opts"])
+	gi.setTarget(target)
+	page = None if job.get("multi_page") else job.get("page", 0)
+	return (writeSvg(gi, page, job.get("area")), cached)
+
+def parseFlag(name, value):
+	value = value.lower()
+	if value in TRUE:
+		return True
+	if value in FALSE:
+		return False
+	raise ValueError("%s should be true or false, not %r" % (name, value))
+
+def parseJob(query, body):
+	"""A job for convertJob from the query string and the request body.
+	   Raises ValueError for anything malformed."""
+	params = {name: values[-1] for (name, values) in parse_qs(query, keep_blank_values=True).items()}
+	job = {"target_opts": {}}
+	if "path" in params:
+		job["path"] = params.pop("path")
+	elif body:
+		job["data"] = body
+	else:
+		raise ValueError("give the document as the request body, or its path")
+	if "page" in params:
+		job["page"] = int(params.pop("page"))
+	if "area" in params:
+		coords = [float(v) for v in params.pop("area").split(",")]
+		if len(coords) != 4:
+			raise ValueError("area should be x1,y1,x2,y2")
+		job["area"] = ((coords[0], coords[1]), (coords[2], coords[3]))
+	if "multi_page" in params:
+		job["multi_page"] = parseFlag("multi_page", params.pop("multi_page"))
+	for name in BOOLEAN_OPTIONS:
+		if name in params:
+			job["target_opts"][name] = parseFlag(name, params.pop(name))
+	for name in INTEGER_OPTIONS:
+		if name in params:
+			job["target_opts"][name] = int(params.pop(name))
+	if params:
+		raise ValueError("unknown parameters: " + ", ".join(sorted(params)))
+	if job.get("multi_page") and ("area" in job or "page" in job):
+		raise ValueError("multi_page converts whole pages, all of them: no area or page")
+	return job
+
+def percentile(ordered, fraction):
+	"""The nearest rank percentile of a sorted list"""
+	if not ordered:
+		return None
+	return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class Stats(object):
+	"""Counters and recent latencies of the jobs, shared by the request
+	   threads"""
+
+	def __init__(self, workers):
+		self.lock = threading.Lock()
+		self.workers = workers
+		self.started = time.time()
+		# jobs sent to every worker and not done yet
+		self.pending = [0] * workers
+		self.completed = 0
+		self.failed = 0
+		self.document_hits = 0
+		self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+	def jobStarted(self, worker):
+		with self.lock:
+			self.pending[worker] += 1
+
+	def jobDone(self, worker, latency, ok, cached=False):
+		with self.lock:
+			self.pending[worker] -= 1
+			if ok:
+				self.completed += 1
+				self.document_hits += cached
+			else:
+				self.failed += 1
+			self.latencies.append(latency)
+
+	def jobRejected(self, latency):
+		"""A job that failed before it got to a worker"""
+		with self.lock:
+			self.failed += 1
+			self.latencies.append(latency)
+
+	def snapshot(self):
+		with self.lock:
+			ordered = sorted(self.latencies)
+			return {
+				"uptime": time.time() - self.started,
+				"workers": self.workers,
+				"pending": sum(self.pending),
+				# jobs waiting for their worker
+				"queued": sum(max(0, pending - 1) for pending in self.pending),
+				"completed": self.completed,
+				"failed": self.failed,
+				"document_hits": self.document_hits,
+				"latency_ms": {name: None if value is None else value * 1000.
+							   for (name, value) in (("p50", percentile(ordered, .5)),
+													 ("p90", percentile(ordered, .9)),
+													 ("p99", percentile(ordered, .99)),
+													 ("max", ordered[-1] if ordered else None))},
+			}
+
+class ConversionServer(object):
+	"""Runs the jobs of the request threads on jobs worker processes, or
+	   with jobs 0 one at a time in this process.
+
+	   Every document goes to the same worker, picked by its key, so it
+	   is only parsed and kept once. The limits on the documents kept are
+	   shared out between the workers."""
+
+	def __init__(self, jobs=1, max_documents=MAX_DOCUMENTS, max_bytes=MAX_DOCUMENT_BYTES):
+		workers = max(1, jobs)
+		self.stats = Stats(workers)
+		limits = (max(1, max_documents // workers), max_bytes // workers)
+		self.pools = []
+		if jobs > 0:
+			from .jobs import getContext
+			self.pools = [getContext().Pool(1, initializer=initWorker, initargs=limits)
+						  for _ in range(workers)]
+		else:
+			self.lock = threading.Lock()
+			initWorker(*limits)
+
+	def worker(self, job):
+		"""Key job, and return the index of the worker it goes to"""
+		job["key"] = documentKey(job)
+		return int(job["key"][0], 16) % self.stats.workers
+
+	def convert(self, job, worker):
+		"""(svg, whether the document was cached); raises what the
+		   conversion raised"""
+		if self.pools:
+			return self.pools[worker].apply(convertJob, (job,))
+		with self.lock:
+			return convertJob(job)
+
+	def close(self):
+		for pool in self.pools:
+			pool.terminate()
+			pool.join()
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+	server_version = "graffle2svg"
+
+	def address_string(self):
+		# Unix sockets have no client address
+		return str(self.client_address[0]) if self.client_address else "local"
+
+	def do_GET(self):
+		self.handle_request(b"")
+
+	def do_POST(self):
+		length = int(self.headers.get("Content-Length") or 0)
+		self.handle_request(self.rfile.read(length))
+
+	def handle_request(self, body):
+		url = urlsplit(self.path)
+		converter = self.server.converter
+		if url.path == "/status":
+			self.send(200, "application/json", json.dumps(converter.stats.snapshot()).encode("utf-8"))
+			return
+		if url.path != "/convert":
+			self.send(404, "text/plain", b"not found\n")
+			return
+		try:
+			job = parseJob(url.query, body)
+		except ValueError as e:
+			self.send(400, "text/plain", ("%s\n" % e).encode("utf-8"))
+			return
+		start = time.time()
+		try:
+			worker = converter.worker(job)
+		except OSError as e:
+			# the path can not be read
+			converter.stats.jobRejected(time.time() - start)
+			self.failed(e)
+			return
+		converter.stats.jobStarted(worker)
+		try:
+			(svg, cached) = converter.convert(job, worker)
+		except Exception as e:
+			converter.stats.jobDone(worker, time.time() - start, False)
+			self.failed(e)
+			return
+		converter.stats.jobDone(worker, time.time() - start, True, cached)
+		headers = {}
+		if job["target_opts"].get("compress_level") is not None:
+			headers["Content-Encoding"] = "gzip"
+		self.send(200, "image/svg+xml", svg, headers)
+
+	def failed(self, error):
+		"""Tell the client what went wrong in a line, the traceback with
+		   the server's paths is only logged"""
+		self.log_error("%s failed:\n%s", self.path, traceback.format_exc())
+		message = "%s: %s" % (type(error).__name__, error)
+		self.send(422, "text/plain", (message.splitlines()[0] + "\n").encode("utf-8"))
+
+	def send(self, code, content_type, body, headers=None):
+		self.send_response(code)
+		self.send_header("Content-Type", content_type)
+		self.send_header("Content-Length", str(len(body)))
+		for (name, value) in (headers or {}).items():
+			self.send_header(name, value)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		if self.server.verbose:
+			http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+	def log_error(self, format, *args):
+		# errors are logged even without verbose
+		http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class ThreadingHTTPServer(http.server.ThreadingHTTPServer):
+	daemon_threads = True
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+def isLoopback(host):
+	"""Whether every address host resolves to is a loopback one"""
+	try:
+		infos = socket.getaddrinfo(host, None)
+	except socket.gaierror:
+		return False
+	return all(ipaddress.ip_address(info[4][0]).is_loopback for info in infos)
+
+def makeServer(address, converter, verbose=False):
+	"""An HTTP server on address: a path for a Unix socket, or
+	   [HOST:]PORT, on localhost if no host is given. Jobs read any
+	   path the server can, so other hosts are refused."""
+	if os.sep in address:
+		if os.path.exists(address):
+			if not stat.S_ISSOCK(os.stat(address).st_mode):
+				raise ValueError("%s exists and is not a socket" % address)
+			# left over by a server that did not clean up
+			os.remove(address)
+		server = ThreadingUnixHTTPServer(address, RequestHandler)
+	else:
+		(host, _, port) = address.rpartition(":")
+		host = host or "127.0.0.1"
+		if not isLoopback(host):
+			raise ValueError("%s is not a loopback address, the server only listens on localhost" % host)
+		server = ThreadingHTTPServer((host, int(port or DEFAULT_PORT)), RequestHandler)
+	server.converter = converter
+	server.verbose = verbose
+	return server
+
+def serve(address, jobs=1, max_documents=MAX_DOCUMENTS, max_bytes=MAX_DOCUMENT_BYTES,
+		  verbose=False):
+	"""Serve conversions on address until interrupted"""
+	converter = ConversionServer(jobs, max_documents, max_bytes)
+	try:
+		server = makeServer(address, converter, verbose)
+	except:
+		converter.close()
+		raise
+	# clean up as well when stopped by a service manager
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		converter.close()
+		if isinstance(server, ThreadingUnixHTTPServer):
+			os.remove(address)
@@ -8,22 +8,119 @@
 #
 # SPDX-License-Identifier: BSD-3-Clause
 
+import codecs
 import gzip
-from urllib.request import urlopen
-import chardet
+import io
+import os
+import posixpath
+import zipfile
+
+# how many bytes are looked at to tell the formats apart
+SNIFF_SIZE = 16
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZIP_MAGIC = b"PK\x03\x04"
+BPLIST_MAGIC = b"bplist00"
+XML_STARTS = (b"<?xml", b"<!DOCTYPE", b"<plist")
+BOMS = (
+	(codecs.BOM_UTF8, "utf-8"),
+	(codecs.BOM_UTF32_LE, "utf-32-le"),
+	(codecs.BOM_UTF32_BE, "utf-32-be"),
+	(codecs.BOM_UTF16_LE, "utf-16-le"),
+	(codecs.BOM_UTF16_BE, "utf-16-be"),
+)
+
+def sniffFormat(head):
+	"""Tell from the first bytes of a file what it holds:
+	   "gzip", "zip", "bplist", "xml" or None"""
+	if head.startswith(GZIP_MAGIC):
+		return "gzip"
+	if head.startswith(ZIP_MAGIC):
+		return "zip"
+	if head.startswith(BPLIST_MAGIC):
+		return "bplist"
+	for bom, encoding in BOMS:
+		if head.startswith(bom):
+			head = head[len(bom):].decode(encoding, "ignore").encode("ascii", "ignore")
+			break
+	if head.startswith(XML_STARTS):
+		return "xml"
+	return None
+
+def peek(fp, size=SNIFF_SIZE):
+	"""The first bytes of fp, without consuming them"""
+	return fp.peek(size)[:size]
 
 class GraffleFilePack(object):
+	"""Opens a graffle file, whichever way it is packed.
+
+	   The format is sniffed from the first bytes of the open file, and
+	   that same file object is read from afterwards, so the input is only
+	   read once. fn is a file name, the directory of a graffle package or
+	   a binary file object.
+
+	   Zip containers are read from in place: the data.plist member is
+	   streamed out of the archive, and may itself be gzipped."""
 	__file = None
 
+	# the document inside of zip containers and package directories
+	PLIST_MEMBER = "data.plist"
+
 	def __init__(self,fn):
-		if not fn:
+		if fn is None or fn == "":
 			raise Exception("You must specify an input file")
-		elif self.detectGZipXMLFile(fn):
-			self.__file = gzip.open(fn, "rb")
-		elif self.detectXMLFile(fn):
-			self.__file = open(fn,"rb")
+		if hasattr(fn, "read"):
+			self.__raw = fn
+			self.__owned = False
+			name = getattr(fn, "name", "<stream>")
 		else:
-			raise Exception("Invalid input file: %s" % (fn))
+			if os.path.isdir(fn):
+				fn = os.path.join(fn, self.PLIST_MEMBER)
+			self.__raw = open(fn, "rb")
+			self.__owned = True
+			name = fn
+		if not hasattr(self.__raw, "peek"):
+			self.__raw = io.BufferedReader(self.__raw)
+		self.container = None
+		self.compression = None
+		# everything opened on top of the raw file, innermost last
+		self.__layers = []
+
+		self.__file = self.__raw
+		self.format = sniffFormat(peek(self.__file))
+		try:
+			if self.format == "zip":
+				self.container = "zip"
+				self.__file = self.openZipMember()
+				self.format = sniffFormat(peek(self.__file))
+			if self.format == "gzip":
+				self.compression = "gzip"
+				self.__file = gzip.GzipFile(fileobj=self.__file, mode="rb")
+				self.__layers.append(self.__file)
+				self.format = sniffFormat(peek(self.__file))
+		except (OSError, EOFError, zipfile.BadZipFile):
+			self.format = None
+		if self.format not in ("xml", "bplist"):
+			self.close()
+			raise Exception("Invalid input file: %s" % (name))
+
+	def openZipMember(self):
+		"""Open the plist member of a zip container as a stream"""
+		raw = self.__raw
+		if not raw.seekable():
+			# zipfile needs random access, so keep the archive in memory
+			raw = io.BytesIO(raw.read())
+		archive = zipfile.ZipFile(raw)
+		self.__layers.append(archive)
+		members = [info for info in archive.infolist()
+				   if posixpath.basename(info.filename) == self.PLIST_MEMBER]
+		if not members:
+			raise zipfile.BadZipFile("no %s in the archive" % (self.PLIST_MEMBER))
+		# the outermost one, if there are several
+		members.sort(key=lambda info: info.filename.count("/"))
+		member = archive.open(members[0])
+		self.__layers.append(member)
+		return member
 
 	@property
 	def fileObject(self):
@@ -33,46 +130,17 @@ class GraffleFilePack(object):
 		return self.__file.read()
 
 	def close(self):
-		self.__file.close()
+		for layer in reversed(self.__layers):
+			layer.close()
+		self.__layers = []
+		if self.__owned:
+			self.__raw.close()
 
-	def detectGZipXMLFile(self,fn):
-		"""Is this a zipped xml file"""
-		result = False
-		try:
-			f = gzip.open(fn, 'rb')
-			try:
-				byteString = f.readline()
-				result = (byteString and byteString[:5] == b'<?xml')
-			except:
-				result = False
-			f.close()
-		except:
-			pass
-		return result
-
-	def detectXMLFile(self,fn):
-		"""Is this an xml file"""
-		result = False
-		encoding = self.__detectEncoding(fn)
-		if encoding and encoding['encoding']:
-			encoding = encoding['encoding']
-			try:
-				f = open(fn, "r", encoding=encoding)
-				try:
-					string = f.readline()
-					result = (string and string[:5] == '<?xml')
-				except:
-					result = False
-				f.close()
-			except:
-				pass
-		return result
-
-	def __detectEncoding(self, fn):
-		fh = urlopen("file:%s" % (fn))
-		result = chardet.detect(fh.read())
-		fh.close()
-		return result
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
 
 if __name__ == "__main__":
     gfp = GraffleFilePack("gziptest.graffle")
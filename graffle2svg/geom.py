@@ -11,6 +11,59 @@
 """simple geometry functions"""
 
 import math
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Points at least this long are transformed with numpy, if it is there;
+# below, setting numpy up costs more than the loop
+NUMPY_MIN_POINTS = 128
+
+class Points(object):
+    """A polyline as one flat array('d') of x0, y0, x1, y1, ..., which
+    reads like a sequence of (x, y) tuples"""
+    __slots__ = ["coords"]
+
+    def __init__(self, coords=()):
+        self.coords = coords if isinstance(coords, array) else array("d", coords)
+
+    def __len__(self):
+        return len(self.coords) // 2
+
+    def __iter__(self):
+        it = iter(self.coords)
+        return zip(it, it)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            (start, stop, step) = index.indices(len(self))
+            if step == 1:
+                return Points(self.coords[2 * start:2 * max(start, stop)])
+            return [self[i] for i in range(start, stop, step)]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("point index out of range")
+        return (self.coords[2 * index], self.coords[2 * index + 1])
+
+    def bounds(self):
+        """(minx, miny, maxx, maxy), reduced over the coordinates at once"""
+        (xs, ys) = (self.coords[0::2], self.coords[1::2])
+        return (min(xs), min(ys), max(xs), max(ys))
+
+    def __eq__(self, other):
+        if isinstance(other, Points):
+            return self.coords == other.coords
+        try:
+            return list(self) == [tuple(p) for p in other]
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return "Points(%r)" % (list(self),)
 
 def findcentre(pts):
     """Finds the centre of the points ( *not* Centre of Mass)"""
@@ -31,54 +84,145 @@ def h_flip_points(pts,centre=None):
     """Horizontal flip"""
     if centre is None:
         centre = findcentre(pts)
-    xc,yc = centre
-    outpts = []
-    for (x,y) in pts:
-        outpts.append([xc + (-1. * (x-xc)), y])
-    return outpts
+    return Affine.scaling(-1., 1.).about(centre).apply(pts)
 
 
 def v_flip_points(pts,centre=None):
     """Vertical flip"""
     if centre is None:
         centre = findcentre(pts)
-    xc,yc = centre
-    outpts = []
-    for (x,y) in pts:
-        outpts.append([x, yc + (-1 * (y-yc))])
-    return outpts
+    return Affine.scaling(1., -1.).about(centre).apply(pts)
 
 def rotate_points(pts, angle=0, centre=None):
-    if centre is None:
-        centre = findcentre(pts)
     if round(angle % 360,7) == 0:
         return pts
-    elif round(angle % 180,7) == 0:
-        return h_flip_points (
-                   v_flip_points(pts, centre),
-                   centre)
-    # in radians
-    phi = (angle * math.pi * 2.) / 360.
-    xc,yc = centre
-    outpts = []
-    cs = math.cos(phi)
-    sn = math.sin(phi)
-    # angle we're changing by
-    for (x,y) in pts:
-        # relative to centres
-        relx,rely = x-xc, y-yc
-        if (relx,rely) == (0.,0.):
-            outpts.append(0.,0.)
-            continue
-        newx = xc + (cs*relx-sn*rely)
-        newy = yc + (sn*relx+cs*rely)
-        outpts.append( [newx,newy] )
-    return outpts
+    if centre is None:
+        centre = findcentre(pts)
+    return Affine.rotation(angle).about(centre).apply(pts)
+
+# cosine and sine of the quarter turns
+QUARTER_TURNS = ((1., 0.), (0., 1.), (-1., 0.), (0., -1.), (1., 0.))
+
+def cos_sin(angle):
+    """cosine and sine of angle degrees, exact for multiples of 90"""
+    quarter = round(angle % 360, 7) / 90.
+    if quarter == int(quarter):
+        return QUARTER_TURNS[int(quarter)]
+    phi = math.radians(angle)
+    return (math.cos(phi), math.sin(phi))
+
+class Affine(object):
+    """The affine transform x' = a*x + c*y + e, y' = b*x + d*y + f, as
+    the matrix(a,b,c,d,e,f) of SVG"""
+    __slots__ = ["a", "b", "c", "d", "e", "f"]
+
+    def __init__(self, a=1., b=0., c=0., d=1., e=0., f=0.):
+        self.a, self.b, self.c, self.d, self.e, self.f = a, b, c, d, e, f
+
+    @classmethod
+    def translation(cls, dx, dy):
+        return cls(e=dx, f=dy)
+
+    @classmethod
+    def scaling(cls, sx, sy):
+        return cls(a=sx, d=sy)
+
+    @classmethod
+    def rotation(cls, angle):
+        """Rotation by angle degrees, clockwise on the screen"""
+        (cs, sn) = cos_sin(angle)
+        return cls(cs, sn, -sn, cs)
+
+    def __matmul__(self, other):
+        """self after other"""
+        return Affine(self.a * other.a + self.c * other.b,
+                      self.b * other.a + self.d * other.b,
+                      self.a * other.c + self.c * other.d,
+                      self.b * other.c + self.d * other.d,
+                      self.a * other.e + self.c * other.f + self.e,
+                      self.b * other.e + self.d * other.f + self.f)
+
+    def about(self, centre):
+        """The same transform, about centre instead of the origin"""
+        (xc, yc) = centre
+        return Affine.translation(xc, yc) @ self @ Affine.translation(-xc, -yc)
+
+    def apply(self, pts):
+        """The transformed points, in a single pass"""
+        (a, b, c, d, e, f) = (self.a, self.b, self.c, self.d, self.e, self.f)
+        if numpy is not None and isinstance(pts, Points) and len(pts) >= NUMPY_MIN_POINTS:
+            # read in place; for lists of pairs the conversion costs more
+            # than it saves
+            xy = numpy.frombuffer(pts.coords, dtype=float).reshape(-1, 2)
+            out = numpy.empty_like(xy)
+            out[:, 0] = a * xy[:, 0] + c * xy[:, 1] + e
+            out[:, 1] = b * xy[:, 0] + d * xy[:, 1] + f
+            return out.tolist()
+        if b == 0. and c == 0.:
+            # flips, and half turns
+            return [[a * x + e, d * y + f] for (x, y) in pts]
+        return [[a * x + c * y + e, b * x + d * y + f] for (x, y) in pts]
+
+    def __eq__(self, other):
+        return isinstance(other, Affine) and \
+            (self.a, self.b, self.c, self.d, self.e, self.f) == (other.a, other.b, other.c, other.d, other.e, other.f)
+
+    def __repr__(self):
+        return "Affine(%r, %r, %r, %r, %r, %r)" % (self.a, self.b, self.c, self.d, self.e, self.f)
+
+def shape_transform(pts, hflip=False, vflip=False, angle=None):
+    """The flips and the rotation graffle applies to a shape, in this
+    order, about the centre of its points, as one Affine; None if they
+    leave the points as they are"""
+    if not (hflip or vflip or angle is not None):
+        return None
+    sx = -1. if hflip else 1.
+    sy = -1. if vflip else 1.
+    (cs, sn) = (1., 0.) if angle is None else cos_sin(angle)
+    # the rotation after the flips
+    (a, b, c, d) = (cs * sx, sn * sx, -sn * sy, cs * sy)
+    if (a, b, c, d) == (1., 0., 0., 1.):
+        return None
+    # neither flips nor rotations move the centre
+    (xc, yc) = findcentre(pts)
+    return Affine(a, b, c, d, xc - a * xc - c * yc, yc - b * xc - d * yc)
+
+def points_bounds(pts):
+    """(minx, miny, maxx, maxy) of the points, in one pass over them"""
+    if isinstance(pts, Points):
+        return pts.bounds()
+    (xmin, ymin) = (xmax, ymax) = pts[0]
+    for (x, y) in pts:
+        if x < xmin:
+            xmin = x
+        elif x > xmax:
+            xmax = x
+        if y < ymin:
+            ymin = y
+        elif y > ymax:
+            ymax = y
+    return (xmin, ymin, xmax, ymax)
+
+def union_bounds(first, second):
+    """The (minx, miny, maxx, maxy) bounds enclosing both, either of
+    which may be None for nothing"""
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return (min(first[0], second[0]), min(first[1], second[1]),
+            max(first[2], second[2]), max(first[3], second[3]))
 
 def out_of_boundingbox(points,  boundingbox):
     ''' returns True if one of the points is out of selected boundingbox. If boundingbox is None, returns False'''
     if not boundingbox:
         return False
+    if isinstance(points, Points):
+        # outside if the extent of the points is not within the box
+        (minx, miny, maxx, maxy) = points.bounds()
+        ((x1, y1), (x2, y2)) = boundingbox
+        return (minx < min(x1, x2) or maxx > max(x1, x2) or
+                miny < min(y1, y2) or maxy > max(y1, y2))
     for point in points:
         if ((point[0] - boundingbox[0][0]) * (point[0] - boundingbox[1][0])>0) or \
             ((point[1] - boundingbox[0][1]) * (point[1] - boundingbox[1][1])>0):
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2023 Robin Vobruba <hoijui.quaero@gmail.com>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""Converting the pages of a document in parallel"""
+
+import multiprocessing
+import os
+import traceback
+
+from .main import GraffleInterpreter, createTarget
+
+# the interpreter of a worker process, set up by initWorker
+_interpreter = None
+
+def makeInterpreter(doc_dict, target_opts=None):
+	"""An interpreter of doc_dict; target_opts are the keyword arguments
+	   of createTarget"""
+	interpreter = GraffleInterpreter()
+	interpreter.setTarget(createTarget(target_opts))
+	interpreter.dict = doc_dict
+	return interpreter
+
+def initWorker(doc_dict, target_opts=None):
+	"""Share the parsed document with a worker. With fork this is the
+	   parent's document itself, otherwise it is unpickled once per worker."""
+	global _interpreter
+	_interpreter = makeInterpreter(doc_dict, target_opts)
+
+def convertPage(job, interpreter=None):
+	"""Write one page with interpreter, the worker's by default, and
+	   return (page, out_file, error or None)"""
+	page, out_file = job
+	try:
+		writePageFile(interpreter or _interpreter, page, out_file)
+	except Exception:
+		return (page, out_file, traceback.format_exc())
+	return (page, out_file, None)
+
+def writePageFile(interpreter, page, out_file):
+	"""Write a page, or with page None all pages as one document, to
+	   out_file, which is removed again if that fails, as streaming
+	   targets write as they go"""
+	try:
+		with open(out_file, "wb") as f:
+			if page is None:
+				interpreter.writeDocument(f)
+			else:
+				interpreter.writePage(f, page=page)
+	except BaseException:
+		if os.path.exists(out_file):
+			os.remove(out_file)
+		raise
+
+def getContext():
+	"""fork shares the document with the workers without copying it"""
+	if "fork" in multiprocessing.get_all_start_methods():
+		return multiprocessing.get_context("fork")
+	return multiprocessing.get_context()
+
+def convertPages(doc_dict, pages, jobs=1, target_opts=None):
+	"""Convert the pages given as (page, out_file) pairs, using up to jobs
+	   processes. The results of convertPage are yielded in the order of
+	   pages; a page that fails does not stop the others."""
+	pages = list(pages)
+	jobs = min(jobs, len(pages))
+	if jobs <= 1:
+		# not kept in _interpreter, the document goes once this is done
+		interpreter = makeInterpreter(doc_dict, target_opts)
+		for job in pages:
+			yield convertPage(job, interpreter)
+		return
+	pool = getContext().Pool(jobs, initializer=initWorker, initargs=(doc_dict, target_opts))
+	try:
+		for result in pool.imap(convertPage, pages):
+			yield result
+	finally:
+		pool.terminate()
+		pool.join()
@@ -11,117 +11,88 @@
 #
 # SPDX-License-Identifier: BSD-3-Clause
 
-import xml.dom.minidom
 import gzip
+import io
+import os
+import xml.dom.minidom
+from xml.sax.saxutils import escape
 
-from .rtf import extractRTFString
-from .styles import CascadingStyles
+from .filepack import GraffleFilePack
+from .rtf import RTFCache
+from .styles import CascadingStyles, StyleCache
 from . import geom
 from . import fileinfo
+from . import normalize
+from . import spatial
+from . import svgfmt
+from . import xmlplist
 
 class GraffleParser(object):
 
-	def __init__(self):
+	def __init__(self, cache=None):
 		self.doc_dict = None
-		self.g_dom = None
-
-	def walkGraffleFile(self,filename):
-		import plistlib
-		try:
-			with gzip.open(filename, 'rb') as fp:
-				self.doc_dict = plistlib.load(fp)
-		except gzip.BadGzipFile:
-			with open(filename, 'rb') as fp:
-				self.doc_dict = plistlib.load(fp)
+		# a cache.DocumentCache, if parsed documents should be kept
+		self.cache = cache
+
+	def walkGraffleFile(self, filename, lazy=False):
+		"""Load a graffle file, given by name or as a binary file object
+
+		   With lazy set, only the document level keys are loaded, and the
+		   sheets are parsed one at a time when they are looked up."""
+		if self.cache is not None:
+			return self.walkCachedGraffleFile(filename, lazy)
+		with GraffleFilePack(filename) as pack:
+			if lazy:
+				self.doc_dict = self.loadLazy(pack)
+			else:
+				self.doc_dict = self.loadPlist(pack)
 		if self.doc_dict is None:
 			raise Exception('File not found or not Plist format')
 		return self.doc_dict
 
-	def walkGraffle(self, xmlstr, **kwargs):
-		"""Walk over the file"""
-		self.g_dom = xml.dom.minidom.parseString(xmlstr)
-
-		self.walkGraffleDoc(self.g_dom, **kwargs)
+	def walkCachedGraffleFile(self, filename, lazy=False):
+		"""Look the raw file up in the cache, and only unpack
+		   and parse it when it is not there"""
+		if hasattr(filename, "read"):
+			raw = filename.read()
+		else:
+			if os.path.isdir(filename):
+				# a graffle package
+				filename = os.path.join(filename, GraffleFilePack.PLIST_MEMBER)
+			with open(filename, "rb") as fp:
+				raw = fp.read()
+		key = self.cache.key(raw, lazy)
+		doc_dict = self.cache.get(key)
+		if doc_dict is None:
+			doc_dict = GraffleParser().walkGraffleFile(io.BytesIO(raw), lazy=lazy)
+			self.cache.put(key, doc_dict)
+		self.doc_dict = doc_dict
+		return self.doc_dict
 
-	def walkGraffleDoc(self, parent):
-		# want to pass this around like a continuation
-		cont = self.nodeListGen(parent.childNodes)
-		for e in cont:
-			if e.nodeType == e.DOCUMENT_TYPE_NODE:
-				pass
-			localname = e.localName
-
-			if localname == "plist":
-				# Apple's main container
-				self.walkGraffleDoc(e)
-
-			if localname == "dict":
-				self.doc_dict = self.ReturnGraffleDict(e)
-
-	def nodeListGen(self,nodelist):
-		"""We need this so we can pass continuations around"""
-		for e in nodelist:
-			yield e
-
-	def ReturnGraffleNode(self, parent):
-		"""Return a python representation of the
-		   node passed"""
-		if parent.nodeType == parent.TEXT_NODE:
-			return parent.wholeText
-		elif parent.localName == "dict":
-			return self.ReturnGraffleDict(parent)
-		elif parent.localName == "array":
-			return self.ReturnGraffleArray(parent)
-		elif parent.localName == "true":
-			return True
-		elif parent.localName == "false":
-			return False
-		elif parent.localName in ["string","real","integer"]:
-			return self.ReturnGraffleNode(parent.firstChild)
-		return parent.nodeType
-
-	def ReturnGraffleDict(self, parent):
-		"""Graffle has dicts like
-			<dict>
-				<key />
-				<integer />
-				<key />
-				<string />
-			</dict>
-			- pass the <dict> node to this method
-		"""
-		retdict = {}
-		cont = self.nodeListGen(parent.childNodes)
-		key, val = None, None
-		for e in cont:
-			if e.nodeType == e.TEXT_NODE:
-				continue
-			localname = e.localName
-			if localname == "key":
-				key = self.ReturnGraffleNode(e.firstChild)
-			else:
-				val = self.ReturnGraffleNode(e)
-				retdict[key] = val
-		return retdict
-
-	def ReturnGraffleArray(self, parent):
-		"""Graffle has arrays like
-			<array>
-				<string />
-				<string />
-			</array>
-			- pass the <array> node to this method
-		"""
-		retlist = []
-		cont = self.nodeListGen(parent.childNodes)
-		for e in cont:
-			if e.nodeType == e.TEXT_NODE:
-				continue
-			retlist.append(self.ReturnGraffleNode(e))
-		return retlist
+	def loadPlist(self, pack):
+		import plistlib
+		if pack.format == "bplist":
+			# binary plists need random access
+			return plistlib.loads(pack.read(), fmt=plistlib.FMT_BINARY)
+		return plistlib.load(pack.fileObject, fmt=plistlib.FMT_XML)
+
+	def loadLazy(self, pack):
+		if pack.format == "bplist":
+			# binary plists have no sheets to skip over
+			return self.loadPlist(pack)
+		return xmlplist.loads(pack.read(), typed=True, lazy=True)
+
+	def walkGraffle(self, xmlstr, lazy=False, **kwargs):
+		"""Walk over the file
+
+		   The plist is loaded straight from the parser events,
+		   there is no DOM built for the whole document anymore."""
+		self.doc_dict = xmlplist.loads(xmlstr, lazy=lazy)
+		return self.doc_dict
 
 class GraffleInterpreter(object):
-	__slots__=['doc_dict', 'target', 'fileinfo', 'imagelist', 'bounding_box']
+	__slots__=['doc_dict', 'target', 'fileinfo', 'imagelist', 'bounding_box',
+			   'spatial_index', 'spatial_indexes', 'id_prefix']
 
 	def __init__(self):
 		self.doc_dict = None
@@ -129,6 +100,12 @@ class GraffleInterpreter(object):
 		self.target = None
 		self.imagelist = None
 		self.bounding_box = None
+		# the index of the page being extracted, if only an area of it is
+		self.spatial_index = None
+		# page -> spatial.SheetIndex
+		self.spatial_indexes = {}
+		# graphic IDs are only unique within their sheet
+		self.id_prefix = ""
 
 	def setTarget(self, target):
 		self.target = target
@@ -147,7 +124,10 @@ class GraffleInterpreter(object):
 		self.doc_dict = doc_dict
 		self.fileinfo = None
 		self.imagelist = None
+		self.spatial_indexes = {}
 		if self.doc_dict is not None:
+			# geometry strings are only parsed this once
+			normalize.normalizeDocument(self.doc_dict)
 			# Extract file information
 			self.fileinfo = fileinfo.FileInfo(self.doc_dict)
 			# Graffle lists it's image references separately
@@ -157,13 +137,19 @@ class GraffleInterpreter(object):
 
 	def parseCoords(self, s):
 		"""in: "{0,1}" -> [0,1]"""
+		if not isinstance(s, str):
+			# already normalized
+			return s
 		return [float(a) for a in s[1:-1].split(",")]
 
 	def extractMagnetCoordinates(self,mgnts):
-		pts = [self.parseCoords(a) for a in mgnts]
-		return pts
+		if isinstance(mgnts, (tuple, geom.Points)):
+			return mgnts
+		return normalize.parsePoints(mgnts)
 
 	def extractBoundCOordinates(self,bnds):
+		if not isinstance(bnds, str):
+			return bnds
 		bnds = bnds[1:-1].strip()
 		bnds = bnds.split(",")
 		coords = []
@@ -210,16 +196,84 @@ class GraffleInterpreter(object):
 										    rx=None,
 										    ry=None)
 		self.bounding_box = bounding_box
-		graphics = reversed(mydict["GraphicsList"])
+		self.spatial_index = None
+		if bounding_box:
+			self.spatial_index = self.getSpatialIndex(page, mydict)
+		graphics = reversed(self.visibleGraphics(mydict["GraphicsList"]))
 		self.target.reset()
+		# known before any graphic, for targets that write as they go
+		bgcoords = self.extractBoundCOordinates(
+			mydict["BackgroundGraphic"]["Bounds"])
+		self.target.setDocumentSize(bgcoords[2], bgcoords[3])
 		self.iterateGraffleGraphics(graphics)
 		self.target.add_requirements()
 		self.target.add_document_bounds()
+		self.target.finish()
 
-		bgcoords = self.extractBoundCOordinates(
-			mydict["BackgroundGraphic"]["Bounds"])
-		self.target.svg_tag.setAttribute("width", f"{bgcoords[2]}")
-		self.target.svg_tag.setAttribute("height", f"{bgcoords[3]}")
+	def writePage(self, fp, page=0, bounding_box=None):
+		"""Extract a page into the binary file fp"""
+		sink = self.target.sink
+		self.target.sink = fp
+		try:
+			self.extractPage(page=page, bounding_box=bounding_box)
+		finally:
+			self.target.sink = sink
+
+	def extractDocument(self, pages=None):
+		"""Extract pages, all of them by default, into one document with
+		   the definitions they require written once. Each page is a nested
+		   <svg> with the id PAGE_ID % page, the sheet title as <title>, and
+		   IDs prefixed by its id; all but the first page are hidden."""
+		sheets = self.doc_dict.get("Sheets")
+		if sheets is None:
+			sheets = [self.doc_dict]
+		if pages is None:
+			pages = range(len(sheets))
+		pages = list(pages)
+		sizes = [self.extractBoundCOordinates(sheets[page]["BackgroundGraphic"]["Bounds"])[2:]
+				 for page in pages]
+		self.bounding_box = None
+		self.spatial_index = None
+		self.target.reset(multi_page=True)
+		if sizes:
+			self.target.setDocumentSize(max(w for (w, h) in sizes), max(h for (w, h) in sizes))
+		try:
+			for (page, (width, height)) in zip(pages, sizes):
+				sheet = sheets[page]
+				self.id_prefix = PAGE_ID % page + "-"
+				self.target.startPage(page, width, height, sheet.get("SheetTitle"))
+				self.iterateGraffleGraphics(reversed(sheet["GraphicsList"]))
+				self.target.endPage()
+		finally:
+			self.id_prefix = ""
+		self.target.add_requirements()
+		self.target.finish()
+
+	def writeDocument(self, fp, pages=None):
+		"""Extract pages into one document in the binary file fp"""
+		sink = self.target.sink
+		self.target.sink = fp
+		try:
+			self.extractDocument(pages=pages)
+		finally:
+			self.target.sink = sink
+
+	def graphicId(self, graphic):
+		return self.id_prefix + str(graphic["ID"])
+
+	def getSpatialIndex(self, page, sheet):
+		index = self.spatial_indexes.get(page)
+		# lazily loaded sheets may have been loaded again since
+		if index is None or index.sheet is not sheet:
+			index = spatial.SheetIndex(sheet)
+			self.spatial_indexes[page] = index
+		return index
+
+	def visibleGraphics(self, graphics):
+		"""The graphics of the list that may lie in the extracted area"""
+		if self.spatial_index is None or not self.bounding_box:
+			return graphics
+		return self.spatial_index.query(graphics, self.bounding_box)
 
 	def svgAddGraffleShapedGraphic(self, graphic):
 		shape = graphic['Shape']
@@ -231,7 +285,7 @@ class GraffleInterpreter(object):
 			extra_opts["VFlip"] = True
 		if graphic.get("Rotation") is not None:
 			extra_opts["Rotation"] = float(graphic["Rotation"])
-		extra_opts["id"] = str(graphic["ID"])
+		extra_opts["id"] = self.graphicId(graphic)
 
 		coords = self.extractBoundCOordinates(graphic['Bounds'])
 
@@ -246,7 +300,7 @@ class GraffleInterpreter(object):
 					return
 				image = self.imagelist[image_id]
 				self.target.addImage(bounds = coords, \
-								  href = image)
+								  href = image, id = extra_opts["id"])
 				print("Insert Image - " + str(image))
 			else:
 				# radius of corners is stored on the style in graffle
@@ -341,6 +395,8 @@ class GraffleInterpreter(object):
 			elif cls == "ShapedGraphic":
 				try:
 					if not self.svgAddGraffleShapedGraphic(graphics):
+						# left out, and so is its style
+						self.target.style.popScope()
 						continue
 				except:
 					raise
@@ -349,6 +405,7 @@ class GraffleInterpreter(object):
 			elif cls == "LineGraphic":
 				pts = self.extractMagnetCoordinates(graphics["Points"])
 				if geom.out_of_boundingbox(pts,self.bounding_box):
+					self.target.style.popScope()
 					continue
 				self.target.style["fill"] = "none"
 				if not graphics.get("OrthogonalBarAutomatic"):
@@ -372,18 +429,20 @@ class GraffleInterpreter(object):
 						pts = out_pts
 						"""
 
-					self.target.addPath( pts,id=str(graphics["ID"]))
+					self.target.addPath( pts,id=self.graphicId(graphics))
 
 			elif cls == "TableGroup":
 				# In Progress
 				table_graphics = graphics.get("Graphics")
 				if table_graphics is not None:
-					self.target.addLayer(self, reversed(table_graphics))
+					self.target.addLayer(self, reversed(self.visibleGraphics(table_graphics)),
+										 self.graphicId(graphics))
 
 			elif cls == "Group":
 				subgraphics = graphics.get("Graphics")
 				if subgraphics is not None:
-					self.target.addLayer(self, reversed(subgraphics))
+					self.target.addLayer(self, reversed(self.visibleGraphics(subgraphics)),
+										 self.graphicId(graphics))
 			else:
 				print("Don't know how to display Class \"%s\""%cls)
 
@@ -393,92 +452,407 @@ class GraffleInterpreter(object):
 				coords = self.extractBoundCOordinates(graphics['Bounds'])
 
 				if geom.out_of_boundingbox(((coords[0], coords[1]),  ((coords[0]+coords[2]),  (coords[1] + coords[3]))), self.bounding_box):
+					self.target.style.popScope()
 					continue
 				x, y, width, height = coords
 				dx = float(graphics['Text'].get('Pad',0))
 				dy = float(graphics['Text'].get('VerticalPad',0))
 				self.target.addText(rtftext = graphics.get("Text").get("Text",""),
-							     x = x+dx, y = y+dy, width = width-2*dx, height = height-2*dy, fontinfo = graphics.get("FontInfo"),id=graphics["ID"])
+							     x = x+dx, y = y+dy, width = width-2*dx, height = height-2*dy, fontinfo = graphics.get("FontInfo"),id=self.graphicId(graphics))
 
 			self.target.style.popScope()
 
+# Fragments for the defs, each a single element in a <defs>. Attribute
+# values may hold %(key)s placeholders, filled in by fillTemplate.
+DEF_TEMPLATES = {
+	"Arrow1Lend": """
+				<defs><marker
+				   orient='auto'
+				   refY='0.0'
+				   refX='0.0'
+				   id='%(id)s'
+				   style='overflow:visible;'>
+				  <path
+					 id='path_%(id)s'
+					 d='M -5,0.0 L -5,-2.0 L 0.0,0.0 L -5,2.0 z '
+					 style='fill:#%(color)s;fill-rule:evenodd;stroke:#%(color)s;stroke-width:1.0px;marker-start:none;'
+					 transform='scale(%(scale)f)' />
+				</marker></defs>""",
+	"Arrow1Lstart": """
+				<defs><marker
+				   orient='auto'
+				   refY='0.0'
+				   refX='0.0'
+				   id='%(id)s'
+				   style='overflow:visible'>
+				  <path
+					 id='path_%(id)s'
+					 d='M 5,0.0 L 5.0,-2.0 L 0.0,0.0 L 5.0,2.0 z'
+					 style='fill:#%(color)s;fill-rule:evenodd;stroke:#%(color)s;stroke-width:1.0px;marker-start:none'
+					 transform='scale(%(scale)f)'/>
+				</marker></defs>""",
+	"Arrow2Lend": """
+			<defs><marker
+			   orient='auto'
+			   refY='0.0'
+			   refX='0.0'
+			   id='Arrow2Lend'
+			   overflow='visible'
+			   stroke='currentColor'>
+			  <path
+				 id='Arrow2Lend'
+				 d='M 10.0,-2.0 L 0.0,0.0 L 10.0,2.0'
+				 style='fill:none;stroke:#000000;stroke-width:1.0px;marker-start:none' />
+			</marker></defs>""",
+	"Arrow2Lstart": """
+			<defs><marker
+			   orient='auto'
+			   refY='0.0'
+			   refX='0.0'
+			   id='Arrow2Lstart'
+			   overflow='visible'
+			   stroke='currentColor'>
+			  <path
+				 id='pathStickArrow'
+				 d='M -10.0,-2.0 L 0.0,0.0 L -10.0,2.0'
+				 style='fill:none;stroke:#000000;stroke-width:1.0px;marker-start:none'/>
+			</marker></defs>""",
+	"DropShadow": """
+			<defs><filter id='DropShadow' filterRes='100' x='0' y='0'>
+			   <feGaussianBlur stdDeviation='3' result='MyBlur'/>
+			   <feOffset in='MyBlur' dx='2' dy='4' result='movedBlur'/>
+			   <feMerge>
+				   <feMergeNode in='movedBlur'/>
+				   <feMergeNode in='SourceGraphic'/>
+			   </feMerge>
+			</filter></defs>""",
+	"CrowBall": """
+			<defs><marker
+			refX='0'
+			refY='0'
+			orient='auto'
+			id='mCrowBall'
+			style='overflow:visible'>
+			<path d='M 0.0,2.5 L 7.5,0.0 L 0.0,-2.5'
+			 style='stroke:#000;stroke-width:1.0px;marker-start:none;fill:none;' />
+			<circle cx='10' cy='0' r='2.5' style='stroke-width:1px; stroke: #000; fill:none;'/>
+			</marker></defs>""",
+	"Bar": """
+			<defs><marker
+			refX='0'
+			refY='0'
+			orient='auto'
+			id='mBar'
+			style='overflow:visible'>
+			<path d='M -7.5,-2.5 L -7.5,2.5'
+			 style='stroke:#000;stroke-width:1.0px;marker-start:none;fill:none;' />
+			</marker></defs>""",
+	# cloud shape 500x500
+	"network_cloud": """
+			<defs><g id='network_cloud'>
+			<path d='M 127.5 106.25 C 127.5 106.25 126.25 18.7501 231.25 45 C 336.25 71.25 317.5 115 318.75 115 C 320 115 300 61.25 380 51.25 C 452.5 57.5 486.25 71.25 482.5 117.5 C 478.75 163.75 443.75 175 443.75 175 C 443.75 175 507.5 181.25 490 275 C 462.5 340 462.5 333.75 398.75 341.25 C 370 330 368.75 320 368.75 320 C 368.75 320 421.25 368.75 342.5 400 C 253.75 423.75 242.5 402.5 205 391.25 C 168.75 368.75 176.25 341.25 176.25 341.25 C 176.25 341.25 198.75 387.5 122.5 396.25 C 46.25 405 17.5 387.5 3.75 316.25 C 2.08616e-06 262.5 67.5 257.5 67.5 257.5 C 67.5 257.5 26.25 258.75 15 231.25 C 3.75 203.75 -3.75 167.5 30 118.75 C 92.5 60 135 98.75 127.5 106.25 z '/>
+			</g></defs>""",
+	"network_cloud_use": """<defs><use xmlns:xlink='http://www.w3.org/1999/xlink' xlink:href='#network_cloud' /></defs>""",
+}
+
+# (name, compact) -> parsed element of DEF_TEMPLATES, see defTemplate
+_def_templates = {}
+
+def defTemplate(name, compact=False):
+	"""The element of DEF_TEMPLATES[name], parsed once per process. In
+	   compact mode without the whitespace between its elements."""
+	template = _def_templates.get((name, compact))
+	if template is None:
+		fragment = xml.dom.minidom.parseString(DEF_TEMPLATES[name])
+		if compact:
+			stripWhitespace(fragment.documentElement)
+		template = fragment.documentElement.firstChild
+		_def_templates[(name, compact)] = template
+	return template
+
+def stripWhitespace(node):
+	"""Remove the whitespace-only text nodes below node"""
+	for child in list(node.childNodes):
+		if child.nodeType == child.TEXT_NODE and not child.data.strip():
+			node.removeChild(child)
+		else:
+			stripWhitespace(child)
+
+def fillTemplate(node, params):
+	"""Fill in the %(key)s placeholders in the attributes below node"""
+	if node.nodeType != node.ELEMENT_NODE:
+		return
+	for (name, value) in list(node.attributes.items()):
+		if "%(" in value:
+			node.setAttribute(name, value % params)
+	for child in node.childNodes:
+		fillTemplate(child, params)
+
+# the id of a page, in a document of several pages
+PAGE_ID = "page%d"
+
+def pageAttributes(page, width, height, hidden):
+	"""The attributes of the nested <svg> of a page"""
+	attrs = [("id", PAGE_ID % page), ("width", f"{width}"), ("height", f"{height}")]
+	if hidden:
+		attrs.append(("display", "none"))
+	return attrs
+
 class TargetSvg(object):
-	def __init__(self):
-		self.svg_bounds = None
+	def __init__(self, css_classes=False, rtf_cache_size=1024, compact=False,
+				 compress_level=None, precision=None, reuse_shapes=False, tight=False,
+				 graphic_bounds=True):
+		# style elements by shared classes, declared once in the defs
+		self.css_classes = css_classes
+		# without indentation and line breaks
+		self.compact = compact
+		# 0-9 to gzip what is written to the sink, as for .svgz files
+		self.compress_level = compress_level
+		# decimal places of coordinates, and compact path data; None
+		# writes them as they come
+		self.precision = precision
+		# shapes of the same geometry drawn as <use> of one def
+		self.reuse_shapes = reuse_shapes
+		# pages sized to what is drawn on them rather than to the canvas
+		self.tight = tight
+		# whether graphic_bounds is kept, an entry per graphic drawn
+		self.keep_graphic_bounds = graphic_bounds
+		self.indent, self.newline = ("", "") if compact else ("\t", "\n")
+		# the bounds of the page, then of each group open in it
+		self.bounds_stack = [None]
+		# graphic ID -> bounds of the graphic, see addBounds; None if
+		# they are not kept
+		self.graphic_bounds = None
 		self.svg_dom = None
 		self.svg_current_layer = None
 		self.svg_current_font  = ""
 		self.svg_tag = None
+		# the <svg> of the page being drawn
+		self.svg_page = None
 		self.svg_graphroot = None
 		self.svg_def = None
 		self.style = None
+		# kept across pages, as documents reuse the same few styles
+		self.style_cache = StyleCache()
+		# labels repeat a lot, so their RTF is only parsed once
+		self.rtf_cache = RTFCache(rtf_cache_size)
+		# binary file a finished page is written to, if any
+		self.sink = None
+		# the pages started, in a document of several pages
+		self.pages = None
 		self.reset()
 
-	def __bb_box(self, minx, miny, w, h):
-		maxx = minx + w
-		maxy = miny + h
-		if not self.svg_bounds:
-			self.svg_bounds = (minx, miny, maxx, maxy)
-		else:
-			(ix, iy, ax, ay) = self.svg_bounds
-			if minx < ix:
-				ix = minx
-			if miny < iy:
-				iy = miny
-			if maxx > ax:
-				ax = maxx
-			if maxy > ay:
-				ay = maxy
-			self.svg_bounds = (ix, iy, ax, ay)
-
-	def __bb_point(self, px, py):
-		if not self.svg_bounds:
-			self.svg_bounds = (px, py, px, py)
-		else:
-			(ix, iy, ax, ay) = self.svg_bounds
-			if px < ix:
-				ix = px
-			if py < iy:
-				iy = py
-			if px > ax:
-				ax = px
-			if py > ay:
-				ay = py
-			self.svg_bounds = (ix, iy, ax, ay)
-
-	def reset(self):
-		self.svg_bounds = None
+	@property
+	def svg_bounds(self):
+		"""(minx, miny, maxx, maxy) of the page, or None if nothing was
+		   drawn. Groups are added to it when they are closed."""
+		return self.bounds_stack[0]
+
+	def addBounds(self, bounds, graphic_id=None):
+		"""Extend the bounds of the innermost open group, or of the page,
+		   and of the graphic graphic_id, by (minx, miny, maxx, maxy)"""
+		self.bounds_stack[-1] = geom.union_bounds(self.bounds_stack[-1], bounds)
+		if graphic_id and self.graphic_bounds is not None:
+			self.graphic_bounds[graphic_id] = geom.union_bounds(self.graphic_bounds.get(graphic_id), bounds)
+
+	def addBox(self, x, y, width, height, graphic_id=None):
+		(x, y) = (float(x), float(y))
+		self.addBounds((x, y, x + float(width), y + float(height)), graphic_id)
+
+	def reset(self, multi_page=False):
+		"""Start a document, of one page, or with multi_page of the pages
+		   drawn between startPage and endPage"""
+		self.bounds_stack = [None]
+		self.graphic_bounds = {} if self.keep_graphic_bounds else None
 		self.svg_dom = xml.dom.minidom.Document()
 		self.svg_dom.doctype = ""
 		self.svg_tag = self.svg_dom.createElement("svg")
 		self.svg_tag.setAttribute("xmlns","http://www.w3.org/2000/svg")
 		self.svg_tag.setAttribute("xmlns:xlink","http://www.w3.org/1999/xlink")
 		self.svg_dom.appendChild(self.svg_tag)
+		self.svg_page = self.svg_tag
 		def_tag = self.svg_dom.createElement("defs")
 		self.svg_tag.appendChild(def_tag)
 		self.svg_def = def_tag
 
+		self.resetStyles()
+		self.pages = [] if multi_page else None
+		self.svg_current_layer = self.svg_tag
+		if not multi_page:
+			self.startDrawing()
+
+	def startDrawing(self):
+		"""Add the group the drawing goes into to the current element"""
+		self.svg_graphroot = self.svg_dom.createElement("g")
+		self.svg_current_layer.appendChild(self.svg_graphroot)
+		self.svg_current_layer = self.svg_graphroot
+		self.startElement("g", self.styleAttributes(str(self.style)))
+
+	def startPage(self, page, width, height, title=None):
+		"""Start the next page of a multi_page document. The definitions
+		   are shared with the other pages, the styles start afresh."""
+		self.bounds_stack = [None]
+		self.resetStyleStack()
+		self.svg_current_layer = self.svg_tag
+		self.startElement("svg", pageAttributes(page, width, height, bool(self.pages)))
+		self.svg_page = self.svg_current_layer
+		self.pages.append(page)
+		if title:
+			self.addElement("title", [], title)
+		self.startDrawing()
+
+	def endPage(self):
+		self.add_document_bounds()
+
+	def resetStyles(self):
 		# set of required macros
 		self.required_defs = set()
+		# (element name, geometry) -> reused shape, in reuse_shapes mode
+		self.shapes = {}
+		# style -> class name, in css_classes mode
+		self.style_classes = {}
+		self.resetStyleStack()
 
+	def resetStyleStack(self):
 		self.style = CascadingStyles()
 		self.style.appendScope()
 		self.style["fill"]="#fff"
 		self.style["stroke"]="#000000"
 		self.style["stroke-width"]="1.000000px"
 
-		self.svg_graphroot = self.svg_dom.createElement("g")
-
-		graphic_tag = self.svg_dom.createElement("g")
-		graphic_tag.setAttribute("style",str(self.style))
-		self.svg_graphroot.appendChild(graphic_tag)
-		self.svg_tag.appendChild(self.svg_graphroot)
-		self.svg_current_layer = graphic_tag
+	def setDocumentSize(self, width, height):
+		self.svg_tag.setAttribute("width", f"{width}")
+		self.svg_tag.setAttribute("height", f"{height}")
+
+	def finish(self):
+		"""The page is complete, write it to the sink if there is one"""
+		if self.sink is not None:
+			self.save(self.sink)
+
+	def save(self, fp):
+		"""Write the page to the binary file fp, compressed if compressing"""
+		out = self.openOutput(fp)
+		self.writeSvg(out)
+		if out is not fp:
+			out.close()
+
+	def openOutput(self, fp):
+		"""fp, through gzip if compressing. Closing what is returned
+		   leaves fp open."""
+		if self.compress_level is None:
+			return fp
+		# no timestamp, so that unchanged pages give the same bytes
+		return gzip.GzipFile(fileobj=fp, mode="wb",
+							 compresslevel=self.compress_level, mtime=0)
+
+	def writeSvg(self, fp):
+		"""Serialize the document into the binary file fp"""
+		writer = io.TextIOWrapper(fp, encoding="utf-8",
+								  errors="xmlcharrefreplace", newline="\n")
+		self.svg_dom.writexml(writer, "", self.indent, self.newline, encoding="utf-8")
+		writer.detach()
+
+	def startElement(self, name, attrs):
+		"""Add an element, with attrs as (name, value) pairs, to the
+		   current one, and add the next elements to it until endElement"""
+		tag = self.svg_dom.createElement(name)
+		for (k, v) in attrs:
+			tag.setAttribute(k, v)
+		self.svg_current_layer.appendChild(tag)
+		self.svg_current_layer = tag
+
+	def endElement(self):
+		self.svg_current_layer = self.svg_current_layer.parentNode
+
+	def addElement(self, name, attrs, text=None):
+		"""Add an element without children, or with only text"""
+		tag = self.svg_dom.createElement(name)
+		for (k, v) in attrs:
+			tag.setAttribute(k, v)
+		if text is not None:
+			tag.appendChild(self.svg_dom.createTextNode(text))
+		self.svg_current_layer.appendChild(tag)
+		return tag
+
+	def addShape(self, name, origin, geometry, attrs, inline):
+		"""Add an element as a <use> of a def shared by every element of
+		   the same geometry, given by attributes relative to origin.
+		   attrs are those of the <use>, inline those of the element on
+		   its own, which is how the first one is written until a second
+		   one turns up."""
+		key = (name, tuple(geometry))
+		shape = self.shapes.get(key)
+		if shape is None:
+			tag = self.addElement(name, inline)
+			self.shapes[key] = ("shape%d" % len(self.shapes), tag, attrs, origin)
+			return
+		if not isinstance(shape, str):
+			(shape, tag, first_attrs, first_origin) = shape
+			def_tag = self.svg_dom.createElement(name)
+			for (k, v) in [("id", shape)] + list(geometry):
+				def_tag.setAttribute(k, v)
+			self.svg_def.appendChild(def_tag)
+			self.shapes[key] = shape
+			use_tag = self.svg_dom.createElement("use")
+			for (k, v) in self.useAttributes(shape, first_origin, first_attrs):
+				use_tag.setAttribute(k, v)
+			tag.parentNode.replaceChild(use_tag, tag)
+		self.addElement("use", self.useAttributes(shape, origin, attrs))
+
+	def useAttributes(self, shape, origin, attrs):
+		return attrs + [("xlink:href", "#" + shape),
+						("x", self.num(origin[0])), ("y", self.num(origin[1]))]
+
+	def shapeNumber(self, value):
+		"""A coordinate relative to the origin of a reused shape, rounded
+		   so that shapes at different places compare equal"""
+		return svgfmt.formatNumber(value, 6 if self.precision is None else self.precision)
+
+	def addTemplate(self, name, params=None):
+		self.svg_current_layer.appendChild(self.cloneTemplate(name, params))
+
+	def styleAttributes(self, style):
+		"""The attributes styling an element inline, or in css_classes
+		   mode by the class shared by everything that has the same style"""
+		if not self.css_classes:
+			return [("style", style)]
+		if not style:
+			return []
+		name = self.style_classes.get(style)
+		if name is None:
+			name = "s%d" % len(self.style_classes)
+			self.style_classes[style] = name
+		return [("class", name)]
+
+	def styleRules(self):
+		return "\n".join(".%s{%s}" % (name, style) for (style, name) in self.style_classes.items())
+
+	def add_style_classes(self):
+		"""Declare the classes used in css_classes mode"""
+		if not self.style_classes:
+			return
+		style_tag = self.svg_dom.createElement("style")
+		style_tag.setAttribute("type", "text/css")
+		style_tag.appendChild(self.svg_dom.createTextNode(self.styleRules()))
+		self.svg_def.insertBefore(style_tag, self.svg_def.firstChild)
 
 	@property
 	def svg(self):
-		"""Return the svg document"""
-		return self.svg_dom.toprettyxml(encoding='utf-8')
+		"""Return the svg document, uncompressed"""
+		svg = io.BytesIO()
+		self.writeSvg(svg)
+		return svg.getvalue()
+
+	def num(self, value):
+		"""A coordinate or length as written in attributes"""
+		if self.precision is None:
+			return str(value)
+		return svgfmt.formatNumber(value, self.precision)
+
+	def translate(self, x, y):
+		if self.precision is None:
+			return "translate(%f,%f)" % (x, y)
+		return "translate(%s,%s)" % (self.num(x), self.num(y))
 
 	def mkHex(self, s):
 		# s is a string of a float
@@ -524,16 +898,16 @@ class TargetSvg(object):
 
 		self.svg_current_font = ";".join(fontstuffs)
 
-	def addLayer(self, graffleInterpreter, GraphicsList):
-		current_layer = self.svg_current_layer
+	def addLayer(self, graffleInterpreter, GraphicsList, graphic_id=None):
 		self.style.appendScope()
-		g_emt = self.svg_dom.createElement("g")
-		g_emt.setAttribute("style",str(self.style))
-		current_layer.appendChild(g_emt)
-		self.svg_current_layer = g_emt
+		self.startElement("g", self.styleAttributes(str(self.style)))
+		self.bounds_stack.append(None)
 		graffleInterpreter.iterateGraffleGraphics(GraphicsList)
+		bounds = self.bounds_stack.pop()
+		if bounds is not None:
+			self.addBounds(bounds, graphic_id)
 		self.style.popScope()
-		self.svg_current_layer = current_layer
+		self.endElement()
 
 	def addAdjustableArrow(self, bounds, graphic,**opts):
 		x,y,width,height = [float(a) for a in bounds]
@@ -551,27 +925,32 @@ class TargetSvg(object):
 		self.addPath([[x,ymiddle], [xmiddle,y+height], [x+width,ymiddle], [xmiddle,y]],closepath=True,**opts)
 
 	def addPath(self, pts, **opts):
-		# do geometry mapping here
+		# do geometry mapping here, all of it in one pass
 		mypts = pts
-		if opts.get("HFlip",False):
-			mypts = geom.h_flip_points(mypts)
-		if opts.get("VFlip",False):
-			mypts = geom.v_flip_points(mypts)
-		if opts.get("Rotation") is not None:
-			mypts = geom.rotate_points(mypts,opts["Rotation"])
-
-		for (localx, localy) in mypts:
-			self.__bb_point(localx, localy)
-
-		ptStrings = [",".join([str(b) for b in a]) for a in mypts]
-		line_string = "M %s"%ptStrings[0] + " ".join(" L %s"%a for a in ptStrings[1:] )
-		if opts.get("closepath",False):
-			line_string = line_string + " z"
-		path_tag = self.svg_dom.createElement("path")
-		path_tag.setAttribute("id", opts.get("id",""))
-		path_tag.setAttribute("style", str(self.style.scopeStyle()))
-		path_tag.setAttribute("d", line_string)
-		self.svg_current_layer.appendChild(path_tag)
+		transform = geom.shape_transform(pts, opts.get("HFlip",False), opts.get("VFlip",False),
+										 opts.get("Rotation"))
+		if transform is not None:
+			mypts = transform.apply(pts)
+
+		self.addBounds(geom.points_bounds(mypts), opts.get("id"))
+
+		if self.precision is not None:
+			line_string = svgfmt.pathData(mypts, self.precision, opts.get("closepath",False))
+		else:
+			ptStrings = ["%s,%s" % (x, y) for (x, y) in mypts]
+			line_string = "M %s"%ptStrings[0] + " ".join(" L %s"%a for a in ptStrings[1:] )
+			if opts.get("closepath",False):
+				line_string = line_string + " z"
+		attrs = [("id", opts.get("id",""))] + self.styleAttributes(self.style.scopeString())
+		if self.reuse_shapes:
+			(ox, oy) = mypts[0]
+			relative = svgfmt.pathData([(px - ox, py - oy) for (px, py) in mypts],
+									   6 if self.precision is None else self.precision,
+									   opts.get("closepath",False))
+			self.addShape("path", (ox, oy), [("d", relative)], attrs,
+						  attrs + [("d", line_string)])
+			return
+		self.addElement("path", attrs + [("d", line_string)])
 
 	def addHorizontalTriangle(self, bounds, **opts):
 		"""Graffle has the "HorizontalTriangle" Shape"""
@@ -582,15 +961,11 @@ class TargetSvg(object):
 	def addImage(self, bounds, **opts):
 		"""SVG viewers should support images - unfortunately many don't :-("""
 		x,y,width,height = [float(a) for a in bounds]
-		image_tag = self.svg_dom.createElement("image")
-		image_tag.setAttribute("x", str(x))
-		image_tag.setAttribute("y", str(y))
-		image_tag.setAttribute("width", str(width))
-		image_tag.setAttribute("height", str(height))
-		image_tag.setAttribute("xlink:href", str(opts.get("href","")))
-		image_tag.setAttribute("style", str(self.style.scopeStyle()))
-		self.__bb_box(x, y, width, height)
-		self.svg_current_layer.appendChild(image_tag)
+		self.addElement("image", [("x", self.num(x)), ("y", self.num(y)),
+								  ("width", self.num(width)), ("height", self.num(height)),
+								  ("xlink:href", str(opts.get("href","")))]
+						+ self.styleAttributes(self.style.scopeString()))
+		self.addBox(x, y, width, height, opts.get("id"))
 
 	def addRightTriangle(self,  bounds, **opts):
 		"""Graffle has the "RightTriangle" Shape"""
@@ -608,59 +983,72 @@ class TargetSvg(object):
 		"""Add an svg rect"""
 		if opts is None:
 			opts = {}
-		rect_tag = self.svg_dom.createElement("rect")
-		rect_tag.setAttribute("id",opts.get("id",""))
-		rect_tag.setAttribute("width",str(opts["width"]))
-		rect_tag.setAttribute("height",str(opts["height"]))
-		rect_tag.setAttribute("x",str(opts.get("x","0")))
-		rect_tag.setAttribute("y",str(opts.get("y","0")))
+		attrs = [("id",opts.get("id","")),
+				 ("width",self.num(opts["width"])),
+				 ("height",self.num(opts["height"])),
+				 ("x",self.num(opts.get("x","0"))),
+				 ("y",self.num(opts.get("y","0")))]
 		if opts.get("rx") is not None:
-			rect_tag.setAttribute("rx",str(opts["rx"]))
-			rect_tag.setAttribute("ry",str(opts["ry"]))
-		rect_tag.setAttribute("style", str(self.style.scopeStyle()))
-		self.svg_current_layer.appendChild(rect_tag)
-		self.__bb_box(opts.get("x","0"), opts.get("y","0"), opts["width"], opts["height"])
+			attrs.append(("rx",self.num(opts["rx"])))
+			attrs.append(("ry",self.num(opts["ry"])))
+		style = self.styleAttributes(self.style.scopeString())
+		if self.reuse_shapes:
+			geometry = [("width",self.shapeNumber(opts["width"])),
+						("height",self.shapeNumber(opts["height"]))]
+			if opts.get("rx") is not None:
+				geometry.append(("rx",self.shapeNumber(opts["rx"])))
+				geometry.append(("ry",self.shapeNumber(opts["ry"])))
+			self.addShape("rect", (float(opts.get("x","0")), float(opts.get("y","0"))), geometry,
+						  attrs[:1] + style, attrs + style)
+		else:
+			self.addElement("rect", attrs + style)
+		self.addBox(opts.get("x","0"), opts.get("y","0"), opts["width"], opts["height"], opts.get("id"))
 
 	def addEllipse(self,  bounds, **opts):
 		c = [bounds[i] + (bounds[i+2]/2.) for i in [0,1]] # centre of circle
 		rx = bounds[2]/2.
 		ry = bounds[3]/2.
-		circle_tag = self.svg_dom.createElement("ellipse")
-		circle_tag.setAttribute("id", opts.get("id",""))
-		circle_tag.setAttribute("style", str(self.style.scopeStyle()))
-		circle_tag.setAttribute("cx", str(c[0]))
-		circle_tag.setAttribute("cy", str(c[1]))
-		circle_tag.setAttribute("rx", str(rx))
-		circle_tag.setAttribute("ry", str(ry))
-		self.svg_current_layer.appendChild(circle_tag)
-		self.__bb_box(c[0] - rx, c[1] - ry, c[0] + rx, c[1] + ry)
+		attrs = [("id", opts.get("id",""))] + self.styleAttributes(self.style.scopeString())
+		inline = attrs + [("cx", self.num(c[0])), ("cy", self.num(c[1])),
+						  ("rx", self.num(rx)), ("ry", self.num(ry))]
+		if self.reuse_shapes:
+			self.addShape("ellipse", c, [("rx", self.shapeNumber(rx)), ("ry", self.shapeNumber(ry))],
+						  attrs, inline)
+		else:
+			self.addElement("ellipse", inline)
+		self.addBounds((c[0] - rx, c[1] - ry, c[0] + rx, c[1] + ry), opts.get("id"))
 
 	def addCloud(self,bounds,**opts):
 		"""Add a cloud element"""
 		self.required_defs.add("network_cloud")
 		x, y, dx, dy = bounds
-		cloud_tag = self.svg_dom.createElement("g")
-		cloud_tag.setAttribute("id", opts.get("id",""))
-		cloud_tag.setAttribute("style", str(self.style.scopeStyle()))
-		cloud_tag.setAttribute("transform","translate(%f,%f) scale(%f,%f)" % (x,y,float(dx)/500.0,float(dy)/500.0))
-		p = xml.dom.minidom.parseString("<use xmlns:xlink='http://www.w3.org/1999/xlink' xlink:href='#network_cloud' />")
-		def_node = p.childNodes[0]
-		cloud_tag.appendChild(def_node)
-		self.svg_current_layer.appendChild(cloud_tag)
-		self.__bb_box(x, y, dx, dy)
+		self.startElement("g", [("id", opts.get("id",""))]
+						  + self.styleAttributes(self.style.scopeString())
+						  + [("transform",self.cloudTransform(x, y, dx, dy))])
+		self.addTemplate("network_cloud_use")
+		self.endElement()
+		self.addBox(x, y, dx, dy, opts.get("id"))
+
+	def cloudTransform(self, x, y, dx, dy):
+		(sx, sy) = (float(dx)/500.0, float(dy)/500.0)
+		if self.precision is None:
+			return "translate(%f,%f) scale(%f,%f)" % (x,y,sx,sy)
+		# the scale applies to the 500 wide cloud, so it needs more places
+		scale_places = self.precision + 3
+		return "%s scale(%s,%s)" % (self.translate(x, y),
+									svgfmt.formatNumber(sx, scale_places),
+									svgfmt.formatNumber(sy, scale_places))
 
 	def addText(self,**opts):
 		"""Add an svg text element"""
-		text_tag = self.svg_dom.createElement("text")
-		text_tag.setAttribute("id",str(opts.get("id",""))+"_text")
-		text_tag.setAttribute("x",str(opts.get("x","0")))
-		text_tag.setAttribute("y",str(opts.get("y","0")))
-		# text_tag.setAttribute("dominant-baseline","mathematical")
-		text_tag.setAttribute("style", self.svg_current_font)
-		self.svg_current_layer.appendChild(text_tag)
+		# ("dominant-baseline","mathematical")
+		self.startElement("text", [("id",str(opts.get("id",""))+"_text"),
+								   ("x",self.num(opts.get("x","0"))),
+								   ("y",self.num(opts.get("y","0")))]
+						  + self.styleAttributes(self.svg_current_font))
 
 		# Generator
-		lines = extractRTFString(opts["rtftext"])
+		lines = self.rtf_cache.extract(opts["rtftext"])
 		font_info =  opts.get("fontinfo",None)
 		if font_info is not None:
 			font_height = int(font_info.get("Size"))
@@ -676,259 +1064,395 @@ class TargetSvg(object):
 			y_diff+= float(span["style"].get("font-size","%.1fpx"%font_height)[:-2])
 			linenb+=1
 			opts["id"]=str(line_id)+"_line"+str(linenb)
-			self.addLine(text_tag,text = span["string"], style = span["style"],\
+			self.addLine(text = span["string"], style = span["style"],\
 						y_pos=y_diff, line_height =font_height, **opts)
-		self.__bb_box(opts.get("x", "0"), opts.get("y", "0"), opts.get("width", "0"), opts.get("height", "0"))
+		self.endElement()
+		self.addBox(opts.get("x", "0"), opts.get("y", "0"), opts.get("width", "0"), opts.get("height", "0"),
+					line_id)
 
-	def addLine(self,textnode, **opts):
-		"""Add a line of text"""
-		tspan_node = self.svg_dom.createElement("tspan")
-		tspan_node.setAttribute("id",opts.get("id",""))
+	def addLine(self, **opts):
+		"""Add a line of text to the text element being written"""
+		attrs = [("id",opts.get("id",""))]
 		align = opts.get("style", {"text-align":"left"}).get("text-align", "left")
 		x = opts.get("x",0)
 		if align=="center":
-			tspan_node.setAttribute("text-anchor","middle")
+			attrs.append(("text-anchor","middle"))
 			x+=opts.get("width", 0)/2
 		elif align == "right":
 			x+=opts.get("width", 0)
-		tspan_node.setAttribute("x",str(x))
+		attrs.append(("x",self.num(x)))
 		y_pos = float(opts.get("y_pos",0))
-		tspan_node.setAttribute("y",str(y_pos))
-		if (opts.get("style") is not None) and len(opts.get("style"))>0:
-			thestyle = opts.get("style")
-			parstyle = textnode.getAttribute("style")	# parent style
-			for (k,v) in thestyle.items():
-				if parstyle.find(k) >= 0:
-					# the parent text has the same attribute in the style
-					next
-				tspan_node.setAttribute(k,v)
-		actual_string = self.svg_dom.createTextNode(opts.get("text"," "))
-		tspan_node.appendChild(actual_string)
-		textnode.appendChild(tspan_node)
+		attrs.append(("y",self.num(y_pos)))
+		if opts.get("style") is not None:
+			attrs.extend(opts["style"].items())
+		self.addElement("tspan", attrs, opts.get("text"," "))
 
 	def add_document_bounds(self):
 		if self.svg_bounds:
 			(minx, miny, maxx, maxy) = self.svg_bounds
-#			self.svg_tag.setAttribute("width", str(maxx - minx))
-#			self.svg_tag.setAttribute("height", str(maxy - miny))
-			self.svg_graphroot.setAttribute('transform', ("translate(%f,%f)" % (-minx, -miny)))
-
-	def add_requirements(self):
+			if self.tight:
+				(width, height) = (self.num(maxx - minx), self.num(maxy - miny))
+				self.svg_page.setAttribute("width", width)
+				self.svg_page.setAttribute("height", height)
+				self.svg_page.setAttribute("viewBox", "0 0 %s %s" % (width, height))
+			self.svg_graphroot.setAttribute('transform', self.translate(-minx, -miny))
+
+	def cloneTemplate(self, name, params=None):
+		"""A copy of a DEF_TEMPLATES element for this document"""
+		node = self.svg_dom.importNode(defTemplate(name, self.compact), True)
+		if params:
+			fillTemplate(node, params)
+		return node
+
+	def requiredTemplates(self):
+		"""(name, params) of the DEF_TEMPLATES the page requires"""
 		for required in self.required_defs:
-			if required.startswith("Arrow1Lend"):
-				(shape,  color, width) = required.split( "_")
-				scale=1.0/((float(width[0:-2])-1.0)/20.0+1.0)
-				p = xml.dom.minidom.parseString("""
-				<defs><marker
-				   orient='auto'
-				   refY='0.0'
-				   refX='0.0'
-				   id='%(id)s'
-				   style='overflow:visible;'>
-				  <path
-					 id='path_%(id)s'
-					 d='M -5,0.0 L -5,-2.0 L 0.0,0.0 L -5,2.0 z '
-					 style='fill:#%(color)s;fill-rule:evenodd;stroke:#%(color)s;stroke-width:1.0px;marker-start:none;'
-					 transform='scale(%(scale)f)' />
-				</marker></defs>"""%{"id":required, "color":color,  "scale":scale})
-				def_node = p.childNodes[0]
-				for node in def_node.childNodes:
-					self.svg_def.appendChild(node)
-			if required.startswith("Arrow1Lstart"):
+			if required.startswith("Arrow1Lend") or required.startswith("Arrow1Lstart"):
 				(shape,  color, width) = required.split( "_")
 				scale=1.0/((float(width[0:-2])-1.0)/20.0+1.0)
-				p = xml.dom.minidom.parseString("""
-				<defs><marker
-				   orient='auto'
-				   refY='0.0'
-				   refX='0.0'
-				   id='%(id)s'
-				   style='overflow:visible'>
-				  <path
-					 id='path_%(id)s'
-					 d='M 5,0.0 L 5.0,-2.0 L 0.0,0.0 L 5.0,2.0 z'
-					 style='fill:#%(color)s;fill-rule:evenodd;stroke:#%(color)s;stroke-width:1.0px;marker-start:none'
-					 transform='scale(%(scale)f)'/>
-				</marker></defs>"""%{"id":required, "color":color,  "scale":scale})
-				def_node = p.childNodes[0]
-				for node in def_node.childNodes:
-					self.svg_def.appendChild(node)
-
-		if "Arrow2Lend" in self.required_defs:
-			# TODO
-			p = xml.dom.minidom.parseString("""
-			<defs><marker
-			   orient='auto'
-			   refY='0.0'
-			   refX='0.0'
-			   id='Arrow2Lend'
-			   overflow='visible'
-			   stroke='currentColor'>
-			  <path
-				 id='Arrow2Lend'
-				 d='M 10.0,-2.0 L 0.0,0.0 L 10.0,2.0'
-				 style='fill:none;stroke:#000000;stroke-width:1.0px;marker-start:none' />
-			</marker></defs>""")
-			def_node = p.childNodes[0]
-			for node in def_node.childNodes:
-				self.svg_def.appendChild(node)
-
-		if "Arrow2Lstart" in self.required_defs:
-			p = xml.dom.minidom.parseString("""
-			<defs><marker
-			   orient='auto'
-			   refY='0.0'
-			   refX='0.0'
-			   id='Arrow2Lstart'
-			   overflow='visible'
-			   stroke='currentColor'>
-			  <path
-				 id='pathStickArrow'
-				 d='M -10.0,-2.0 L 0.0,0.0 L -10.0,2.0'
-				 style='fill:none;stroke:#000000;stroke-width:1.0px;marker-start:none'/>
-			</marker></defs>""")
-			def_node = p.childNodes[0]
-			for node in def_node.childNodes:
-				self.svg_def.appendChild(node)
-
-		if "DropShadow" in self.required_defs:
-			p = xml.dom.minidom.parseString("""
-			<defs><filter id='DropShadow' filterRes='100' x='0' y='0'>
-			   <feGaussianBlur stdDeviation='3' result='MyBlur'/>
-			   <feOffset in='MyBlur' dx='2' dy='4' result='movedBlur'/>
-			   <feMerge>
-				   <feMergeNode in='movedBlur'/>
-				   <feMergeNode in='SourceGraphic'/>
-			   </feMerge>
-			</filter></defs>""")
-			def_node = p.childNodes[0]
-			for node in def_node.childNodes:
-				self.svg_def.appendChild(node)
+				yield (shape, {"id":required, "color":color,  "scale":scale})
 
-		if "CrowBall" in self.required_defs:
-			p = xml.dom.minidom.parseString("""
-			<defs><marker
-			refX='0'
-			refY='0'
-			orient='auto'
-			id='mCrowBall'
-			style='overflow:visible'>
-			<path d='M 0.0,2.5 L 7.5,0.0 L 0.0,-2.5'
-			 style='stroke:#000;stroke-width:1.0px;marker-start:none;fill:none;' />
-			<circle cx='10' cy='0' r='2.5' style='stroke-width:1px; stroke: #000; fill:none;'/>
-			</marker></defs>""")
-			def_node = p.childNodes[0]
-			for node in def_node.childNodes:
-				self.svg_def.appendChild(node)
+		for required in ("Arrow2Lend", "Arrow2Lstart", "DropShadow", "CrowBall", "Bar", "network_cloud"):
+			if required in self.required_defs:
+				yield (required, None)
 
-		if "Bar" in self.required_defs:
-			p = xml.dom.minidom.parseString("""
-			<defs><marker
-			refX='0'
-			refY='0'
-			orient='auto'
-			id='mBar'
-			style='overflow:visible'>
-			<path d='M -7.5,-2.5 L -7.5,2.5'
-			 style='stroke:#000;stroke-width:1.0px;marker-start:none;fill:none;' />
-			</marker></defs>""")
-			def_node = p.childNodes[0]
-			for node in def_node.childNodes:
-				self.svg_def.appendChild(node)
-
-		if "network_cloud" in self.required_defs:
-			''' cloud shape 500x500 '''
-			p = xml.dom.minidom.parseString("""
-			<defs><g id='network_cloud'>
-			<path d='M 127.5 106.25 C 127.5 106.25 126.25 18.7501 231.25 45 C 336.25 71.25 317.5 115 318.75 115 C 320 115 300 61.25 380 51.25 C 452.5 57.5 486.25 71.25 482.5 117.5 C 478.75 163.75 443.75 175 443.75 175 C 443.75 175 507.5 181.25 490 275 C 462.5 340 462.5 333.75 398.75 341.25 C 370 330 368.75 320 368.75 320 C 368.75 320 421.25 368.75 342.5 400 C 253.75 423.75 242.5 402.5 205 391.25 C 168.75 368.75 176.25 341.25 176.25 341.25 C 176.25 341.25 198.75 387.5 122.5 396.25 C 46.25 405 17.5 387.5 3.75 316.25 C 2.08616e-06 262.5 67.5 257.5 67.5 257.5 C 67.5 257.5 26.25 258.75 15 231.25 C 3.75 203.75 -3.75 167.5 30 118.75 C 92.5 60 135 98.75 127.5 106.25 z '/>
-			</g></defs>""")
-			def_node = p.childNodes[0]
-			for node in def_node.childNodes:
-				self.svg_def.appendChild(node)
+	def add_requirements(self):
+		self.add_style_classes()
+		for (name, params) in self.requiredTemplates():
+			self.svg_def.appendChild(self.cloneTemplate(name, params))
 
 	def setGraffleStyle(self, style):
+		try:
+			key = self.graffleStyleKey(style)
+			entry = self.style_cache.get(key)
+		except TypeError:
+			# something unhashable in there, do without the cache
+			key = entry = None
+		if entry is None:
+			entry = self.resolveGraffleStyle(style)
+			if key is not None:
+				self.style_cache.put(key, *entry)
+		styles, defs = entry
+		self.style.update(styles)
+		self.required_defs.update(defs)
+
+	def graffleStyleKey(self, style):
+		"""The parts of a graffle Style dict that resolveGraffleStyle
+		   reads, keep the two in step"""
+		fill = style.get("fill")
+		if fill is not None:
+			color = fill.get("Color")
+			fill = (fill.get("Draws",""), color and tuple(color.items()))
+		stroke = style.get("stroke")
+		if stroke is not None:
+			color = stroke.get("Color")
+			head, tail = stroke.get("HeadArrow"), stroke.get("TailArrow")
+			stroke = (stroke.get("Draws",""), color and tuple(color.items()),
+					  stroke.get("Width"), head, stroke.get("HeadScale"),
+					  tail, stroke.get("TailScale"), stroke.get("Pattern"))
+			if "FilledArrow" in (head, tail):
+				# the marker is named after the stroke, which may be inherited
+				stroke += (self.style["stroke"], self.style["stroke-width"])
+		return (fill, stroke, style.get("shadow",{}).get("Draws","NO"))
+
+	def resolveGraffleStyle(self, style):
+		"""Work out the SVG styles a graffle Style dict sets in the
+		   current scope, and the definitions they require"""
+		scratch = CascadingStyles()
+		for key in ("stroke", "stroke-width"):
+			try:
+				scratch.appendScope({key: self.style[key]})
+			except KeyError:
+				pass
+		scratch.appendScope()
+		defs = set()
+
 		if style.get("fill") is not None:
 			fill = style.get("fill")
 			if fill.get("Draws","") == "NO":
 				# don't display
-				self.style["fill"]="none"
+				scratch["fill"]="none"
 			else:
 				grap_col = fill.get("Color")
 				if grap_col is not None:
 					fill_col = self.extract_colour(grap_col)
-					self.style["fill"]="#%s"%fill_col
+					scratch["fill"]="#%s"%fill_col
 
 		if style.get("stroke") is not None:
 			stroke = style.get("stroke")
 			if stroke.get("Draws","") == "NO":
-				self.style["stroke"]="none"
+				scratch["stroke"]="none"
 			else:
 				grap_col = stroke.get("Color",{"r":0.,"g":0.,"b":0.})
 				if grap_col is not None:
 					stroke_col = self.extract_colour(grap_col)
-					self.style["stroke"]="#%s"%stroke_col
+					scratch["stroke"]="#%s"%stroke_col
 
 			if stroke.get("Width") is not None:
 				width = stroke["Width"]
-				self.style["stroke-width"]="%fpx"%float(width)
+				scratch["stroke-width"]="%fpx"%float(width)
 
 			if stroke.get("HeadArrow") is not None:
 				headarrow = stroke["HeadArrow"]
 				marker_end = "none"
 				headscale = stroke.get("HeadScale", 1.0)
 				if headarrow == "FilledArrow":
-					marker_end = "Arrow1Lend_" + self.style["stroke"] [1:] + "_" + "%fpx"%(float(self.style["stroke-width"][0:-2])*headscale)
-					self.style["marker-end"]="url(#%s)"%marker_end
-					self.required_defs.add(marker_end)
+					marker_end = "Arrow1Lend_" + scratch["stroke"] [1:] + "_" + "%fpx"%(float(scratch["stroke-width"][0:-2])*headscale)
+					scratch["marker-end"]="url(#%s)"%marker_end
+					defs.add(marker_end)
 				elif headarrow == "StickArrow":
-					self.style["marker-end"]="url(#Arrow2Lend)"
-					self.required_defs.add("Arrow2Lend")
+					scratch["marker-end"]="url(#Arrow2Lend)"
+					defs.add("Arrow2Lend")
 				elif headarrow == "Bar":
 					#TODO
-					self.style["marker-end"]="url(#mBar)"
-					self.required_defs.add("Bar")
+					scratch["marker-end"]="url(#mBar)"
+					defs.add("Bar")
 				elif headarrow == "0":
-					self.style["marker-end"] = "none"
+					scratch["marker-end"] = "none"
 				else:
 					print("unknown HeadArrow "+ headarrow)
-					self.style["marker-end"]="url(#Arrow2Lend)"
-					self.required_defs.add("Arrow2Lend")
+					scratch["marker-end"]="url(#Arrow2Lend)"
+					defs.add("Arrow2Lend")
 
 			if stroke.get("TailArrow") is not None:
 				tailarrow = stroke["TailArrow"]
 				tailscale = stroke.get("TailScale",1.0)
 				if tailarrow == "FilledArrow":
-					marker_start = "Arrow1Lstart_" + self.style["stroke"] [1:] + "_" + "%fpx"%(float(self.style["stroke-width"][0:-2])*tailscale)
-					self.style["marker-start"]="url(#%s)"%marker_start
-					self.required_defs.add(marker_start)
+					marker_start = "Arrow1Lstart_" + scratch["stroke"] [1:] + "_" + "%fpx"%(float(scratch["stroke-width"][0:-2])*tailscale)
+					scratch["marker-start"]="url(#%s)"%marker_start
+					defs.add(marker_start)
 				elif tailarrow =="StickArrow":
-					self.style["marker-end"]="url(#Arrow2Lstart)"
-					self.required_defs.add("Arrow2Lstart")
+					scratch["marker-end"]="url(#Arrow2Lstart)"
+					defs.add("Arrow2Lstart")
 				elif tailarrow == "CrowBall":
-					self.style["marker-start"]  = "url(#mCrowBall)"
-					self.required_defs.add("CrowBall")
+					scratch["marker-start"]  = "url(#mCrowBall)"
+					defs.add("CrowBall")
 
 				elif tailarrow == "0":
-					self.style["marker-start"]="none"
+					scratch["marker-start"]="none"
 				else:
 					print("unknown TailArrow "+ tailarrow)
-					self.style["marker-end"]="url(#Arrow2Lstart)"
-					self.required_defs.add("Arrow2Lstart")
+					scratch["marker-end"]="url(#Arrow2Lstart)"
+					defs.add("Arrow2Lstart")
 
 			if stroke.get("Pattern") is not None:
 				pattern = stroke["Pattern"]
 				if pattern == 1:
-					self.style["stroke-dasharray"]="3 3"
+					scratch["stroke-dasharray"]="3 3"
 				elif pattern == 2:
-					self.style["stroke-dasharray"]="5 5"
+					scratch["stroke-dasharray"]="5 5"
 				else:
 					print("unknown pattern " + str(pattern))
-					self.style["stroke-dasharray"]="1 1"
+					scratch["stroke-dasharray"]="1 1"
 
 		if style.get("shadow",{}).get("Draws","NO") != "NO":
 			# for some reason graffle has a shadow by default
-			self.required_defs.add("DropShadow")
-			self.style["filter"]="url(#DropShadow)"
+			defs.add("DropShadow")
+			scratch["filter"]="url(#DropShadow)"
+
+		return (scratch.popScope(), frozenset(defs))
+
+# the drawing, in the defs of a page written by StreamingTargetSvg
+STREAM_PAGE_ID = "graffle2svg-page"
+
+class StreamingTargetSvg(TargetSvg):
+	"""Writes the page to the binary file sink while it is converted,
+	   instead of building a DOM of it first, so that memory goes with
+	   the nesting depth and not with the number of elements.
+
+	   How far the drawing has to be moved is only known once all of it
+	   is written, so it goes into the defs, followed by the definitions
+	   it requires, and is placed by a <use> at the end. The pages of a
+	   multi_page document are each placed by a <use> in their nested
+	   <svg>. Without a sink the page is kept for the svg property."""
+
+	def __init__(self, sink=None, graphic_bounds=False, **opts):
+		if opts.get("tight"):
+			raise ValueError("a streamed page is sized before its bounds are known")
+		self.out = None
+		self.compressor = None
+		self.page = None
+		# unlike the page bounds, these grow with the document
+		TargetSvg.__init__(self, graphic_bounds=graphic_bounds, **opts)
+		self.sink = sink
+		# elements drawn before the page is reset are dropped
+		self.pending = False
+
+	def reset(self, multi_page=False):
+		if self.out is not None:
+			# a page left unfinished, the sink is not ours to close
+			self.closeOutput()
+		self.bounds_stack = [None]
+		self.graphic_bounds = {} if self.keep_graphic_bounds else None
+		self.resetStyles()
+		# [page, width, height, title, bounds] of the pages started
+		self.pages = [] if multi_page else None
+		self.root_attrs = self.styleAttributes(str(self.style))
+		self.size = None
+		self.open_tags = []
+		# the page is started by the first element written
+		self.pending = True
+
+	def setDocumentSize(self, width, height):
+		"""Only taken into account before the first element"""
+		self.size = (width, height)
+
+	def startDocument(self):
+		self.pending = False
+		self.page = None
+		if self.sink is None:
+			sink = self.page = io.BytesIO()
+		else:
+			sink = self.openOutput(self.sink)
+			if sink is not self.sink:
+				self.compressor = sink
+		self.out = io.TextIOWrapper(sink, encoding="utf-8",
+									errors="xmlcharrefreplace", newline="\n")
+		self.out.write('<?xml version="1.0" encoding="utf-8"?>' + self.newline)
+		attrs = [("xmlns","http://www.w3.org/2000/svg"),
+				 ("xmlns:xlink","http://www.w3.org/1999/xlink")]
+		if self.size is not None:
+			attrs += [("width", f"{self.size[0]}"), ("height", f"{self.size[1]}")]
+		self.startElement("svg", attrs)
+		self.startElement("defs", [])
+		if self.pages is None:
+			self.startElement("g", [("id", STREAM_PAGE_ID)])
+			self.startElement("g", self.root_attrs)
+
+	def startPage(self, page, width, height, title=None):
+		self.bounds_stack = [None]
+		self.resetStyleStack()
+		self.pages.append([page, width, height, title, None])
+		self.startElement("g", [("id", "%s-%d" % (STREAM_PAGE_ID, page))])
+		self.startElement("g", self.styleAttributes(str(self.style)))
+
+	def endPage(self):
+		while len(self.open_tags) > 2:
+			self.endElement()
+		self.pages[-1][4] = self.svg_bounds
+
+	def startPending(self):
+		"""Start the document if it waits for its first element, before
+		   that element's indentation is taken from open_tags"""
+		if self.out is None and self.pending:
+			self.startDocument()
+
+	def write(self, s):
+		self.startPending()
+		if self.out is not None:
+			self.out.write(s)
+
+	def attrString(self, attrs):
+		# like setAttribute, a repeated name keeps its place and last value
+		return "".join(' %s="%s"' % (k, escape(v, {'"': "&quot;"}))
+					   for (k, v) in dict(attrs).items())
+
+	def startElement(self, name, attrs):
+		self.startPending()
+		self.write("%s<%s%s>%s" % (self.indent * len(self.open_tags), name,
+									self.attrString(attrs), self.newline))
+		self.open_tags.append(name)
+
+	def endElement(self):
+		name = self.open_tags.pop()
+		self.write("%s</%s>%s" % (self.indent * len(self.open_tags), name, self.newline))
+
+	def addElement(self, name, attrs, text=None):
+		self.startPending()
+		indent = self.indent * len(self.open_tags)
+		if text is None:
+			self.write("%s<%s%s/>%s" % (indent, name, self.attrString(attrs), self.newline))
+		else:
+			self.write("%s<%s%s>%s</%s>%s" % (indent, name, self.attrString(attrs),
+											  escape(text), name, self.newline))
+
+	def addShape(self, name, origin, geometry, attrs, inline):
+		"""Every shape is a <use>, as written elements can not be turned
+		   into one later. The defs are written by finish."""
+		key = (name, tuple(geometry))
+		shape = self.shapes.get(key)
+		if shape is None:
+			shape = self.shapes[key] = "shape%d" % len(self.shapes)
+		self.addElement("use", self.useAttributes(shape, origin, attrs))
+
+	def addTemplate(self, name, params=None):
+		node = defTemplate(name, self.compact).cloneNode(True)
+		if params:
+			fillTemplate(node, params)
+		self.startPending()
+		node.writexml(self, self.indent * len(self.open_tags), self.indent, self.newline)
+
+	def add_requirements(self):
+		"""Written by finish, after the drawing"""
+
+	def add_document_bounds(self):
+		"""Written by finish, after the drawing"""
+
+	def finish(self):
+		"""Write the definitions and the placement of the drawing, and
+		   hand the sink back"""
+		if self.out is None:
+			if not self.pending:
+				return
+			self.startDocument()
+		while len(self.open_tags) > 2:
+			self.endElement()
+		if self.style_classes:
+			self.addElement("style", [("type", "text/css")], self.styleRules())
+		for (name, params) in self.requiredTemplates():
+			self.addTemplate(name, params)
+		for ((name, geometry), shape) in self.shapes.items():
+			self.addElement(name, [("id", shape)] + list(geometry))
+		self.endElement()
+		if self.pages is None:
+			self.placeDrawing(STREAM_PAGE_ID, self.svg_bounds)
+		for (index, (page, width, height, title, bounds)) in enumerate(self.pages or ()):
+			self.startElement("svg", pageAttributes(page, width, height, index > 0))
+			if title:
+				self.addElement("title", [], title)
+			self.placeDrawing("%s-%d" % (STREAM_PAGE_ID, page), bounds)
+			self.endElement()
+		self.endElement()
+		self.closeOutput()
+
+	def placeDrawing(self, drawing, bounds):
+		"""A <use> of the drawing in the defs, moved by bounds as
+		   add_document_bounds would"""
+		attrs = [("xlink:href", "#" + drawing)]
+		if bounds:
+			(minx, miny, maxx, maxy) = bounds
+			attrs.append(("transform", self.translate(-minx, -miny)))
+		self.addElement("use", attrs)
+
+	def closeOutput(self):
+		# flushes, and leaves the sink open
+		self.out.detach()
+		self.out = None
+		if self.compressor is not None:
+			self.compressor.close()
+			self.compressor = None
+
+	@property
+	def svg(self):
+		"""The last page, if it was not written to a sink, uncompressed"""
+		if self.page is None:
+			return None
+		return self.page.getvalue()
+
+	def save(self, fp):
+		"""Write the last page to fp, if it was not written to a sink"""
+		out = self.openOutput(fp)
+		out.write(self.svg)
+		if out is not fp:
+			out.close()
+
+def createTarget(target_opts=None):
+	"""The target for the keyword arguments of TargetSvg, with
+	   stream=True for a StreamingTargetSvg"""
+	opts = dict(target_opts or {})
+	if opts.pop("stream", False):
+		return StreamingTargetSvg(**opts)
+	return TargetSvg(**opts)
 
 if __name__ == "__main__":
 	gi = GraffleInterpreter()
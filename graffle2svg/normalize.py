@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2023 Robin Vobruba <hoijui.quaero@gmail.com>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""Turn the geometry strings of a graffle document into numbers
+
+Graffle stores geometry as strings like "{{x, y}, {w, h}}" and "{x, y}".
+These are converted in place, once after loading, so that the interpreter
+never has to parse them again."""
+
+import re
+from itertools import chain
+
+from .geom import Points
+
+NUMBER = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+# a point "{x, y}", with the numbers as groups
+PAIR = re.compile(r"\{\s*(%s)\s*,\s*(%s)\s*\}" % (NUMBER.pattern, NUMBER.pattern))
+
+def parseNumbers(s):
+	"""in: "{{0, 1}, {2, 3}}" -> (0., 1., 2., 3.)"""
+	return tuple([float(a) for a in NUMBER.findall(s)])
+
+def parsePoints(strings):
+	"""in: ["{0, 1}", "{2, 3}"] -> Points([0., 1., 2., 3.]), all parsed
+	   in one go"""
+	pairs = PAIR.findall("".join(strings))
+	if len(pairs) != len(strings):
+		# not all pairs, kept as they are
+		return tuple([parseNumbers(s) for s in strings])
+	return Points(map(float, chain.from_iterable(pairs)))
+
+def normalizeGraphics(graphics):
+	"""Convert the geometry of a list of graphics, groups included"""
+	for graphic in graphics:
+		bounds = graphic.get("Bounds")
+		if isinstance(bounds, str):
+			graphic["Bounds"] = parseNumbers(bounds)
+		for key in ("Points", "Magnets"):
+			points = graphic.get(key)
+			if isinstance(points, list):
+				graphic[key] = parsePoints(points)
+		subgraphics = graphic.get("Graphics")
+		if subgraphics is not None:
+			normalizeGraphics(subgraphics)
+
+def normalizeSheet(sheet):
+	"""Convert the geometry of a sheet, or of a single sheet document"""
+	origin = sheet.get("CanvasOrigin")
+	if isinstance(origin, str):
+		sheet["CanvasOrigin"] = parseNumbers(origin)
+	background = sheet.get("BackgroundGraphic")
+	if background is not None:
+		normalizeGraphics([background])
+	graphics = sheet.get("GraphicsList")
+	if graphics is not None:
+		normalizeGraphics(graphics)
+	return sheet
+
+def normalizeDocument(doc_dict):
+	"""Convert the geometry of the whole document. Lazily loaded sheets
+	   are converted when they are loaded."""
+	normalizeSheet(doc_dict)
+	sheets = doc_dict.get("Sheets")
+	if isinstance(sheets, list):
+		for sheet in sheets:
+			normalizeSheet(sheet)
+	elif sheets is not None:
+		sheets.onLoad = normalizeSheet
+	return doc_dict
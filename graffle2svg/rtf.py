@@ -10,32 +10,32 @@
 #
 # SPDX-License-Identifier: BSD-3-Clause
 
+import codecs
 import re
+from collections import OrderedDict
+from types import MappingProxyType
 
 from .styles import CascadingStyles
 
-def isint(i):
-    try:
-        int(i)
-        return True
-    except:
-        return False
+# one token of RTF: a control word with its parameter, a character given
+# in the code page, a line break, a control symbol, a brace or a text run
+TOKEN = re.compile(r"""
+    \\(?P<word>[a-zA-Z]+)(?P<param>-?\d+)?[ ]?
+    | \\'(?P<hex>[0-9a-fA-F]{2})
+    | \\(?P<newline>\r\n|\n|\r)
+    | \\(?P<symbol>.?)
+    | (?P<group>[{}])
+    | (?P<text>[^\\{}\r\n]+)
+    | (?P<skip>[\r\n]+)
+    """, re.VERBOSE | re.DOTALL)
+
+# control symbols which stand for text
+SYMBOLS = {"\\": "\\", "{": "{", "}": "}", "~": "\u00a0", "_": "\u2011"}
+
+ALIGNMENTS = {"ql": "left", "qr": "right", "qj": "justify", "qc": "center"}
 
 def extractRTFString(s):
-    """Extract a string and some styling info"""
-    bracket_depth = 0
-    instruction = False
-    inst_code = ""
-
-    ftable = FontTable()
-    colortable = ColorTable()
-    # The string being generated:
-    std_string = ""
-    style = CascadingStyles()
-    # Want to set these as defaults even if not specified
-    style.appendScope()
-    """TODO:
-     extract styling
+    r"""Extract a string and some styling info
 
      e.g.
      {\rtf1\ansi\ansicpg1252\cocoartf949\cocoasubrtf460
@@ -44,179 +44,251 @@ def extractRTFString(s):
 \pard\tx560\tx1120\tx1680\tx2240\tx2800\tx3360\tx3920\tx4480\tx5040\tx5600\tx6160\tx6720\ql\qnatural\pardirnatural
 
 \f0\fs28 \cf0 Next ads are represented in a book-ended carousel on end screen}
-    """
-
-    def do_instruction(inst_code, i, std_string):
-        if inst_code == "b":
-            style["font-weight"] = "bold"
-        if inst_code == "ql":
-            style["text-align"] = "left"
-        elif inst_code == "qr":
-            style["text-align"] = "right"
-        elif inst_code == "qj":
-            style["text-align"] = "justify"
-        elif inst_code == "qc":
-            style["text-align"] = "center"
-        elif inst_code == "fonttbl":
-            i = ftable.parseTable(s,i)
-        elif inst_code == "colortbl":
-            i = colortable.parseTable(s, i)
-        elif inst_code[0]=="f" and inst_code[1:].isdigit():
-            # Font looked up in font table
-            font = ftable.fonts.get(int(inst_code[1:]),{})
-            for k,v in font.items():
-                if k != "":
-                    style[k] = v
-        elif inst_code[:2]=="fs" and isint(inst_code[2:]):
-            # font size - RTF specifies half pt sizes
-            style["font-size"] = "%.1fpx"%(float(inst_code[2:])/2.0)
-        elif inst_code[:2]=="cf" and isint(inst_code[2:]):
-            # font colour is enytry int(inst_code[2:]) in the colour table
-            style["fill"] = "#" + colortable[int(inst_code[2:])]
-            style["stroke"] = "#" + colortable[int(inst_code[2:])]
-        elif inst_code[0] == "u" and isint(inst_code[1:]):
-            std_string += chr(int(inst_code[1:]))
-        return i,  std_string
-    i = -1
-    result_lines =[]
-    while i < len(s)-1:
-        i += 1
-        c = s[i]
-        if c == "{":
-            bracket_depth +=1
-            style.appendScope()
-        elif c == "}":
-            if len(inst_code) > 0:
-                i,  std_string = do_instruction(inst_code, i,  std_string)
-                instruction=False
-                inst_code=""
-            if std_string != "":
-                result_lines.append({"string":std_string, "style":style.currentStyle()})
-                std_string = ""
-            style.popScope()
-            bracket_depth -=1
-        elif c == "\\":
-            if len(inst_code) > 0:
-                i, std_string = do_instruction(inst_code, i,  std_string)
-            instruction = True
-            inst_code = ""
-
-        if instruction:
-            if c == " ":
-                instruction = False
-                i, std_string = do_instruction(inst_code, i,  std_string)
-                inst_code=""
-            elif c == "\n":
-                instruction = False
-                if inst_code == "":
-                    result_lines.append({"string":std_string, "style":style.currentStyle()})
-                    std_string = ""
+
+    gives one line per backslash-newline, or per group closed after text,
+    as {"string": ..., "style": {...}}. Only the text of the outermost
+    group is kept."""
+    return RTFReader().read(s)
+
+class RTFReader(object):
+    """Goes once over the tokens of an RTF string"""
+    def __init__(self):
+        self.style = CascadingStyles()
+        self.ftable = FontTable()
+        self.colortable = ColorTable()
+        self.lines = []
+        # the text of the line being read
+        self.text = []
+        self.depth = 0
+        self.codec = "cp1252"
+        # characters after \u that stand in for it in older readers
+        self.uc = 1
+        self.skip = 0
+
+    def read(self, s):
+        # Want to set these as defaults even if not specified
+        self.style.appendScope()
+        # a font or colour table, as (table, its depth, where it starts)
+        table = None
+        for m in TOKEN.finditer(s):
+            kind = m.lastgroup
+            if kind == "param":
+                kind = "word"
+            if table is not None:
+                # tables are read as a whole, once they are closed
+                if kind == "group":
+                    if m.group(kind) == "{":
+                        self.depth += 1
+                        continue
+                    if self.depth > table[1]:
+                        self.depth -= 1
+                        continue
+                    table[0].parseTable(s[table[2]:m.start()])
+                    table = None
                 else:
-                    i, std_string = do_instruction(inst_code, i,  std_string)
-                    inst_code=""
-            elif not c  in "\\;":
-                inst_code += c
-
-        else:
-            if bracket_depth == 1:
-                if not c in "{}\\\n\r":
-                    # those characters are escaped
-                    std_string += c
-    style.popScope()
-    return result_lines
+                    continue
+            if kind == "text":
+                if self.depth == 1:
+                    self.addText(m.group(kind))
+            elif kind == "word":
+                word, param = m.group("word", "param")
+                if word in ("fonttbl", "colortbl") and param is None:
+                    tbl = self.ftable if word == "fonttbl" else self.colortable
+                    table = (tbl, self.depth, m.end())
+                    continue
+                handler = self.CONTROL_WORDS.get(word)
+                if handler is not None:
+                    handler(self, param)
+            elif kind == "group":
+                if m.group(kind) == "{":
+                    self.depth += 1
+                    self.style.appendScope()
+                else:
+                    if self.text:
+                        self.addLine()
+                    self.style.popScope()
+                    self.depth -= 1
+            elif kind == "newline":
+                self.addLine()
+            elif kind == "hex":
+                if self.depth == 1:
+                    self.addText(bytes([int(m.group(kind), 16)]).decode(self.codec, "replace"))
+            elif kind == "symbol":
+                if self.depth == 1 and m.group(kind) in SYMBOLS:
+                    self.addText(SYMBOLS[m.group(kind)])
+        self.style.popScope()
+        return self.lines
+
+    def addText(self, text):
+        if self.skip:
+            skipped = min(self.skip, len(text))
+            self.skip -= skipped
+            text = text[skipped:]
+        if text:
+            self.text.append(text)
+
+    def addLine(self):
+        self.lines.append({"string": "".join(self.text), "style": self.style.currentStyle()})
+        self.text = []
+
+    def doBold(self, param):
+        if param is None:
+            self.style["font-weight"] = "bold"
+
+    def doAlign(self, word, param):
+        if param is None:
+            self.style["text-align"] = ALIGNMENTS[word]
+
+    def doFont(self, param):
+        # Font looked up in font table
+        if param is not None and not param.startswith("-"):
+            for k, v in self.ftable.fonts.get(int(param), {}).items():
+                if k != "":
+                    self.style[k] = v
+
+    def doFontSize(self, param):
+        # font size - RTF specifies half pt sizes
+        if param is not None:
+            self.style["font-size"] = "%.1fpx" % (float(param) / 2.0)
+
+    def doColour(self, param):
+        # font colour is an entry in the colour table
+        if param is not None:
+            index = int(param)
+            if -len(self.colortable.color) <= index < len(self.colortable.color):
+                self.style["fill"] = "#" + self.colortable[index]
+                self.style["stroke"] = "#" + self.colortable[index]
+
+    def doUnicode(self, param):
+        if param is not None:
+            code = int(param)
+            if code < 0:
+                # written as a signed 16 bit number
+                code += 0x10000
+            self.text.append(chr(code))
+            self.skip = self.uc
+
+    def doUnicodeSkip(self, param):
+        if param is not None:
+            self.uc = int(param)
+
+    def doCodePage(self, param):
+        if param is not None:
+            try:
+                self.codec = codecs.lookup("cp" + param).name
+            except LookupError:
+                pass
+
+RTFReader.CONTROL_WORDS = {
+    "b": RTFReader.doBold,
+    "ql": lambda reader, param: reader.doAlign("ql", param),
+    "qr": lambda reader, param: reader.doAlign("qr", param),
+    "qj": lambda reader, param: reader.doAlign("qj", param),
+    "qc": lambda reader, param: reader.doAlign("qc", param),
+    "f": RTFReader.doFont,
+    "fs": RTFReader.doFontSize,
+    "cf": RTFReader.doColour,
+    "u": RTFReader.doUnicode,
+    "uc": RTFReader.doUnicodeSkip,
+    "ansicpg": RTFReader.doCodePage,
+}
+
+class RTFCache(object):
+    """Remembers the lines extractRTFString returns for the most recently
+       used max_size RTF strings. The lines are shared between callers,
+       so they come as a tuple of read-only mappings."""
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.lines = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def extract(self, s):
+        lines = self.lines.get(s)
+        if lines is not None:
+            self.hits += 1
+            self.lines.move_to_end(s)
+            return lines
+        self.misses += 1
+        lines = tuple(MappingProxyType({"string": line["string"],
+                                        "style": MappingProxyType(line["style"])})
+                      for line in extractRTFString(s))
+        if self.max_size > 0:
+            self.lines[s] = lines
+            if len(self.lines) > self.max_size:
+                self.lines.popitem(last=False)
+        return lines
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return float(self.hits) / lookups
+
+    def __str__(self):
+        return "%d hits, %d misses" % (self.hits, self.misses)
+
+# an entry of a font table: control words and the font name
+FONT_TOKEN = re.compile(r"\\([a-zA-Z]+)(-?\d+)?[ ]?|([^\\]+)")
+
+# generic families of the font table
+FONT_FAMILIES = {"fswiss": "Sans-serif", "froman": "Serif"}
+
+COLOR_PRIMITIVE = re.compile(r"(\D+)(\d+)")
 
 class FontTable(object):
     def __init__(self):
         self.fonts = {}
-        # For parsing
-        self.varname = ""
-        self.fontnum = 0
-
-    def parseTable(self, defn, startidx):
-        #{\fonttbl\f0\fswiss\fcharset0 Helvetica;}
-        i = startidx
-        in_name = False
-        tkn_string = ""
-        fontnum = ""
-        tkn_name = ""
-
-        def process_string():
-            if tkn_name == "fcharset":
-                font_opns = self.fonts.get(fontnum,{})
-                existing_font = font_opns.get("font-family","")
-                if existing_font != "":
-                    existing_font = ","+existing_font
-                font_opns["font-family"] = tkn_string + existing_font
-                self.fonts[fontnum] = font_opns
-
-            if tkn_name == "fswiss":
-                font_opns = self.fonts.get(fontnum,{})
-                font_opns["font-family"] = "Sans-serif"
-                self.fonts[fontnum] = font_opns
-
-            if tkn_name == "froman":
-                 font_opns = self.fonts.get(fontnum,{})
-                 font_opns["font-family"] = "Serif"
-                 self.fonts[fontnum] = font_opns
-
-        while i < len(defn):
-            c = defn[i]
-            if c == "}":
-                if in_name:
-                    tkn_name = tkn_string
-                    tkn_string = ""
-                if len(tkn_string)>1 and tkn_string[-1]==";":
-                    tkn_string = tkn_string[:-1]
-                process_string()
-                break
-            elif c == "{":
-                pass
-            elif c == "\\":
-                if in_name:
-                    tkn_name = tkn_string
-                    tkn_string = ""
-                process_string()
-                in_name = True
-                tkn_string = ""
-                tkn_name = ""
-            elif c.isdigit():
-                if tkn_string == "f":
-                    fontnum = int(str(fontnum) + c)
-                    tkn_name = tkn_string
-                    tkn_string = ""
-                    in_name = False
-                if not in_name:
-                    tkn_string = tkn_string + c
-            elif c == " ":
-                if in_name:
-                    in_name = False
-                    tkn_name = tkn_string
-                    tkn_string = ""
-                else:
-                    tkn_string = tkn_string + c
-            else:
-                tkn_string = tkn_string + c
-            i += 1
 
-        return i-1
+    def parseTable(self, defn):
+        """Read the fonts of a table, without its \\fonttbl and braces:
+           \\f0\\fswiss\\fcharset0 Helvetica;\\f1\\fnil\\fcharset0 Monaco;"""
+        for entry in defn.replace("{", "").replace("}", "").split(";"):
+            fontnum = None
+            family = None
+            names = []
+            for (word, param, name) in FONT_TOKEN.findall(entry):
+                if word == "f" and param:
+                    fontnum = int(param)
+                elif word in FONT_FAMILIES:
+                    family = FONT_FAMILIES[word]
+                elif name.strip():
+                    names.append(name.strip())
+            if fontnum is None:
+                continue
+            families = [f for f in (" ".join(names), family) if f]
+            if families:
+                self.fonts[fontnum] = {"font-family": ",".join(families)}
 
 class ColorTable(object):
     """ Create a table of colors from a RTF definition in the form of {\colortbl;\red255\green255\blue255;\red75\green75\blue75;}"""
     def __init__(self):
         self.color = []
 
-    def parseTable(self,defn, startidx ):
+    def parseTable(self, defn, startidx=None):
+        """Read the colours of a table, without its \\colortbl and braces,
+           or those of the table that ends after startidx in defn"""
+        if startidx is None:
+            self.parseColors(defn)
+            return len(defn)
         endidx = defn.find("}", startidx)
-        primitive_reg = re.compile(r"(\D+)(\d+)")
-        for colordef in defn[startidx-1:endidx-1].split(";"):
+        self.parseColors(defn[startidx-1:endidx])
+        return endidx-1
+
+    def parseColors(self, defn):
+        colordefs = defn.split(";")
+        if len(colordefs) > 1 and colordefs[-1].strip() == "":
+            # the last colour ends in a ;
+            colordefs.pop()
+        for colordef in colordefs:
             color = {'red':0, 'green':0, 'blue':0}
             for primitivedef in colordef.split('\\'):
-                 primitive_match = primitive_reg.match(primitivedef)
+                 primitive_match = COLOR_PRIMITIVE.match(primitivedef)
                  if primitive_match is not None:
                     primitive, value = primitive_match.groups()
                     color[primitive] = int(value)
             self.color.append("%02x"%color['red'] + "%02x"%color['green'] + "%02x"%color['blue'])
-        return endidx-1
 
     def __getitem__(self, key):
         return self.color[key]
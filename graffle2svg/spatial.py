@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2023 Robin Vobruba <hoijui.quaero@gmail.com>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""Finding the graphics of a sheet that lie in an area
+
+Extents are (minx, miny, maxx, maxy). A group's extent covers everything
+in it, so a group outside of the area is left out as a whole."""
+
+import math
+
+from . import geom
+
+# graphics lists shorter than this are simply scanned
+GRID_THRESHOLD = 64
+
+def normalizeBox(box):
+	"""((x1, y1), (x2, y2)), in any corner order -> extent"""
+	(x1, y1), (x2, y2) = box
+	return (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+
+def unionExtents(extents):
+	extents = [e for e in extents if e is not None]
+	if not extents:
+		return None
+	return (min(e[0] for e in extents), min(e[1] for e in extents),
+			max(e[2] for e in extents), max(e[3] for e in extents))
+
+def intersects(a, b):
+	"""Touching counts, as graphics on the edge of the area are drawn"""
+	return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+def boundsExtent(bounds):
+	x, y, width, height = bounds[:4]
+	return (min(x, x + width), min(y, y + height),
+			max(x, x + width), max(y, y + height))
+
+def pointsExtent(points):
+	return geom.points_bounds(points)
+
+class GridIndex(object):
+	"""A uniform grid over the extents of a list of graphics. Items are
+	   filed under every cell they overlap; items spanning most of the
+	   grid are kept aside, as they would be found by any query anyway."""
+
+	def __init__(self, extents):
+		self.count = len(extents)
+		self.always = []
+		self.cells = {}
+		known = [e for e in extents if e is not None]
+		(self.minx, self.miny, maxx, maxy) = unionExtents(known) or (0., 0., 0., 0.)
+		side = max(1, int(math.sqrt(len(known))))
+		self.cell_width = ((maxx - self.minx) / side) or 1.
+		self.cell_height = ((maxy - self.miny) / side) or 1.
+		self.side = side
+		for (i, extent) in enumerate(extents):
+			if extent is None:
+				self.always.append(i)
+				continue
+			(cx1, cy1, cx2, cy2) = self.cellRange(extent)
+			if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > side:
+				self.always.append(i)
+				continue
+			for cx in range(cx1, cx2 + 1):
+				for cy in range(cy1, cy2 + 1):
+					self.cells.setdefault((cx, cy), []).append(i)
+
+	def cellRange(self, extent):
+		last = self.side - 1
+		def clamp(v):
+			return min(last, max(0, int(v)))
+		return (clamp((extent[0] - self.minx) / self.cell_width),
+				clamp((extent[1] - self.miny) / self.cell_height),
+				clamp((extent[2] - self.minx) / self.cell_width),
+				clamp((extent[3] - self.miny) / self.cell_height))
+
+	def candidates(self, area):
+		"""The sorted positions of the items which may intersect area"""
+		found = set(self.always)
+		(cx1, cy1, cx2, cy2) = self.cellRange(area)
+		for cx in range(cx1, cx2 + 1):
+			for cy in range(cy1, cy2 + 1):
+				found.update(self.cells.get((cx, cy), ()))
+		return sorted(found)
+
+class SheetIndex(object):
+	"""Spatial lookups into one sheet. Extents are computed, and grids
+	   built, for the lists of graphics that are queried, on first use."""
+
+	def __init__(self, sheet):
+		# keeps the graphics alive, as they are known by id
+		self.sheet = sheet
+		self.extents = {}
+		self.grids = {}
+
+	def extent(self, graphic):
+		"""The extent of graphic and of everything in it, None if it has
+		   no geometry"""
+		key = id(graphic)
+		try:
+			return self.extents[key]
+		except KeyError:
+			pass
+		parts = []
+		bounds = graphic.get("Bounds")
+		if bounds is not None and not isinstance(bounds, str):
+			parts.append(boundsExtent(bounds))
+		points = graphic.get("Points")
+		if points and not isinstance(points, str):
+			parts.append(pointsExtent(points))
+		subgraphics = graphic.get("Graphics")
+		if subgraphics:
+			group_extent = unionExtents([self.extent(g) for g in subgraphics])
+			if group_extent is None or any(self.extent(g) is None for g in subgraphics):
+				# something in the group can not be placed
+				self.extents[key] = None
+				return None
+			parts.append(group_extent)
+		extent = unionExtents(parts)
+		self.extents[key] = extent
+		return extent
+
+	def query(self, graphics, box):
+		"""The graphics of the list that may be drawn in box, in their order"""
+		area = normalizeBox(box)
+		if len(graphics) < GRID_THRESHOLD:
+			return [g for g in graphics
+					if self.isCandidate(self.extent(g), area)]
+		grid = self.grids.get(id(graphics))
+		if grid is None or grid.count != len(graphics):
+			grid = GridIndex([self.extent(g) for g in graphics])
+			self.grids[id(graphics)] = grid
+		return [graphics[i] for i in grid.candidates(area)
+				if self.isCandidate(self.extent(graphics[i]), area)]
+
+	def isCandidate(self, extent, area):
+		return extent is None or intersects(extent, area)
@@ -7,27 +7,50 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
 class CascadingStyles(object):
+    """A stack of scopes of styles. Every scope keeps a flattened view of
+       the styles applied at that point, which it shares with the scope
+       below until one of its own styles is set, and the string of those
+       styles once it has been asked for. Scopes should only be changed
+       through the stack, so that the views follow."""
     def __init__(self, defaults = None):
         if defaults is None:
             defaults = {}
         self.defaults = defaults
         self.scopes = []
+        # per scope: [flattened styles, whether they are still those of
+        # the scope below, cached string of them, cached scope string]
+        self.levels = []
 
     def appendScope(self,scope=None):
         """Add a new scope for styles"""
         if scope is None:
             scope = {}
         self.scopes.append(scope)
+        if self.levels and not scope:
+            below = self.levels[-1]
+            self.levels.append([below[0], True, below[2], None])
+        else:
+            view = dict(self.levels[-1][0]) if self.levels else {}
+            view.update(scope)
+            self.levels.append([view, False, None, None])
 
     def popScope(self):
         """remove the most recent scope of styles"""
+        self.levels.pop()
         return self.scopes.pop(-1)
 
     def __getitem__(self, k):
         """get the current setting for the style"""
-        for scope in self.scopes[::-1]:
-            if scope.get(k) is not None:
-                return scope[k]
+        if self.levels:
+            view = self.levels[-1][0]
+            v = view.get(k)
+            if v is not None:
+                return v
+            if k in view:
+                # set to None in a scope, which leaves it to those below
+                for scope in self.scopes[::-1]:
+                    if scope.get(k) is not None:
+                        return scope[k]
 
         if self.defaults.get(k) is not None:
             return self.defaults[k]
@@ -37,24 +60,88 @@ class CascadingStyles(object):
     def __setitem__(self, k, v):
         """Set a style in the current scope"""
         self.scopes[-1][k] = v
+        self.ownView()[k] = v
+
+    def update(self, styles):
+        """Set several styles in the current scope"""
+        self.scopes[-1].update(styles)
+        self.ownView().update(styles)
+
+    def ownView(self):
+        """The view of the current scope, copied from the one below if
+           it is still shared, with the strings that depend on it dropped"""
+        level = self.levels[-1]
+        if level[1]:
+            level[0] = dict(level[0])
+            level[1] = False
+        level[2] = level[3] = None
+        return level[0]
 
     def __str__(self):
-        style = self.currentStyle()
-        return ";".join(["%s:%s"%(k,v) for (k,v) in style.items()])
+        if not self.levels:
+            return ""
+        level = self.levels[-1]
+        if level[2] is None:
+            level[2] = self.styleString(level[0])
+        return level[2]
+
+    def styleString(self, styles):
+        return ";".join(["%s:%s"%(k,v) for (k,v) in styles.items()
+                         if not self.isDefault(k, v)])
+
+    def isDefault(self, k, v):
+        return k in self.defaults and self.defaults[k] == v
 
     def currentStyle(self):
         """return all styles applied at this point"""
-        styles = {}
-        for scope in self.scopes:
-            styles.update(scope)
+        if not self.levels:
+            return {}
+        return dict((k, v) for (k, v) in self.levels[-1][0].items()
+                    if not self.isDefault(k, v))
 
-        for key,v in self.defaults.items():
-            if styles.get(key,None) == v:
-                del styles[key]
-        return styles
+    def scopeString(self):
+        """return the styles of this scope only, as a string"""
+        level = self.levels[-1]
+        if level[3] is None:
+            level[3] = self.styleString(self.scopes[-1])
+        return level[3]
 
     def scopeStyle(self):
         """return the styles of this scope only"""
         one_scope = CascadingStyles(defaults = self.defaults)
         one_scope.appendScope(self.scopes[-1])
         return one_scope
+
+class StyleCache(object):
+    """Remembers what graffle Style dicts resolved to, as the SVG styles
+       they set and the definitions they require. Once more than
+       max_entries styles are known, it starts over."""
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def put(self, key, styles, defs):
+        if len(self.entries) >= self.max_entries:
+            self.entries.clear()
+        self.entries[key] = (styles, defs)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return float(self.hits) / lookups
+
+    def __str__(self):
+        return "%d hits, %d misses" % (self.hits, self.misses)
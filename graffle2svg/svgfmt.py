@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2023 Robin Vobruba <hoijui.quaero@gmail.com>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""Writing numbers and path data with a given number of decimal places
+
+Coordinates are rounded to integers counting 10**-precision units first,
+so relative path commands add up to exactly the rounded absolute points."""
+
+# the most decimal places the digits after the point are tabulated for
+TABLE_PRECISION = 4
+
+# precision -> the digits after the point, without trailing zeros, of
+# every number of units below 1
+_fractions = {}
+
+def fractionDigits(precision):
+	digits = _fractions.get(precision)
+	if digits is None:
+		digits = [("%0*d" % (precision, units)).rstrip("0") for units in range(10 ** precision)]
+		_fractions[precision] = digits
+	return digits
+
+def scaled(value, precision):
+	"""value as an integer number of 10**-precision units"""
+	return int(round(float(value) * 10 ** precision))
+
+# (precision, leading_zero) -> function made by scaledFormatter
+_formatters = {}
+
+def scaledFormatter(precision, leading_zero=True):
+	"""A function writing a number of 10**-precision units, without
+	   trailing zeros, and without the 0 before the point if not
+	   leading_zero"""
+	formatter = _formatters.get((precision, leading_zero))
+	if formatter is None:
+		formatter = _formatters[(precision, leading_zero)] = makeFormatter(precision, leading_zero)
+	return formatter
+
+def makeFormatter(precision, leading_zero):
+	scale = 10 ** precision
+	if precision == 0:
+		return str
+	if precision <= TABLE_PRECISION:
+		fractions = fractionDigits(precision)
+	else:
+		fractions = None
+	point = "0." if leading_zero else "."
+	def formatScaled(units):
+		if units < 0:
+			(whole, fraction) = divmod(-units, scale)
+			sign = "-"
+		else:
+			(whole, fraction) = divmod(units, scale)
+			sign = ""
+		if not fraction:
+			return sign + str(whole)
+		if fractions is None:
+			digits = ("%0*d" % (precision, fraction)).rstrip("0")
+		else:
+			digits = fractions[fraction]
+		if whole:
+			return "%s%d.%s" % (sign, whole, digits)
+		return sign + point + digits
+	return formatScaled
+
+def formatNumber(value, precision):
+	"""value rounded to precision decimal places: 100.00000000000001 -> 100"""
+	return scaledFormatter(precision)(scaled(value, precision))
+
+def separated(last, number):
+	"""number as it follows last in path data: without a separator before
+	   a minus sign, or before a point after a number with a point"""
+	if last is None or number[0] == "-" or (number[0] == "." and "." in last):
+		return number
+	return " " + number
+
+def pathData(points, precision, closepath=False):
+	"""The d attribute of a polyline through points. Every segment is
+	   written with the shorter of its absolute and relative forms, as
+	   H/V when it is horizontal or vertical, and commands repeated from
+	   the previous segment are left out."""
+	scale = 10 ** precision
+	fmt = scaledFormatter(precision, leading_zero=False)
+	points = iter(points)
+	(x, y) = next(points)
+	x = int(round(x * scale))
+	y = int(round(y * scale))
+	first = fmt(x)
+	last = fmt(y)
+	out = ["M", first, separated(first, last)]
+	# what a command-less pair of numbers would mean here
+	implied = "L"
+	for (nx, ny) in points:
+		nx = int(round(nx * scale))
+		ny = int(round(ny * scale))
+		if ny == y or nx == x:
+			if ny == y:
+				(absolute, relative, command) = (fmt(nx), fmt(nx - x), "H")
+			else:
+				(absolute, relative, command) = (fmt(ny), fmt(ny - y), "V")
+			# a command that is implied costs nothing
+			if len(relative) + (implied != command.lower()) < len(absolute) + (implied != command):
+				(command, absolute) = (command.lower(), relative)
+			if command != implied:
+				out.append(command)
+				implied = command
+				last = None
+			out.append(separated(last, absolute))
+			last = absolute
+		else:
+			(ax, ay) = (fmt(nx), fmt(ny))
+			(rx, ry) = (fmt(nx - x), fmt(ny - y))
+			command = "L"
+			if len(rx) + len(ry) + (implied != "l") < len(ax) + len(ay) + (implied != "L"):
+				(command, ax, ay) = ("l", rx, ry)
+			if command != implied:
+				out.append(command)
+				implied = command
+				last = None
+			out.append(separated(last, ax))
+			out.append(separated(ax, ay))
+			last = ay
+		(x, y) = (nx, ny)
+	if closepath:
+		out.append("z")
+	return "".join(out)
@@ -12,6 +12,15 @@ import tests.testCascadingStyles
 import tests.testRTF
 import tests.testGeom
 import tests.testMain
+import tests.testFilePack
+import tests.testCache
+import tests.testNormalize
+import tests.testJobs
+import tests.testBatch
+import tests.testSpatial
+import tests.testSvgFmt
+import tests.testApi
+import tests.testDaemon
 
 def get_tests():
     test_suite = TestSuite()
@@ -19,4 +28,13 @@ def get_tests():
     test_suite.addTest(testRTF.get_tests())
     test_suite.addTest(testGeom.get_tests())
     test_suite.addTest(testMain.get_tests())
+    test_suite.addTest(testFilePack.get_tests())
+    test_suite.addTest(testCache.get_tests())
+    test_suite.addTest(testNormalize.get_tests())
+    test_suite.addTest(testJobs.get_tests())
+    test_suite.addTest(testBatch.get_tests())
+    test_suite.addTest(testSpatial.get_tests())
+    test_suite.addTest(testSvgFmt.get_tests())
+    test_suite.addTest(testApi.get_tests())
+    test_suite.addTest(testDaemon.get_tests())
     return test_suite
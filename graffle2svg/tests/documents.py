@@ -0,0 +1,22 @@
+# SPDX-FileCopyrightText: 2023 Robin Vobruba <hoijui.quaero@gmail.com>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""Small graffle documents shared by the tests"""
+
+def sheet(width, title=None, style=None):
+    """A sheet width wide and 100 high, with a circle at (5, 5) (ID 2,
+       drawn with style) and a rectangle at (50, 50) (ID 3)"""
+    circle = {"Class": "ShapedGraphic", "ID": 2, "Shape": "Circle", "Bounds": "{{5, 5}, {10, 10}}"}
+    if style is not None:
+        circle["Style"] = style
+    sheet = {"BackgroundGraphic": {"Class": "SolidGraphic", "ID": 1, "Bounds": "{{0, 0}, {%d, 100}}" % width},
+             "GraphicsList": [circle,
+                              {"Class": "ShapedGraphic", "ID": 3, "Shape": "Rectangle", "Bounds": "{{50, 50}, {10, 10}}"}]}
+    if title is not None:
+        sheet["SheetTitle"] = title
+    return sheet
+
+def document(width):
+    """A single page document, of a sheet(width)"""
+    return dict(sheet(width), GraphDocumentVersion=6)
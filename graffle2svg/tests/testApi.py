@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2023 Robin Vobruba <hoijui.quaero@gmail.com>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+import gzip
+import io
+import os
+import plistlib
+import shutil
+import tempfile
+from unittest import makeSuite, TestCase, TestSuite
+
+from api import convert
+from tests.documents import sheet
+
+class TestConvert(TestCase):
+    def setUp(self):
+        self.data = plistlib.dumps({"GraphDocumentVersion": 6, "Sheets": [sheet(100), sheet(200)]})
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "doc.graffle")
+        with open(self.path, "wb") as fp:
+            fp.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testSources(self):
+        svg = convert(self.data, page=1)
+        self.assertTrue(b'width="200.0"' in svg)
+        self.assertEqual(convert(self.path, page=1), svg)
+        with open(self.path, "rb") as fp:
+            self.assertEqual(convert(fp, page=1), svg)
+
+    def testAllPages(self):
+        pages = convert(self.data, all_pages=True)
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(pages[1], convert(self.data, page=1))
+        self.assertRaises(ValueError, convert, self.data, all_pages=True, out=io.BytesIO())
+
+    def testMultiPage(self):
+        self.assertTrue(b'id="page1"' in convert(self.data, multi_page=True))
+
+    def testArea(self):
+        svg = convert(self.data, area=((0, 0), (20, 20)))
+        self.assertTrue(b'id="2"' in svg)
+        self.assertFalse(b'id="3"' in svg)
+
+    def testOut(self):
+        out = io.BytesIO()
+        self.assertEqual(convert(self.data, out=out, stream=True, compress_level=1), None)
+        self.assertTrue(gzip.decompress(out.getvalue()).rstrip().endswith(b"</svg>"))
+
+def get_tests():
+    TS = TestSuite()
+    TS.addTest(makeSuite(TestConvert))
+    return TS
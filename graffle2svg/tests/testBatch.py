@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2023 Robin Vobruba <hoijui.quaero@gmail.com>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+import gzip
+import os
+import plistlib
+import shutil
+import tempfile
+from unittest import makeSuite, TestCase, TestSuite
+
+from batch import BatchConverter, findInputs
+from tests.documents import document
+
+class TestBatchConverter(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.src = os.path.join(self.directory, "src")
+        self.out = os.path.join(self.directory, "out")
+        os.makedirs(os.path.join(self.src, "sub", "package.graffle"))
+        self.write("a.graffle", document(100))
+        self.write(os.path.join("sub", "b.graffle"), document(200))
+        self.write(os.path.join("sub", "package.graffle", "data.plist"), document(300))
+        with open(os.path.join(self.src, "notes.txt"), "w") as fp:
+            fp.write("not a graffle file")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, doc):
+        with open(os.path.join(self.src, name), "wb") as fp:
+            plistlib.dump(doc, fp)
+
+    def run_batch(self, **kwargs):
+        batch = BatchConverter(self.out, **kwargs)
+        results = list(batch.run([self.src]))
+        return batch, results
+
+    def testFindInputs(self):
+        rels = [rel for (path, rel) in findInputs([self.src])]
+        self.assertEqual(rels, ["a.graffle", os.path.join("sub", "package.graffle"),
+                                os.path.join("sub", "b.graffle")])
+        pattern = os.path.join(self.src, "**", "b.graffle")
+        self.assertEqual([rel for (path, rel) in findInputs([pattern])],
+                         [os.path.join("sub", "b.graffle")])
+
+    def testMirrorsTree(self):
+        batch, results = self.run_batch()
+        self.assertEqual(batch.converted, 3)
+        self.assertEqual(batch.failed, 0)
+        with open(os.path.join(self.out, "sub", "b.svg"), "rb") as fp:
+            self.assertTrue(b'width="200.0"' in fp.read())
+        self.assertTrue(os.path.exists(os.path.join(self.out, "sub", "package.svg")))
+
+    def testSvgz(self):
+        self.run_batch(target_opts={"compress_level": 1})
+        with gzip.open(os.path.join(self.out, "sub", "b.svgz"), "rb") as fp:
+            self.assertTrue(b'width="200.0"' in fp.read())
+
+    def testMultiPage(self):
+        batch, results = self.run_batch(multi_page=True)
+        self.assertEqual(batch.converted, 3)
+        with open(os.path.join(self.out, "a.svg"), "rb") as fp:
+            self.assertTrue(b'id="page0"' in fp.read())
+
+    def testSkipsUnchanged(self):
+        self.run_batch()
+        batch, results = self.run_batch()
+        self.assertEqual((batch.converted, batch.skipped), (0, 3))
+        # a new stamp alone does not make it convert again
+        os.utime(os.path.join(self.src, "a.graffle"), (0, 0))
+        batch, results = self.run_batch()
+        self.assertEqual((batch.converted, batch.skipped), (0, 3))
+        self.write(os.path.join("sub", "b.graffle"), document(250))
+        batch, results = self.run_batch()
+        self.assertEqual([rel for (rel, _, _) in results], [os.path.join("sub", "b.graffle")])
+        self.assertEqual((batch.converted, batch.skipped), (1, 2))
+
+    def testRemovedOutputIsRebuilt(self):
+        self.run_batch()
+        os.remove(os.path.join(self.out, "a.svg"))
+        batch, results = self.run_batch()
+        self.assertEqual([rel for (rel, _, _) in results], ["a.graffle"])
+
+    def testOptionsInvalidateManifest(self):
+        self.run_batch()
+        batch, results = self.run_batch(all_pages=True)
+        self.assertEqual(batch.converted, 3)
+        self.assertTrue(os.path.exists(os.path.join(self.out, "a-0.svg")))
+        batch, results = self.run_batch(all_pages=True, force=True)
+        self.assertEqual(batch.converted, 3)
+
+    def testFailureIsRetried(self):
+        with open(os.path.join(self.src, "a.graffle"), "wb") as fp:
+            fp.write(b"garbage")
+        batch, results = self.run_batch(jobs=2)
+        self.assertEqual((batch.converted, batch.failed), (2, 1))
+        batch, results = self.run_batch()
+        self.assertEqual((batch.failed, batch.skipped), (1, 2))
+
+    def testGlobOnlyMatchesGraffles(self):
+        pattern = os.path.join(self.src, "*")
+        self.assertEqual([rel for (path, rel) in findInputs([pattern])], ["a.graffle"])
+        pattern = os.path.join(self.src, "sub", "*")
+        self.assertEqual([rel for (path, rel) in findInputs([pattern])], ["b.graffle", "package.graffle"])
+
+    def testMissingInputFails(self):
+        missing = os.path.join(self.src, "missing.graffle")
+        batch = BatchConverter(self.out)
+        results = list(batch.run([missing, os.path.join(self.src, "a.graffle")]))
+        self.assertEqual((batch.converted, batch.failed), (1, 1))
+        self.assertEqual(results[0][0], "missing.graffle")
+        self.assertTrue("No such file" in results[0][2])
+        self.assertTrue("error" in batch.loadManifest()["missing.graffle"])
+        batch = BatchConverter(self.out)
+        list(batch.run([missing, os.path.join(self.src, "a.graffle")]))
+        self.assertEqual((batch.skipped, batch.failed), (1, 1))
+
+    def testInterruptedRunConvertsTheRest(self):
+        run = BatchConverter(self.out).run([self.src])
+        next(run)
+        run.close()
+        batch, results = self.run_batch()
+        self.assertEqual((batch.converted, batch.skipped), (2, 1))
+        self.assertTrue(os.path.exists(os.path.join(self.out, "sub", "b.svg")))
+
+def get_tests():
+    TS = TestSuite()
+    TS.addTest(makeSuite(TestBatchConverter))
+    return TS
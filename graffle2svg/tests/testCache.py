@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2023 Robin Vobruba <hoijui.quaero@gmail.com>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+import gzip
+import io
+import os
+import pickle
+import shutil
+import tempfile
+from unittest import makeSuite, TestCase, TestSuite
+
+from cache import DocumentCache
+from main import GraffleParser
+
+PLIST = b"""<?xml version="1.0" encoding="UTF-8"?>
+<plist version="1.0"><dict><key>GraphDocumentVersion</key><integer>6</integer></dict></plist>"""
+
+class TestDocumentCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testHitAndMiss(self):
+        cache = DocumentCache(self.directory)
+        key = cache.key(b"raw", False)
+        self.assertEqual(cache.get(key), None)
+        cache.put(key, {"a": [1, 2]})
+        self.assertEqual(cache.get(key), {"a": [1, 2]})
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def testBrokenEntryIsAMiss(self):
+        cache = DocumentCache(self.directory)
+        for (key, data) in (("truncated", pickle.dumps({"a": 1})[:-3]),
+                            ("stale", b"\x80\x04c__no_such_module__\nThing\n.")):
+            with open(cache.path(key), "wb") as fp:
+                fp.write(data)
+            self.assertEqual(cache.get(key), None)
+            self.assertFalse(os.path.exists(cache.path(key)))
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def testPackageDirectory(self):
+        cache = DocumentCache(self.directory)
+        package = os.path.join(self.directory, "doc.graffle")
+        os.mkdir(package)
+        with open(os.path.join(package, "data.plist"), "wb") as fp:
+            fp.write(PLIST)
+        self.assertEqual(GraffleParser(cache).walkGraffleFile(package), {"GraphDocumentVersion": 6})
+        self.assertEqual(GraffleParser(cache).walkGraffleFile(package, lazy=True), {"GraphDocumentVersion": 6})
+        self.assertEqual(cache.misses, 2)
+
+    def testKeyVariant(self):
+        cache = DocumentCache(self.directory)
+        self.assertNotEqual(cache.key(b"raw", False), cache.key(b"raw", True))
+
+    def testEvictLeastRecentlyUsed(self):
+        cache = DocumentCache(self.directory, max_size=13000)
+        for (i, name) in enumerate(("old", "used", "new")):
+            cache.put(name, "x" * 4000)
+            os.utime(cache.path(name), (i, i))
+        cache.get("used")
+        cache.put("newest", "x" * 4000)
+        self.assertFalse(os.path.exists(cache.path("old")))
+        self.assertTrue(os.path.exists(cache.path("used")))
+        self.assertTrue(os.path.exists(cache.path("newest")))
+
+    def testParserSkipsParsingOnHit(self):
+        cache = DocumentCache(self.directory)
+        raw = gzip.compress(PLIST)
+        first = GraffleParser(cache).walkGraffleFile(io.BytesIO(raw))
+        second = GraffleParser(cache).walkGraffleFile(io.BytesIO(raw))
+        self.assertEqual(first, {"GraphDocumentVersion": 6})
+        self.assertEqual(second, first)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+def get_tests():
+    TS = TestSuite()
+    TS.addTest(makeSuite(TestDocumentCache))
+    return TS
@@ -42,6 +42,42 @@ class TestScope(TestCase):
         self.cs["font"] = "newfont"
         self.cs["font"] == "newfont"
 
+    def testUpdate(self):
+        self.cs.appendScope()
+        self.cs.update({"font":"newfont","font-size":"10pt"})
+        self.assertEqual(self.cs["font-size"], "10pt")
+        self.cs.popScope()
+        self.assertEqual(self.cs["font-size"], "12pt")
+
+    def testSharedView(self):
+        self.cs.appendScope()
+        self.cs["fill"] = "red"
+        self.cs.appendScope()
+        self.assertEqual(str(self.cs), "fill:red")
+        self.cs["fill"] = "blue"
+        self.assertEqual(str(self.cs), "fill:blue")
+        self.cs.popScope()
+        self.assertEqual(self.cs["fill"], "red")
+        self.assertEqual(str(self.cs), "fill:red")
+
+    def testScopeString(self):
+        self.cs.appendScope({"fill": "red"})
+        self.cs.appendScope()
+        self.cs["stroke"] = "blue"
+        self.cs["font"] = "arial"
+        self.assertEqual(self.cs.scopeString(), "stroke:blue")
+        self.cs["stroke"] = "green"
+        self.assertEqual(self.cs.scopeString(), "stroke:green")
+        self.assertEqual(str(self.cs), "fill:red;stroke:green")
+
+    def testNoneFallsThrough(self):
+        self.cs.appendScope({"fill": "red"})
+        self.cs.appendScope()
+        self.cs["fill"] = None
+        self.assertEqual(self.cs["fill"], "red")
+        self.cs["font-size"] = None
+        self.assertEqual(self.cs["font-size"], "12pt")
+
 def get_tests():
     TS = TestSuite()
     TS.addTest(makeSuite(TestDefaults))
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2023 Robin Vobruba <hoijui.quaero@gmail.com>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+import gzip
+import http.client
+import json
+import os
+import plistlib
+import shutil
+import socket
+import tempfile
+import threading
+from unittest import makeSuite, TestCase, TestSuite
+from unittest.mock import patch
+
+from api import convert
+from daemon import ConversionServer, RequestHandler, WarmDocuments, makeServer, parseJob, percentile
+from tests.documents import sheet
+
+class UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        http.client.HTTPConnection.__init__(self, "localhost")
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+class TestParseJob(TestCase):
+    def testOptions(self):
+        job = parseJob("page=1&area=0,0,20,20&compact&precision=2&tight=no", b"data")
+        self.assertEqual(job["data"], b"data")
+        self.assertEqual(job["page"], 1)
+        self.assertEqual(job["area"], ((0, 0), (20, 20)))
+        self.assertEqual(job["target_opts"], {"compact": True, "precision": 2, "tight": False})
+        self.assertEqual(parseJob("path=/a.graffle&multi_page=1", b"")["path"], "/a.graffle")
+
+    def testMalformed(self):
+        self.assertRaises(ValueError, parseJob, "page=1", b"")
+        self.assertRaises(ValueError, parseJob, "area=0,0,20", b"data")
+        self.assertRaises(ValueError, parseJob, "compact=maybe", b"data")
+        self.assertRaises(ValueError, parseJob, "stream", b"data")
+        self.assertRaises(ValueError, parseJob, "multi_page&area=0,0,20,20", b"data")
+        self.assertRaises(ValueError, parseJob, "multi_page=yes&page=1", b"data")
+
+    def testPercentile(self):
+        self.assertEqual(percentile([], .5), None)
+        self.assertEqual(percentile(list(range(100)), .9), 90)
+        self.assertEqual(percentile([1, 2], .99), 2)
+
+class TestWarmDocuments(TestCase):
+    def testLimits(self):
+        documents = WarmDocuments(max_count=2, max_bytes=100)
+        for (key, size) in (("a", 10), ("b", 10), ("c", 10)):
+            documents.put(key, key.upper(), size)
+        self.assertEqual(documents.get("a"), None)
+        self.assertEqual(documents.get("b"), "B")
+        documents.put("d", "D", 85)
+        # b was used more recently than c, and fits beside d
+        self.assertEqual((documents.get("c"), documents.get("b"), documents.get("d")), (None, "B", "D"))
+        documents.put("e", "E", 200)
+        self.assertEqual((list(documents.entries), documents.size), (["e"], 200))
+
+class TestMakeServer(TestCase):
+    def testOnlyLoopback(self):
+        for address in ("0.0.0.0:0", "192.0.2.1:0"):
+            self.assertRaises(ValueError, makeServer, address, None)
+        makeServer("localhost:0", None).server_close()
+
+class TestServer(TestCase):
+    jobs = 0
+
+    def setUp(self):
+        self.data = plistlib.dumps({"GraphDocumentVersion": 6, "Sheets": [sheet(100), sheet(200)]})
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "doc.graffle")
+        with open(self.path, "wb") as fp:
+            fp.write(self.data)
+        # the tracebacks of failed jobs
+        self.logged = patch.object(RequestHandler, "log_error").start()
+        self.addCleanup(patch.stopall)
+        self.converter = ConversionServer(jobs=self.jobs)
+        self.server = makeServer(self.address(), self.converter)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.converter.close()
+        shutil.rmtree(self.directory)
+
+    def address(self):
+        return "127.0.0.1:0"
+
+    def connect(self):
+        return http.client.HTTPConnection(*self.server.server_address)
+
+    def request(self, method, url, body=None):
+        connection = self.connect()
+        try:
+            connection.request(method, url, body)
+            response = connection.getresponse()
+            return (response.status, response.getheader("Content-Encoding"), response.read())
+        finally:
+            connection.close()
+
+    def testConvert(self):
+        self.assertEqual(self.request("POST", "/convert?page=1", self.data),
+                         (200, None, convert(self.data, page=1)))
+        self.assertEqual(self.request("GET", "/convert?path=%s&area=0,0,20,20" % self.path)[2],
+                         convert(self.data, area=((0, 0), (20, 20))))
+        self.assertEqual(self.request("POST", "/convert?multi_page", self.data)[2],
+                         convert(self.data, multi_page=True))
+        (status, encoding, svgz) = self.request("POST", "/convert?compress_level=1&compact", self.data)
+        self.assertEqual(encoding, "gzip")
+        self.assertEqual(gzip.decompress(svgz), convert(self.data, compact=True))
+
+    def testStatus(self):
+        self.request("POST", "/convert", self.data)
+        self.request("POST", "/convert?page=1", self.data)
+        (code, _, message) = self.request("POST", "/convert?page=5", self.data)
+        self.assertEqual((code, message), (422, b"IndexError: list index out of range\n"))
+        self.assertTrue("Traceback" in self.logged.call_args[0][2])
+        self.assertEqual(self.request("POST", "/convert?page=x", self.data)[0], 400)
+        self.assertEqual(self.request("GET", "/nothing")[0], 404)
+        status = json.loads(self.request("GET", "/status")[2])
+        self.assertEqual(status["completed"], 2)
+        self.assertEqual(status["failed"], 1)
+        self.assertEqual(status["pending"], 0)
+        self.assertEqual(status["queued"], 0)
+        # the second job found the document parsed by the first
+        self.assertEqual(status["document_hits"], 1)
+        self.assertTrue(0 <= status["latency_ms"]["p50"] <= status["latency_ms"]["p99"] <= status["latency_ms"]["max"])
+
+    def testDocumentsStayWithOneWorker(self):
+        for page in (0, 1, 0, 1, 0, 1):
+            self.request("GET", "/convert?path=%s&page=%d" % (self.path, page))
+        self.assertEqual(self.request("GET", "/convert?path=/no/such.graffle")[0], 422)
+        status = json.loads(self.request("GET", "/status")[2])
+        self.assertEqual((status["completed"], status["document_hits"], status["failed"]), (6, 5, 1))
+
+class TestUnixServer(TestServer):
+    def address(self):
+        return os.path.join(self.directory, "graffle2svg.sock")
+
+    def connect(self):
+        return UnixConnection(self.server.server_address)
+
+    def testKeepsOtherFiles(self):
+        path = os.path.join(self.directory, "out.svg")
+        with open(path, "wb") as fp:
+            fp.write(b"<svg/>")
+        self.assertRaises(ValueError, makeServer, path, self.converter)
+        self.assertTrue(os.path.exists(path))
+
+class TestWorkerPool(TestServer):
+    jobs = 2
+
+def get_tests():
+    TS = TestSuite()
+    TS.addTest(makeSuite(TestParseJob))
+    TS.addTest(makeSuite(TestWarmDocuments))
+    TS.addTest(makeSuite(TestMakeServer))
+    TS.addTest(makeSuite(TestServer))
+    TS.addTest(makeSuite(TestUnixServer))
+    TS.addTest(makeSuite(TestWorkerPool))
+    return TS
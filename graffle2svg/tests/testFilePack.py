@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2023 Robin Vobruba <hoijui.quaero@gmail.com>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+import codecs
+import gzip
+import io
+import plistlib
+import shutil
+import tempfile
+import os
+import zipfile
+from unittest import makeSuite, TestCase, TestSuite
+
+from filepack import GraffleFilePack, sniffFormat
+
+PLIST = b'<?xml version="1.0" encoding="UTF-8"?>\n<plist version="1.0"><dict/></plist>'
+
+class TestSniffFormat(TestCase):
+    def testXml(self):
+        self.assertEqual(sniffFormat(PLIST[:16]), "xml")
+
+    def testXmlWithBom(self):
+        self.assertEqual(sniffFormat(codecs.BOM_UTF8 + PLIST[:13]), "xml")
+        utf16 = codecs.BOM_UTF16_LE + PLIST.decode("ascii").encode("utf-16-le")
+        self.assertEqual(sniffFormat(utf16[:16]), "xml")
+
+    def testMagics(self):
+        self.assertEqual(sniffFormat(b"\x1f\x8b\x08\x00"), "gzip")
+        self.assertEqual(sniffFormat(b"PK\x03\x04\x14\x00"), "zip")
+        self.assertEqual(sniffFormat(b"bplist00\xd1\x01"), "bplist")
+
+    def testUnknown(self):
+        self.assertEqual(sniffFormat(b"{\\rtf1"), None)
+
+class TestGraffleFilePack(TestCase):
+    def testPlainStream(self):
+        with GraffleFilePack(io.BytesIO(PLIST)) as pack:
+            self.assertEqual(pack.format, "xml")
+            self.assertEqual(pack.compression, None)
+            self.assertEqual(pack.read(), PLIST)
+
+    def testGzipStream(self):
+        with GraffleFilePack(io.BytesIO(gzip.compress(PLIST))) as pack:
+            self.assertEqual(pack.format, "xml")
+            self.assertEqual(pack.compression, "gzip")
+            self.assertEqual(pack.read(), PLIST)
+
+    def zipped(self, members):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as zf:
+            for (name, data) in members:
+                zf.writestr(name, data)
+        archive.seek(0)
+        return archive
+
+    def testZipContainer(self):
+        archive = self.zipped([("image1.png", b"\x89PNG"), ("data.plist", PLIST)])
+        with GraffleFilePack(archive) as pack:
+            self.assertEqual(pack.container, "zip")
+            self.assertEqual(pack.format, "xml")
+            self.assertEqual(pack.read(), PLIST)
+
+    def testZipWithGzippedBinaryPlist(self):
+        bplist = plistlib.dumps({"GraphDocumentVersion": 6}, fmt=plistlib.FMT_BINARY)
+        archive = self.zipped([("Doc.graffle/data.plist", gzip.compress(bplist))])
+        with GraffleFilePack(archive) as pack:
+            self.assertEqual(pack.compression, "gzip")
+            self.assertEqual(pack.format, "bplist")
+            self.assertEqual(pack.read(), bplist)
+
+    def testZipWithoutPlist(self):
+        self.assertRaises(Exception, GraffleFilePack, self.zipped([("image1.png", b"")]))
+
+    def testPackageDirectory(self):
+        directory = tempfile.mkdtemp(suffix=".graffle")
+        try:
+            with open(os.path.join(directory, "data.plist"), "wb") as fp:
+                fp.write(gzip.compress(PLIST))
+            with GraffleFilePack(directory) as pack:
+                self.assertEqual(pack.read(), PLIST)
+        finally:
+            shutil.rmtree(directory)
+
+    def testInvalid(self):
+        self.assertRaises(Exception, GraffleFilePack, io.BytesIO(b"not a graffle file"))
+        self.assertRaises(Exception, GraffleFilePack, io.BytesIO(gzip.compress(b"nor this")))
+
+def get_tests():
+    TS = TestSuite()
+    TS.addTest(makeSuite(TestSniffFormat))
+    TS.addTest(makeSuite(TestGraffleFilePack))
+    return TS
@@ -8,7 +8,8 @@
 #
 # SPDX-License-Identifier: BSD-3-Clause
 
-from unittest import makeSuite, TestCase, TestSuite
+from unittest import makeSuite, skipUnless, TestCase, TestSuite
+from unittest.mock import patch
 
 import geom
 
@@ -74,6 +75,83 @@ class TestRotate(TestGeom):
         rotated =geom.rotate_points(pts, 180.000001)
         self.assertFigureAlmostEqual(rotated,[[1., 1.], [-1., 1.]])
 
+class TestAffine(TestGeom):
+    def testComposition(self):
+        pts = [[1., 2.], [-3., 0.5]]
+        first = geom.Affine(2., 0.5, -1., 1., 3., -4.)
+        second = geom.Affine.rotation(30.)
+        self.assertFigureAlmostEqual((second @ first).apply(pts), second.apply(first.apply(pts)))
+
+    def testQuarterTurnsAreExact(self):
+        self.assertEqual(geom.Affine.rotation(90.), geom.Affine(0., 1., -1., 0.))
+        self.assertEqual(geom.Affine.rotation(-90.), geom.Affine(0., -1., 1., 0.))
+        self.assertEqual(geom.Affine.rotation(180.).apply([[2., 3.]]), [[-2., -3.]])
+
+    def testAbout(self):
+        transform = geom.Affine.rotation(57.).about((3., 4.))
+        self.assertFigureAlmostEqual(transform.apply([[3., 4.]]), [[3., 4.]])
+
+    def testShapeTransform(self):
+        pts = [[-1., 1.], [3., 1.], [-1, -2], [0.5, 7.]]
+        for (hflip, vflip, angle) in [(True, False, None), (False, True, None),
+                                      (False, False, 33.), (True, True, 90.), (True, False, -72.5)]:
+            expected = pts
+            if hflip:
+                expected = geom.h_flip_points(expected)
+            if vflip:
+                expected = geom.v_flip_points(expected)
+            if angle is not None:
+                expected = geom.rotate_points(expected, angle)
+            transform = geom.shape_transform(pts, hflip, vflip, angle)
+            self.assertFigureAlmostEqual(transform.apply(pts), expected)
+
+    def testShapeTransformIdentity(self):
+        pts = [[0., 0.], [1., 1.]]
+        self.assertEqual(geom.shape_transform(pts), None)
+        self.assertEqual(geom.shape_transform(pts, angle=360.), None)
+        # a half turn is both flips
+        self.assertEqual(geom.shape_transform(pts, True, True, 180.), None)
+
+    @skipUnless(geom.numpy, "numpy is not installed")
+    def testApplyNumpy(self):
+        transform = geom.shape_transform([[0., 0.], [10., 10.]], True, False, 33.)
+        pts = [[i * .5, (i * 7) % 13 - 6.] for i in range(geom.NUMPY_MIN_POINTS)]
+        points = geom.Points([v for pt in pts for v in pt])
+        with patch.object(geom, "numpy", None):
+            expected = transform.apply(pts)
+        self.assertFigureAlmostEqual(transform.apply(pts), expected)
+        self.assertFigureAlmostEqual(transform.apply(points), expected)
+
+class TestPoints(TestCase):
+    def setUp(self):
+        self.points = geom.Points([1., 2., 3., -4., 5., 6.])
+
+    def testSequence(self):
+        self.assertEqual(len(self.points), 3)
+        self.assertEqual(list(self.points), [(1., 2.), (3., -4.), (5., 6.)])
+        self.assertEqual(self.points[-1], (5., 6.))
+        self.assertRaises(IndexError, lambda: self.points[3])
+        self.assertEqual(list(self.points[1:].coords), [3., -4., 5., 6.])
+        self.assertEqual(self.points[::2], [(1., 2.), (5., 6.)])
+
+    def testBounds(self):
+        self.assertEqual(geom.points_bounds(self.points), (1., -4., 5., 6.))
+        self.assertFalse(geom.out_of_boundingbox(self.points, ((5, 6), (1, -4))))
+        self.assertTrue(geom.out_of_boundingbox(self.points, ((0, -4), (4, 7))))
+
+    def testTransform(self):
+        self.assertEqual(geom.Affine.translation(1., 1.).apply(self.points), [[2., 3.], [4., -3.], [6., 7.]])
+
+class TestBounds(TestCase):
+    def testPoints(self):
+        self.assertEqual(geom.points_bounds([[3., 1.], [-1., 4.], [2., -5.]]), (-1., -5., 3., 4.))
+        self.assertEqual(geom.points_bounds([[2., 7.]]), (2., 7., 2., 7.))
+
+    def testUnion(self):
+        self.assertEqual(geom.union_bounds(None, (0, 1, 2, 3)), (0, 1, 2, 3))
+        self.assertEqual(geom.union_bounds((0, 1, 2, 3), None), (0, 1, 2, 3))
+        self.assertEqual(geom.union_bounds((0, 1, 2, 3), (-1, 2, 1, 5)), (-1, 1, 2, 5))
+
 class TestBoundingBox(TestGeom):
 
     def testBbInside(self):
@@ -115,5 +193,8 @@ def get_tests():
     TS = TestSuite()
     TS.addTest(makeSuite(TestCentre))
     TS.addTest(makeSuite(TestRotate))
+    TS.addTest(makeSuite(TestAffine))
+    TS.addTest(makeSuite(TestPoints))
+    TS.addTest(makeSuite(TestBounds))
     TS.addTest(makeSuite(TestBoundingBox))
     return TS
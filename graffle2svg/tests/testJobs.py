@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2023 Robin Vobruba <hoijui.quaero@gmail.com>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+import os
+import shutil
+import tempfile
+from unittest import makeSuite, TestCase, TestSuite
+
+import jobs
+from jobs import convertPages
+from tests.documents import sheet
+
+class TestConvertPages(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        broken = sheet(300)
+        del broken["GraphicsList"]
+        self.doc = {"GraphDocumentVersion": 6, "Sheets": [sheet(100), broken, sheet(200)]}
+        self.pages = [(page, os.path.join(self.directory, "out-%d.svg" % page)) for page in range(3)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def convert(self, jobs, target_opts=None):
+        results = list(convertPages(self.doc, self.pages, jobs, target_opts))
+        self.assertEqual([(page, out_file) for (page, out_file, _) in results], self.pages)
+        self.assertEqual([error is None for (_, _, error) in results], [True, False, True])
+        self.assertTrue("KeyError" in results[1][2])
+        outputs = []
+        for (page, out_file) in self.pages:
+            if os.path.exists(out_file):
+                with open(out_file, "rb") as fp:
+                    outputs.append(fp.read())
+        return outputs
+
+    def testSerial(self):
+        outputs = self.convert(1)
+        # nothing holds on to the document
+        self.assertEqual(jobs._interpreter, None)
+        self.assertEqual(len(outputs), 2)
+        self.assertTrue(b'width="200.0"' in outputs[1])
+
+    def testParallelMatchesSerial(self):
+        serial = self.convert(1)
+        self.assertEqual(self.convert(2), serial)
+
+    def testStreamed(self):
+        outputs = self.convert(1, {"stream": True})
+        # the failed page left no partial file
+        self.assertEqual(len(outputs), 2)
+        self.assertTrue(b'width="200.0"' in outputs[1])
+        self.assertTrue(outputs[1].rstrip().endswith(b"</svg>"))
+
+def get_tests():
+    TS = TestSuite()
+    TS.addTest(makeSuite(TestConvertPages))
+    return TS
@@ -7,11 +7,15 @@
 #
 # SPDX-License-Identifier: BSD-3-Clause
 
-import xml.dom.minidom
+import gzip
+import io
+import plistlib
+import xml.etree.ElementTree as ET
 from unittest import makeSuite, TestCase, TestSuite
 from unittest.mock import Mock,  patch
 
-from main import TargetSvg,  GraffleParser,  GraffleInterpreter
+from main import TargetSvg,  StreamingTargetSvg,  GraffleParser,  GraffleInterpreter
+from tests.documents import sheet
 
 class TestMkHex(TestCase):
     def setUp(self):
@@ -39,21 +43,117 @@ class TestGraffleParser(TestCase):
     def tearDown(self):
         del self.gp
 
+    def walkDict(self, content):
+        return self.gp.walkGraffle("<plist><dict>%s</dict></plist>" % content)
+
     def testGraffleDictInteger(self):
-        p = xml.dom.minidom.parseString("<dict><key>ImageCounter</key><integer>1</integer></dict>")
-        dict = self.gp.ReturnGraffleDict(p.firstChild)
+        dict = self.walkDict("<key>ImageCounter</key><integer>1</integer>")
         self.assertEqual(dict['ImageCounter'], '1')
 
     def testGraffleDictReal(self):
-        p = xml.dom.minidom.parseString("<dict><key>Size</key><real>19</real></dict>")
-        dict = self.gp.ReturnGraffleDict(p.firstChild)
+        dict = self.walkDict("<key>Size</key><real>19</real>")
         self.assertEqual(dict['Size'], '19')
 
-    def testGraffleDictReal(self):
-        p = xml.dom.minidom.parseString("<dict><key>Shape</key><string>RoundRect</string></dict>")
-        dict = self.gp.ReturnGraffleDict(p.firstChild)
+    def testGraffleDictString(self):
+        dict = self.walkDict("<key>Shape</key><string>RoundRect</string>")
         self.assertEqual(dict['Shape'], 'RoundRect')
 
+    def testWalkGraffle(self):
+        xmlstr = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">
+<plist version="1.0">
+<dict>
+	<key>GraphDocumentVersion</key>
+	<integer>6</integer>
+	<key>Sheets</key>
+	<array>
+		<dict>
+			<key>Bounds</key>
+			<string>{{0, 0}, {756, 553}}</string>
+			<key>Points</key>
+			<array><string>{0, 0}</string><string>{1.5, 2}</string></array>
+			<key>AutoAdjust</key>
+			<true/>
+			<key>Flipped</key>
+			<false/>
+			<key>Text</key>
+			<string>a &amp; b</string>
+			<key>Modified</key>
+			<date>2023-01-02T03:04:05Z</date>
+		</dict>
+	</array>
+</dict>
+</plist>"""
+        expected = {"GraphDocumentVersion": "6",
+                    "Sheets": [{"Bounds": "{{0, 0}, {756, 553}}",
+                                "Points": ["{0, 0}", "{1.5, 2}"],
+                                "AutoAdjust": True,
+                                "Flipped": False,
+                                "Text": "a & b",
+                                "Modified": "2023-01-02T03:04:05Z"}]}
+        self.assertEqual(self.gp.walkGraffle(xmlstr), expected)
+        self.assertEqual(self.gp.walkGraffle(xmlstr.encode("utf-8")), expected)
+        self.assertEqual(self.gp.doc_dict["Sheets"][0]["Text"], "a & b")
+
+    def testWalkGraffleFileBinaryPlist(self):
+        doc = {"GraphDocumentVersion": 6, "Sheets": [{"GraphicsList": []}]}
+        data = plistlib.dumps(doc, fmt=plistlib.FMT_BINARY)
+        self.assertEqual(self.gp.walkGraffleFile(io.BytesIO(data)), doc)
+        self.assertEqual(self.gp.walkGraffleFile(io.BytesIO(data), lazy=True), doc)
+
+class TestLazySheets(TestCase):
+    xmlstr = """<?xml version="1.0" encoding="UTF-8"?>
+<plist version="1.0">
+<dict>
+	<key>GraphDocumentVersion</key>
+	<integer>6</integer>
+	<key>Sheets</key>
+	<array>
+		<dict>
+			<key>SheetTitle</key>
+			<string>first</string>
+			<key>GraphicsList</key>
+			<array><dict><key>ID</key><integer>3</integer></dict></array>
+		</dict>
+		<dict/>
+		<dict>
+			<key>SheetTitle</key>
+			<string>third</string>
+		</dict>
+	</array>
+	<key>Trailer</key>
+	<real>1.5</real>
+</dict>
+</plist>"""
+
+    def testOnlyIndexesSheets(self):
+        doc = GraffleParser().walkGraffle(self.xmlstr, lazy=True)
+        self.assertEqual(doc["Trailer"], "1.5")
+        self.assertEqual(len(doc["Sheets"]), 3)
+        self.assertEqual(doc["Sheets"]._current, (None, None))
+
+    def testSheetsMatchEagerLoading(self):
+        eager = GraffleParser().walkGraffle(self.xmlstr)
+        doc = GraffleParser().walkGraffle(self.xmlstr, lazy=True)
+        self.assertEqual(list(doc["Sheets"]), eager["Sheets"])
+        self.assertEqual(doc["Sheets"][-1]["SheetTitle"], "third")
+
+    def testUnindexedSheetsAreLoaded(self):
+        eager = GraffleParser().walkGraffle(self.xmlstr)
+        variants = [self.xmlstr.replace("<key>Sheets</key>", "<key>Sheets</key><!-- pages -->"),
+                    self.xmlstr.replace("<array>\n\t\t<dict>", "<array >\n\t\t<dict>"),
+                    self.xmlstr.replace('encoding="UTF-8"', 'encoding="UTF-16"').encode("utf-16")]
+        for xmlstr in variants:
+            doc = GraffleParser().walkGraffle(xmlstr, lazy=True)
+            self.assertEqual(doc["Sheets"], eager["Sheets"])
+            self.assertEqual(doc["Sheets"][1], {})
+
+    def testExtractPage(self):
+        gi = GraffleInterpreter()
+        gi.setTarget(Mock())
+        gi.dict = GraffleParser().walkGraffle(self.xmlstr, lazy=True)
+        self.assertEqual(gi.getNumPages(), 3)
+
 class scope(dict):
     def __init__(self):
         self.appendScope=Mock()
@@ -115,6 +215,13 @@ class TestGraffleInterpreterBoundingBox(TestCase):
 		self.gi.iterateGraffleGraphics([{'Class':'LineGraphic', 'Points':['{0, 0}', '{756, 553}'], 'ID':5}])
 		self.assertTrue(any([ mthd_call[0]=='addPath' for mthd_call in self.MockTarget.method_calls]))
 
+	def testNormalizedGraphics(self):
+		self.gi.iterateGraffleGraphics([
+			{'Class':'LineGraphic', 'Points':((0., 0.), (756., 553.)), 'ID':5},
+			{'Class':'ShapedGraphic', 'Bounds':(0., 0., 756., 553.), 'Shape':'Rectangle', 'ID':6}])
+		self.MockTarget.addPath.assert_called_once_with(((0., 0.), (756., 553.)), id='5')
+		self.assertEqual(self.MockTarget.addRect.call_args[1]['width'], 756.)
+
 class TestTargetSvg(TestCase):
     def setUp(self):
         self.ts = TargetSvg()
@@ -140,10 +247,274 @@ class TestTargetSvg(TestCase):
         self.assertEqual(self.ts.style['marker-start'],'url(#Arrow1Lstart_808080_1.000000px)')
         self.assertTrue('Arrow1Lstart_808080_1.000000px' in self.ts.required_defs)
 
+    def testCssClasses(self):
+        ts = TargetSvg(css_classes=True)
+        for (n, fill) in enumerate(['#ff0000', '#00ff00', '#ff0000']):
+            ts.style.appendScope()
+            ts.style['fill'] = fill
+            ts.addRect(x=n, y=0, width=1, height=1, id=str(n))
+            ts.style.popScope()
+        ts.add_requirements()
+        rects = ts.svg_dom.getElementsByTagName('rect')
+        self.assertEqual([r.getAttribute('class') for r in rects], ['s1', 's2', 's1'])
+        self.assertFalse(any(r.hasAttribute('style') for r in rects))
+        style_tag = ts.svg_def.firstChild
+        self.assertEqual(style_tag.tagName, 'style')
+        self.assertTrue('.s1{fill:#ff0000}' in style_tag.firstChild.data)
+
+    def testRepeatedStyleIsCached(self):
+        for _ in range(3):
+            self.ts.style.appendScope()
+            self.ts.setGraffleStyle({'fill':{'Color':{'r':1,'g':0,'b':0}},'shadow':{'Draws':'YES'}})
+            self.assertEqual(self.ts.style['fill'],'#ff0000')
+            self.ts.style.popScope()
+        self.assertEqual((self.ts.style_cache.hits, self.ts.style_cache.misses), (2, 1))
+        self.assertTrue('DropShadow' in self.ts.required_defs)
+
+    def testCachedArrowFollowsInheritedStroke(self):
+        style = {'stroke':{'HeadArrow':"FilledArrow",'Draws':'YES','Color':{'r':0.5,'g':0.5,'b':0.5}}}
+        self.ts.setGraffleStyle(style)
+        self.ts.style.appendScope()
+        self.ts.style['stroke-width'] = '2.000000px'
+        self.ts.style.appendScope()
+        self.ts.setGraffleStyle(style)
+        self.assertEqual(self.ts.style['marker-end'],'url(#Arrow1Lend_808080_2.000000px)')
+        self.assertEqual(self.ts.style_cache.misses, 2)
+
+class TestOutputModes(TestCase):
+    def draw(self, target):
+        target.reset()
+        target.addRect(x=0, y=0, width=1, height=1, id="1")
+        target.addText(rtftext='{\\rtf1 a}', x=0, y=0, width=10, height=10, id=2)
+        target.finish()
+
+    def testCompact(self):
+        pretty, compact = TargetSvg(), TargetSvg(compact=True)
+        self.draw(pretty)
+        self.draw(compact)
+        self.assertFalse(b"\n" in compact.svg)
+        self.assertEqual(ET.tostring(ET.fromstring(compact.svg)),
+                         ET.tostring(ET.fromstring(pretty.svg.replace(b"\n", b"").replace(b"\t", b""))))
+
+    def testSvgz(self):
+        for cls in (TargetSvg, StreamingTargetSvg):
+            plain = cls()
+            self.draw(plain)
+            sink = io.BytesIO()
+            target = cls(compress_level=6)
+            target.sink = sink
+            self.draw(target)
+            self.assertFalse(sink.closed)
+            self.assertEqual(gzip.decompress(sink.getvalue()), plain.svg)
+            saved = io.BytesIO()
+            plain.compress_level = 1
+            plain.save(saved)
+            self.assertEqual(gzip.decompress(saved.getvalue()), plain.svg)
+
+    def testPrecision(self):
+        target = TargetSvg(precision=1)
+        target.addPath([[0.1 + 0.2, 10.], [100.04, 10.], [100.04, 5.]], id="1")
+        target.addRect(x=1/3., y=2, width=10.25, height=1, id="2")
+        path = target.svg_dom.getElementsByTagName('path')[0]
+        self.assertEqual(path.getAttribute('d'), "M.3 10H100V5")
+        rect = target.svg_dom.getElementsByTagName('rect')[0]
+        self.assertEqual([rect.getAttribute(k) for k in ('x', 'y', 'width')], ['0.3', '2', '10.2'])
+
+    def testCompactStream(self):
+        target = StreamingTargetSvg(compact=True)
+        self.draw(target)
+        self.assertFalse(b"\n" in target.svg)
+        ET.fromstring(target.svg)
+
+    def testCompactTemplates(self):
+        for cls in (TargetSvg, StreamingTargetSvg):
+            target = cls(compact=True)
+            target.reset()
+            target.setGraffleStyle({'stroke': {'HeadArrow': "FilledArrow"}, 'shadow': {'Draws': 'YES'}})
+            target.addPath([[0, 0], [10, 10]], id="1")
+            target.add_requirements()
+            target.finish()
+            self.assertTrue(b"<marker" in target.svg)
+            self.assertFalse(b"\n" in target.svg or b"\t" in target.svg or b">  " in target.svg)
+
+class TestReuseShapes(TestCase):
+    SVG = "{http://www.w3.org/2000/svg}"
+    HREF = "{http://www.w3.org/1999/xlink}href"
+
+    def draw(self, target):
+        target.reset()
+        target.addPath([[0., 0.], [10., 5.], [0., 10.]], closepath=True, id="1")
+        target.addRect(x=5, y=5, width=10, height=2, id="2")
+        target.addPath([[20.5, 1.], [30.5, 6.], [20.5, 11.]], closepath=True, id="3")
+        target.addRect(x=5, y=5, width=10, height=3, id="4")
+        target.finish()
+        return ET.fromstring(target.svg)
+
+    def testSecondCopyMakesADef(self):
+        svg = self.draw(TargetSvg(reuse_shapes=True))
+        (shape,) = svg.find(self.SVG + "defs")
+        self.assertEqual(shape.tag, self.SVG + "path")
+        uses = list(svg.iter(self.SVG + "use"))
+        self.assertEqual([u.get("id") for u in uses], ["1", "3"])
+        self.assertEqual([u.get(self.HREF) for u in uses], ["#" + shape.get("id")] * 2)
+        self.assertEqual((uses[1].get("x"), uses[1].get("y")), ("20.5", "1.0"))
+        # shapes drawn once stay as they are
+        self.assertEqual([r.get("id") for r in svg.iter(self.SVG + "rect")], ["2", "4"])
+
+    def testStreamed(self):
+        svg = self.draw(StreamingTargetSvg(reuse_shapes=True))
+        uses = [u for u in svg.iter(self.SVG + "use") if u.get("id")]
+        self.assertEqual([u.get("id") for u in uses], ["1", "2", "3", "4"])
+        self.assertEqual(len(set(u.get(self.HREF) for u in uses)), 3)
+        defs = svg.find(self.SVG + "defs")
+        self.assertEqual(sorted(e.tag for e in defs[1:]), [self.SVG + "path", self.SVG + "rect", self.SVG + "rect"])
+
+class TestMultiPage(TestCase):
+    SVG = "{http://www.w3.org/2000/svg}"
+
+    def setUp(self):
+        shadow = {"shadow": {"Draws": "YES"}}
+        self.doc = {"GraphDocumentVersion": 6, "Sheets": [sheet(100, "One", shadow), sheet(300, "Two", shadow)]}
+
+    def extract(self, target):
+        gi = GraffleInterpreter()
+        gi.setTarget(target)
+        gi.dict = self.doc
+        sink = io.BytesIO()
+        gi.writeDocument(sink)
+        return ET.fromstring(sink.getvalue())
+
+    def checkPages(self, svg):
+        self.assertEqual((svg.get("width"), svg.get("height")), ("300.0", "100.0"))
+        pages = svg.findall(self.SVG + "svg")
+        self.assertEqual([page.get("id") for page in pages], ["page0", "page1"])
+        self.assertEqual([page.get("display") for page in pages], [None, "none"])
+        self.assertEqual([page.get("width") for page in pages], ["100.0", "300.0"])
+        self.assertEqual([page.findtext(self.SVG + "title") for page in pages], ["One", "Two"])
+        # one shadow filter for both pages
+        self.assertEqual([e.get("id") for e in svg.iter(self.SVG + "filter")], ["DropShadow"])
+
+    def testDocument(self):
+        svg = self.extract(TargetSvg())
+        self.checkPages(svg)
+        ids = [e.get("id") for e in svg.iter(self.SVG + "ellipse")]
+        self.assertEqual(ids, ["page0-2", "page1-2"])
+
+    def testStreamed(self):
+        svg = self.extract(StreamingTargetSvg())
+        self.checkPages(svg)
+        drawings = [e.get("id") for e in svg.find(self.SVG + "defs") if e.tag == self.SVG + "g"]
+        uses = [page.find(self.SVG + "use") for page in svg.findall(self.SVG + "svg")]
+        self.assertEqual(["#" + d for d in drawings],
+                         [use.get("{http://www.w3.org/1999/xlink}href") for use in uses])
+
+class TestBounds(TestCase):
+    SVG = "{http://www.w3.org/2000/svg}"
+
+    def setUp(self):
+        group = [{"Class": "LineGraphic", "ID": 4, "Points": ["{40, 50}", "{60, 45}", "{55, 70}"]},
+                 {"Class": "ShapedGraphic", "ID": 5, "Shape": "Rectangle", "Bounds": "{{45, 30}, {10, 5}}"}]
+        sheet = {"BackgroundGraphic": {"Class": "SolidGraphic", "ID": 1, "Bounds": "{{0, 0}, {200, 100}}"},
+                 "GraphicsList": [{"Class": "ShapedGraphic", "ID": 2, "Shape": "Circle", "Bounds": "{{10, 20}, {4, 6}}"},
+                                  {"Class": "Group", "ID": 3, "Graphics": group}]}
+        self.doc = {"GraphDocumentVersion": 6, "Sheets": [sheet]}
+
+    def extract(self, target):
+        gi = GraffleInterpreter()
+        gi.setTarget(target)
+        gi.dict = self.doc
+        gi.extractPage()
+        return target
+
+    def testGraphics(self):
+        target = self.extract(TargetSvg())
+        self.assertEqual(target.graphic_bounds["2"], (10., 20., 14., 26.))
+        self.assertEqual(target.graphic_bounds["4"], (40., 45., 60., 70.))
+        self.assertEqual(target.graphic_bounds["3"], (40., 30., 60., 70.))
+        self.assertEqual(target.svg_bounds, (10., 20., 60., 70.))
+
+    def testStreamedKeepsOnlyPageBounds(self):
+        target = self.extract(StreamingTargetSvg())
+        self.assertEqual(target.graphic_bounds, None)
+        self.assertEqual(target.svg_bounds, (10., 20., 60., 70.))
+        target = self.extract(StreamingTargetSvg(graphic_bounds=True))
+        self.assertEqual(target.graphic_bounds["3"], (40., 30., 60., 70.))
+        self.assertEqual(self.extract(TargetSvg(graphic_bounds=False)).graphic_bounds, None)
+
+    def testTight(self):
+        svg = ET.fromstring(self.extract(TargetSvg(tight=True)).svg)
+        self.assertEqual((svg.get("width"), svg.get("height"), svg.get("viewBox")),
+                         ("50.0", "50.0", "0 0 50.0 50.0"))
+        self.assertRaises(ValueError, StreamingTargetSvg, tight=True)
+
+class TestStreamingTargetSvg(TestCase):
+    SVG = "{http://www.w3.org/2000/svg}"
+
+    def draw(self, target):
+        target.reset()
+        target.setDocumentSize(100.0, 50.0)
+        target.style.appendScope()
+        target.setGraffleStyle({'stroke':{'HeadArrow':"StickArrow"}, 'shadow':{'Draws':'YES'}})
+        target.addRect(x=10, y=20, width=5, height=5, id="1")
+        target.style.popScope()
+        target.addEllipse([12., 30., 4., 6.], id="2")
+        target.addCloud([15., 25., 10., 10.], id="3")
+        target.addText(rtftext='{\\rtf1 a < "b"\\\n\\b c}', x=10, y=20, width=30, height=10, id=4)
+        target.add_requirements()
+        target.add_document_bounds()
+        target.finish()
+
+    def canon(self, element):
+        return (element.tag, sorted(element.attrib.items()), (element.text or "").strip(),
+                [self.canon(child) for child in element])
+
+    def testSameElements(self):
+        dom_target = TargetSvg()
+        self.draw(dom_target)
+        dom = ET.fromstring(dom_target.svg)
+        sink = io.BytesIO()
+        self.draw(StreamingTargetSvg(sink))
+        self.assertFalse(sink.closed)
+        streamed = ET.fromstring(sink.getvalue())
+        self.assertEqual(streamed.attrib, dom.attrib)
+        defs = streamed.find(self.SVG + "defs")
+        (page, *required) = list(defs)
+        graphroot = dom.find(self.SVG + "g")
+        self.assertEqual(self.canon(page)[3], self.canon(graphroot)[3])
+        self.assertEqual([self.canon(e) for e in required],
+                         [self.canon(e) for e in dom.find(self.SVG + "defs")])
+        use = streamed.find(self.SVG + "use")
+        self.assertEqual(use.get("transform"), graphroot.get("transform"))
+        self.assertEqual(use.get("{http://www.w3.org/1999/xlink}href"), "#" + page.get("id"))
+
+    def testIndentsFirstElement(self):
+        target = StreamingTargetSvg()
+        target.reset()
+        target.addEllipse([12., 30., 4., 6.], id="1")
+        target.addEllipse([22., 30., 4., 6.], id="2")
+        target.finish()
+        lines = [line for line in target.svg.decode("utf-8").split("\n") if "<ellipse" in line]
+        self.assertEqual([line[:line.index("<")] for line in lines], ["\t" * 4] * 2)
+
+    def testDropsElementsBeforeReset(self):
+        target = StreamingTargetSvg()
+        target.addRect(x=0, y=0, width=1, height=1, id="background")
+        target.reset()
+        target.addRect(x=0, y=0, width=1, height=1, id="shown")
+        target.finish()
+        ids = [e.get("id") for e in ET.fromstring(target.svg).iter(self.SVG + "rect")]
+        self.assertEqual(ids, ["shown"])
+
 def get_tests():
     TS = TestSuite()
     TS.addTest(makeSuite(TestMkHex))
     TS.addTest(makeSuite(TestGraffleParser))
+    TS.addTest(makeSuite(TestLazySheets))
     TS.addTest(makeSuite(TestGraffleInterpreterBoundingBox))
     TS.addTest(makeSuite(TestTargetSvg))
+    TS.addTest(makeSuite(TestStreamingTargetSvg))
+    TS.addTest(makeSuite(TestOutputModes))
+    TS.addTest(makeSuite(TestReuseShapes))
+    TS.addTest(makeSuite(TestMultiPage))
+    TS.addTest(makeSuite(TestBounds))
     return TS
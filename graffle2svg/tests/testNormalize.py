@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2023 Robin Vobruba <hoijui.quaero@gmail.com>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+from unittest import makeSuite, TestCase, TestSuite
+
+import normalize
+
+class TestParse(TestCase):
+    def testBounds(self):
+        self.assertEqual(normalize.parseNumbers("{{0, -1.5}, {756, 553}}"), (0., -1.5, 756., 553.))
+
+    def testExponent(self):
+        self.assertEqual(normalize.parseNumbers("{1e-05, .5}"), (1e-05, .5))
+
+    def testPoints(self):
+        points = normalize.parsePoints(["{0, 0}", "{756, -5.5e1}"])
+        self.assertEqual(list(points.coords), [0., 0., 756., -55.])
+        self.assertEqual(points, ((0., 0.), (756., -55.)))
+
+    def testPointsNotPairs(self):
+        self.assertEqual(normalize.parsePoints(["{0, 0, 1}", "{2}"]), ((0., 0., 1.), (2.,)))
+
+class TestNormalizeDocument(TestCase):
+    def testSheets(self):
+        line = {"Class": "LineGraphic", "Points": ["{0, 1}", "{2, 3}"]}
+        shape = {"Class": "ShapedGraphic", "Bounds": "{{1, 2}, {3, 4}}", "Magnets": ["{0, 0.5}"]}
+        group = {"Class": "Group", "Graphics": [shape]}
+        doc = {"Sheets": [{"CanvasOrigin": "{0, 0}",
+                           "BackgroundGraphic": {"Bounds": "{{0, 0}, {10, 10}}"},
+                           "GraphicsList": [line, group]}]}
+        normalize.normalizeDocument(doc)
+        sheet = doc["Sheets"][0]
+        self.assertEqual(sheet["CanvasOrigin"], (0., 0.))
+        self.assertEqual(sheet["BackgroundGraphic"]["Bounds"], (0., 0., 10., 10.))
+        self.assertEqual(line["Points"], ((0., 1.), (2., 3.)))
+        self.assertEqual(shape["Bounds"], (1., 2., 3., 4.))
+        self.assertEqual(shape["Magnets"], ((0., .5),))
+
+    def testIdempotent(self):
+        doc = {"GraphicsList": [{"Bounds": "{{1, 2}, {3, 4}}"}]}
+        normalize.normalizeDocument(doc)
+        normalize.normalizeDocument(doc)
+        self.assertEqual(doc["GraphicsList"][0]["Bounds"], (1., 2., 3., 4.))
+
+def get_tests():
+    TS = TestSuite()
+    TS.addTest(makeSuite(TestParse))
+    TS.addTest(makeSuite(TestNormalizeDocument))
+    return TS
@@ -4,7 +4,7 @@
 
 from unittest import makeSuite, TestCase, TestSuite
 
-from rtf import extractRTFString, ColorTable
+from rtf import extractRTFString, ColorTable, RTFCache
 
 class TestRTF(TestCase):
     """Tests with valid RTF"""
@@ -44,6 +44,21 @@ ree of charge, to any person ob\
 \fs24 \uc0\u916}""")
         self.assertEqual(lines[0]['string'],u'\u0394')
 
+    def testhexescape(self):
+        lines = extractRTFString(r"{\rtf1\ansi\ansicpg1252 caf\'e9 cr\'e8me}")
+        self.assertEqual(lines[0]['string'], u'caf\u00e9 cr\u00e8me')
+
+    def testfontnumbers(self):
+        lines = extractRTFString(r"""{\rtf1\ansi
+{\fonttbl\f0\fswiss\fcharset0 Helvetica;\f1\fnil\fcharset0 Monaco;\f12\froman\fcharset0 Times;}
+\f12\fs24 one\
+\f0 two}""")
+        self.assertEqual([line['style']['font-family'] for line in lines], ["Times,Serif", "Helvetica,Sans-serif"])
+
+    def testnestedgroups(self):
+        lines = extractRTFString(r"{\rtf1\ansi{\*\expandedcolortbl;;} outer}")
+        self.assertEqual([line['string'] for line in lines], [" outer"])
+
 def testcomplexunicode(self):
         lines = extractRTFString(r""""{\rtf1\ansi\ansicpg1252\cocoartf949\cocoasubrtf540
 \fs24 \uc0\u916
@@ -58,8 +73,38 @@ class TestColorTable(TestCase):
         self.assertEqual(colors[1], "ffffff")
         self.assertEqual(colors[2], "4b4b4b")
 
+    def testTableBody(self):
+        colors = ColorTable()
+        colors.parseTable(r';\red255\green0\blue0;')
+        self.assertEqual(colors.color, ["000000", "ff0000"])
+
+class TestRTFCache(TestCase):
+    def testHitsAndMisses(self):
+        cache = RTFCache()
+        first = cache.extract(r"{\rtf1\ansi\fs10 DB}")
+        self.assertTrue(cache.extract(r"{\rtf1\ansi\fs10 DB}") is first)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(first[0]["string"], "DB")
+        self.assertEqual(dict(first[0]["style"]), {"font-size": "5.0px"})
+
+    def testReadOnly(self):
+        lines = RTFCache().extract(r"{\rtf1\ansi\fs10 DB}")
+        with self.assertRaises(TypeError):
+            lines[0]["style"]["font-size"] = "1px"
+        with self.assertRaises(TypeError):
+            lines[0]["string"] = ""
+
+    def testLeastRecentlyUsedDropped(self):
+        cache = RTFCache(max_size=2)
+        for label in ("a", "b", "a", "c", "a", "b"):
+            cache.extract(r"{\rtf1 %s}" % label)
+        # b was dropped for c, and a was kept as it was used in between
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+        self.assertEqual(len(cache.lines), 2)
+
 def get_tests():
     TS = TestSuite()
     TS.addTest(makeSuite(TestRTF))
     TS.addTest(makeSuite(TestColorTable))
+    TS.addTest(makeSuite(TestRTFCache))
     return TS
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2023 Robin Vobruba <hoijui.quaero@gmail.com>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+import random
+from unittest import makeSuite, TestCase, TestSuite
+
+import spatial
+from spatial import GridIndex, SheetIndex
+
+def shape(ident, x, y, width=10., height=10.):
+    return {"Class": "ShapedGraphic", "ID": ident, "Bounds": (x, y, width, height)}
+
+class TestSheetIndex(TestCase):
+    def setUp(self):
+        self.group = {"Class": "Group", "ID": 3,
+                      "Graphics": [shape(4, 100, 100), shape(5, 150, 120)]}
+        self.line = {"Class": "LineGraphic", "ID": 6, "Points": ((0., 50.), (30., 60.))}
+        self.graphics = [shape(1, 0, 0), shape(2, 40, 0), self.group, self.line]
+        self.index = SheetIndex({"GraphicsList": self.graphics})
+
+    def ids(self, graphics):
+        return [g["ID"] for g in graphics]
+
+    def testGroupExtent(self):
+        self.assertEqual(self.index.extent(self.group), (100., 100., 160., 130.))
+        self.assertEqual(self.index.extent(self.line), (0., 50., 30., 60.))
+
+    def testQueryKeepsOrder(self):
+        self.assertEqual(self.ids(self.index.query(self.graphics, ((-5, -5), (45, 55)))), [1, 2, 6])
+        # corners in any order
+        self.assertEqual(self.ids(self.index.query(self.graphics, ((45, 55), (-5, -5)))), [1, 2, 6])
+
+    def testGroupPrunedAsAWhole(self):
+        self.assertEqual(self.ids(self.index.query(self.graphics, ((200, 200), (300, 300)))), [])
+        found = self.index.query(self.graphics, ((140, 110), (170, 140)))
+        self.assertEqual(self.ids(found), [3])
+        self.assertEqual(self.ids(self.index.query(self.group["Graphics"], ((140, 110), (170, 140)))), [5])
+
+    def testWithoutGeometryAlwaysFound(self):
+        unknown = {"Class": "Group", "ID": 7, "Graphics": [{"Class": "Unknown", "ID": 8}]}
+        self.graphics.append(unknown)
+        self.assertEqual(self.ids(self.index.query(self.graphics, ((500, 500), (600, 600)))), [7])
+
+    def testGridMatchesScan(self):
+        random.seed(3)
+        graphics = [shape(i, random.uniform(0, 1000), random.uniform(0, 1000),
+                          random.uniform(1, 300), random.uniform(1, 30))
+                    for i in range(500)]
+        index = SheetIndex({"GraphicsList": graphics})
+        for _ in range(50):
+            x, y = random.uniform(-100, 1100), random.uniform(-100, 1100)
+            box = ((x, y), (x + random.uniform(0, 200), y + random.uniform(0, 200)))
+            area = spatial.normalizeBox(box)
+            expected = [g for g in graphics if spatial.intersects(index.extent(g), area)]
+            self.assertEqual(index.query(graphics, box), expected)
+
+class TestGridIndex(TestCase):
+    def testNoExtents(self):
+        grid = GridIndex([None, None])
+        self.assertEqual(grid.candidates((0, 0, 1, 1)), [0, 1])
+
+def get_tests():
+    TS = TestSuite()
+    TS.addTest(makeSuite(TestSheetIndex))
+    TS.addTest(makeSuite(TestGridIndex))
+    return TS
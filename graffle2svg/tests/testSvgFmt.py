@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2023 Robin Vobruba <hoijui.quaero@gmail.com>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+import random
+import re
+from unittest import makeSuite, TestCase, TestSuite
+
+from svgfmt import formatNumber, pathData
+
+PATH_TOKEN = re.compile(r"[MLHVlhvz]|-?(?:\d+\.?\d*|\.\d+)")
+
+def pathPoints(d):
+    """The points of a polyline written by pathData"""
+    points = []
+    tokens = PATH_TOKEN.findall(d)
+    command = None
+    i = 0
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            command = tokens[i]
+            i += 1
+            if command == "z":
+                continue
+        (x, y) = points[-1] if points else (0., 0.)
+        if command in "MLl":
+            (a, b) = (float(tokens[i]), float(tokens[i + 1]))
+            i += 2
+            points.append((x + a, y + b) if command == "l" else (a, b))
+            if command == "M":
+                command = "L"
+        else:
+            v = float(tokens[i])
+            i += 1
+            points.append({"H": (v, y), "h": (x + v, y), "V": (x, v), "v": (x, y + v)}[command])
+    return points
+
+class TestFormatNumber(TestCase):
+    def testRounds(self):
+        self.assertEqual(formatNumber(100.00000000000001, 2), "100")
+        self.assertEqual(formatNumber(3.14159, 3), "3.142")
+        self.assertEqual(formatNumber(-0.5, 1), "-0.5")
+        self.assertEqual(formatNumber(-0.001, 2), "0")
+        self.assertEqual(formatNumber("12", 0), "12")
+
+class TestPathData(TestCase):
+    def testOrthogonal(self):
+        d = pathData([(100.00000000000001, 50.), (200., 50.), (200., 80.5), (150.25, 30.)], 2, True)
+        self.assertEqual(d, "M100 50H200V80.5L150.25 30z")
+
+    def testSeparators(self):
+        self.assertEqual(pathData([(0.5, 0.5), (0.25, 0.75), (-1., -1.)], 2), "M.5.5.25.75-1-1")
+
+    def testRoundTrip(self):
+        rand = random.Random(3)
+        for _ in range(200):
+            points = [(rand.choice([0., 10., 10.5]) + rand.uniform(-500, 500) * rand.random(),
+                       rand.choice([0., -3.25]) + rand.uniform(-500, 500) * rand.random())
+                      for _ in range(rand.randint(1, 8))]
+            for precision in (0, 2):
+                expected = [(round(x, precision), round(y, precision)) for (x, y) in points]
+                found = pathPoints(pathData(points, precision))
+                self.assertEqual(len(found), len(expected))
+                for (a, b) in zip(found, expected):
+                    self.assertAlmostEqual(a[0], b[0], places=6)
+                    self.assertAlmostEqual(a[1], b[1], places=6)
+
+def get_tests():
+    TS = TestSuite()
+    TS.addTest(makeSuite(TestFormatNumber))
+    TS.addTest(makeSuite(TestPathData))
+    return TS
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2023 Robin Vobruba <hoijui.quaero@gmail.com>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""Event driven loader for Apple's XML property lists"""
+
+import base64
+import datetime
+import re
+import xml.parsers.expat
+
+# elements whose text content is the value
+SCALARS = frozenset(("string", "real", "integer", "date", "data"))
+
+# where the sheets of a multi-page document may start
+SHEETS_START = re.compile(rb"<key>Sheets</key>\s*<array>")
+# the tags that delimit the sheets
+SHEET_TAGS = re.compile(rb"<(/?)(?:dict|array)\s*(/?)>")
+
+class PlistBuilder(object):
+	"""Builds the dict/array/string tree of a plist in a single pass
+	   over the expat events.
+
+	   typed -- convert integer, real, date and data values the way
+	            plistlib does, instead of keeping their text
+	   lazy  -- only remember where each entry of the top level "Sheets"
+	            array is, see LazySheets"""
+
+	def __init__(self, typed=False, lazy=False):
+		self.root = None
+		self.typed = typed
+		self.lazy = lazy
+		# containers currently open, innermost last
+		self._stack = []
+		# the pending <key> of every open container (None for arrays)
+		self._keys = []
+		self._text = None
+		# the LazySheets of the Sheets array while it is being indexed
+		self._sheet_ranges = None
+		# whether skipSheets is feeding up to what looks like the Sheets
+		# array, only then will it index the sheets
+		self._indexing = False
+		self._parser = xml.parsers.expat.ParserCreate()
+		self._parser.buffer_text = True
+		self._parser.StartElementHandler = self.startElement
+		self._parser.EndElementHandler = self.endElement
+		self._parser.CharacterDataHandler = self.characters
+
+	def parse(self, data):
+		"""data can be str or bytes (bytes only in lazy mode)"""
+		fed = 0
+		if self.lazy:
+			fed = self.skipSheets(data)
+		self._parser.Parse(data[fed:], True)
+		return self.root
+
+	def skipSheets(self, data):
+		"""Feed the parser up to the top level Sheets array, index the
+		   sheets without handing them to expat at all, and return where
+		   the parsing has to go on from."""
+		fed = 0
+		match = SHEETS_START.search(data)
+		while match is not None:
+			self._indexing = True
+			try:
+				self._parser.Parse(data[fed:match.end()], False)
+			finally:
+				self._indexing = False
+			fed = match.end()
+			if self._sheet_ranges is not None:
+				self._sheet_ranges.data = data
+				return self.indexSheets(data, fed)
+			# a nested Sheets key, not the document's
+			match = SHEETS_START.search(data, fed)
+		return fed
+
+	def indexSheets(self, data, pos):
+		"""Record the range of every sheet from pos up to the </array>
+		   closing Sheets, and return the position of that </array>"""
+		ranges = self._sheet_ranges.ranges
+		depth = 0
+		start = None
+		for tag in SHEET_TAGS.finditer(data, pos):
+			closing, empty = tag.groups()
+			if empty:
+				if depth == 0:
+					ranges.append((tag.start(), tag.end()))
+			elif closing:
+				if depth == 0:
+					return tag.start()
+				depth -= 1
+				if depth == 0:
+					ranges.append((start, tag.end()))
+			else:
+				if depth == 0:
+					start = tag.start()
+				depth += 1
+		return len(data)
+
+	def parseFile(self, fp):
+		"""read and parse a binary file object chunk by chunk"""
+		self._parser.ParseFile(fp)
+		return self.root
+
+	def startElement(self, name, attrs):
+		if name == "dict":
+			self._stack.append({})
+			self._keys.append(None)
+		elif name == "array":
+			self.startArray()
+		elif name == "key" or name in SCALARS:
+			self._text = []
+
+	def endElement(self, name):
+		if name == "key":
+			self._keys[-1] = "".join(self._text)
+			self._text = None
+		elif name in SCALARS:
+			text = "".join(self._text)
+			self._text = None
+			if self.typed:
+				self.addValue(self.convert(name, text))
+			else:
+				self.addValue(text)
+		elif name == "dict" or name == "array":
+			if self._sheet_ranges is not None \
+					and self._stack[-1] is self._sheet_ranges.ranges:
+				self._keys.pop()
+				self._stack.pop()
+				self.addValue(self._sheet_ranges)
+				self._sheet_ranges = None
+				return
+			self._keys.pop()
+			value = self._stack.pop()
+			if self._stack:
+				self.addValue(value)
+			elif name == "dict":
+				self.root = value
+		elif name == "true":
+			self.addValue(True)
+		elif name == "false":
+			self.addValue(False)
+
+	def startArray(self):
+		if self._indexing and len(self._stack) == 1 and self._keys[0] == "Sheets":
+			# the sheets are recorded by their position in the input only
+			self._sheet_ranges = LazySheets(None, typed=self.typed)
+			self._stack.append(self._sheet_ranges.ranges)
+		else:
+			self._stack.append([])
+		self._keys.append(None)
+
+	def convert(self, name, text):
+		"""plistlib's types for the scalar elements"""
+		if name == "integer":
+			return int(text, 0) if text[:2] in ("0x", "0X") else int(text)
+		elif name == "real":
+			return float(text)
+		elif name == "date":
+			return datetime.datetime.strptime(text, "%Y-%m-%dT%H:%M:%SZ")
+		elif name == "data":
+			return base64.b64decode(text.encode("ascii"))
+		return text
+
+	def characters(self, data):
+		if self._text is not None:
+			self._text.append(data)
+
+	def addValue(self, value):
+		if not self._stack:
+			return
+		container = self._stack[-1]
+		if type(container) is dict:
+			container[self._keys[-1]] = value
+		else:
+			container.append(value)
+
+class LazySheets(object):
+	"""Stands in for the "Sheets" array of a document: only the byte range
+	   of every sheet in the (decompressed) plist is known, and a sheet is
+	   parsed when it is asked for."""
+
+	def __init__(self, data, typed=False):
+		self.data = data
+		self.typed = typed
+		# (start, end) of every Sheets[i] in data
+		self.ranges = []
+		# called with every sheet once it is parsed
+		self.onLoad = None
+		# the most recently parsed sheet, as (index, dict)
+		self._current = (None, None)
+
+	def __len__(self):
+		return len(self.ranges)
+
+	def __getitem__(self, i):
+		if i < 0:
+			i += len(self.ranges)
+		if self._current[0] != i:
+			start, end = self.ranges[i]
+			sheet = PlistBuilder(typed=self.typed).parse(self.data[start:end])
+			if self.onLoad is not None:
+				self.onLoad(sheet)
+			self._current = (i, sheet)
+		return self._current[1]
+
+	def __iter__(self):
+		for i in range(len(self.ranges)):
+			yield self[i]
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state["_current"] = (None, None)
+		return state
+
+def loads(data, typed=False, lazy=False):
+	"""Return the top level dict of the plist in data"""
+	if lazy and isinstance(data, str):
+		# the sheet index is made of byte offsets
+		data = data.encode("utf-8")
+	return PlistBuilder(typed=typed, lazy=lazy).parse(data)
+
+def load(fp, typed=False, lazy=False):
+	"""Return the top level dict of the plist read from fp"""
+	if lazy:
+		return loads(fp.read(), typed=typed, lazy=True)
+	return PlistBuilder(typed=typed).parseFile(fp)
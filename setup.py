@@ -31,6 +31,10 @@ Convert omnigraffle files to svg images""",
       install_requires=[
           # -*- Extra requirements: -*-
       ],
+      extras_require={
+          # transforms long point lists faster
+          "numpy": ["numpy"],
+      },
       entry_points="""
       # -*- Entry points: -*-
       """,